@@ -5,46 +5,46 @@
 # ===================================================================
 
 import os
-import argparse
+import sys
 import numpy as np
 import json
-from prody import *
 from datetime import datetime
-from scipy.stats import pearsonr
-
-# --- Bloque de Importación para Reportes PDF ---
-try:
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.units import inch
-    from reportlab.lib import colors
-    from reportlab.platypus import Paragraph
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    REPORTLAB_DISPONIBLE = True
-except ImportError:
-    REPORTLAB_DISPONIBLE = False
+from vally_io import leer_calpha
+from vally_profiling import PerfilEtapas, PerfilNulo, formatear
+# ProDy, SciPy y ReportLab se importan dentro de cada paso: `--help` y los
+# subcomandos que no los necesitan no pagan su tiempo de carga.
+
+PROTEINAS = {
+    "2fom": {"nombre": "Proteasa Dengue (NS2B/NS3)", "clave": [51, 75, 133, 135, 153]},
+    "6lu7": {"nombre": "Proteasa SARS-CoV-2 (Mpro)", "clave": [41, 145, 166, 189]}
+}
 
 # --- 1. Módulos de Análisis y Validación ---
 
-def calcular_y_guardar_anm(pdb_path, pdb_id):
+def calcular_y_guardar_anm(pdb_path, pdb_id, solver='auto', perfil=None):
     print(f"\n--- PASO 1: Iniciando análisis ENM para {pdb_id} ---")
+    perfil = perfil or PerfilNulo()
     try:
-        full_structure = parsePDB(pdb_path)
-        protein_ca = full_structure.select('protein and name CA')
+        with perfil.etapa('parse'):
+            protein_ca = leer_calpha(pdb_path)
         if protein_ca is None or protein_ca.numAtoms() == 0:
             print("ERROR: No se encontraron Carbonos Alfa.")
             return None, None
         
-        anm = ANM(f'{pdb_id} ANM')
-        anm.buildHessian(protein_ca)
-        anm.calcModes(n_modes=20)
+        from vally_solver import calcular_modos
+        anm, info_solver = calcular_modos(protein_ca, n_modes=20, solver=solver, nombre=f'{pdb_id} ANM',
+                                          perfil=perfil)
         print(f"Modelo ANM calculado exitosamente con {protein_ca.numAtoms()} Cα.")
+        print(f"Solver: {info_solver['solver']}/{info_solver['metodo']} | residuo max = {info_solver['residuo_max']:.2e} "
+              f"| caché: {info_solver['cache']}")
         return anm, protein_ca
     except Exception as e:
         print(f"ERROR CRÍTICO: {e}")
         return None, None
 
 def validar_con_datos_experimentales(anm_model, protein_ca):
+    from prody import calcSqFlucts
+    from scipy.stats import pearsonr
     print("\n--- PASO 2: Validando contra B-factors Experimentales ---")
     b_factors_exp = protein_ca.getBetas()
     sq_flucts_calc = calcSqFlucts(anm_model)
@@ -53,6 +53,7 @@ def validar_con_datos_experimentales(anm_model, protein_ca):
     return r_coef
 
 def predecir_con_ia_simulada(anm_model, protein_ca, residuos_clave_nums):
+    from prody import calcSqFlucts
     print("\n--- PASO 3: Ejecutando el predictor de impacto dinámico ---")
     modos_relevantes = anm_model[:3] 
     sq_flucts = calcSqFlucts(modos_relevantes)
@@ -79,7 +80,12 @@ def predecir_con_ia_simulada(anm_model, protein_ca, residuos_clave_nums):
 # --- 2. Módulos de Salida de Datos (PDF y JSON) ---
 
 def generar_reporte_pdf(pdb_id, afinidad, top_residuos, nombre_proteina, r_val, directorio_proyecto):
-    if not REPORTLAB_DISPONIBLE:
+    try:
+        from reportlab.pdfgen import canvas
+        from reportlab.lib.pagesizes import letter
+        from reportlab.lib.units import inch
+        from reportlab.lib import colors
+    except ImportError:
         print("\nADVERTENCIA: Instala 'reportlab' para generar el PDF.")
         return
 
@@ -136,13 +142,8 @@ def generar_reporte_pdf(pdb_id, afinidad, top_residuos, nombre_proteina, r_val,
     c.save()
     print(f"¡Reporte PDF generado exitosamente!")
 
-def generar_reporte_json(pdb_id, afinidad, top_residuos, r_val, directorio_proyecto):
-    """
-    Exporta los resultados en formato JSON para integración con APIs o Dashboards.
-    """
-    reportes_folder = os.path.join(directorio_proyecto, "reportes")
-    os.makedirs(reportes_folder, exist_ok=True)
-    
+def datos_reporte_json(pdb_id, afinidad, top_residuos, r_val, perfil=None):
+    """Contenido del reporte JSON (mismo esquema en archivo y en el servicio HTTP de vally_servicio)."""
     datos = {
         "metadata": {
             "application": "VALLY-Scan",
@@ -160,6 +161,19 @@ def generar_reporte_json(pdb_id, afinidad, top_residuos, r_val, directorio_proye
             "critical_allosteric_residues": top_residuos
         }
     }
+    if perfil is not None:
+        datos["performance"] = perfil
+    return datos
+
+def generar_reporte_json(pdb_id, afinidad, top_residuos, r_val, directorio_proyecto, perfil=None):
+    """
+    Exporta los resultados en formato JSON para integración con APIs o Dashboards.
+    `perfil` (PerfilEtapas.resumen()) añade tiempo, CPU y memoria por etapa.
+    """
+    reportes_folder = os.path.join(directorio_proyecto, "reportes")
+    os.makedirs(reportes_folder, exist_ok=True)
+    
+    datos = datos_reporte_json(pdb_id, afinidad, top_residuos, r_val, perfil)
     
     json_path = os.path.join(reportes_folder, f"analysis_{pdb_id}.json")
     with open(json_path, 'w') as f:
@@ -168,43 +182,58 @@ def generar_reporte_json(pdb_id, afinidad, top_residuos, r_val, directorio_proye
 
 # --- 3. Lógica Principal ---
 
-def main():
-    parser = argparse.ArgumentParser(description="VALLY-Scan v1.6: Análisis con Validación y Salida API.")
-    parser.add_argument("--pdb_id", type=str, required=True, help="ID PDB (ej: 6lu7)")
-    parser.add_argument("--reporte", action="store_true", help="Generar reportes PDF y JSON.")
-    args = parser.parse_args()
-    
-    pdb_id = args.pdb_id.lower()
-    directorio = os.getcwd()
-    pdb_path = os.path.join(directorio, "data", f"{pdb_id}.pdb")
+def resolver_ruta_pdb(pdb_id, directorio):
+    """Ruta directa o data/<id>.pdb sin distinguir mayúsculas (el repositorio trae 6LU7.pdb y 2fom.pdb)."""
+    if os.path.isfile(pdb_id):
+        return pdb_id
+    pdb_id = os.path.splitext(os.path.basename(pdb_id))[0].lower()
+    carpeta = os.path.join(directorio, "data")
+    if os.path.isdir(carpeta):
+        for nombre in os.listdir(carpeta):
+            if nombre.lower() == f"{pdb_id}.pdb":
+                return os.path.join(carpeta, nombre)
+    return os.path.join(carpeta, f"{pdb_id}.pdb")
+
+def ejecutar_validacion(pdb_id, reporte=False, solver='auto', directorio=None):
+    """Flujo técnico v1.6: ANM -> validación B-factors -> predicción -> PDF/JSON opcionales."""
+    directorio = directorio or os.getcwd()
+    pdb_path = resolver_ruta_pdb(pdb_id, directorio)
+    pdb_id = os.path.splitext(os.path.basename(pdb_id))[0].lower()
 
     if not os.path.exists(pdb_path):
         print(f"ERROR: No existe {pdb_path}. Verifica que esté en la carpeta 'data'.")
-        return
-
-    PROTEINAS = {
-        "2fom": {"nombre": "Proteasa Dengue (NS2B/NS3)", "clave": [51, 75, 133, 135, 153]},
-        "6lu7": {"nombre": "Proteasa SARS-CoV-2 (Mpro)", "clave": [41, 145, 166, 189]}
-    }
+        return None
 
     info = PROTEINAS.get(pdb_id, {"nombre": "Proteína Desconocida", "clave": []})
 
-    # FLUJO TÉCNICO:
-    anm, protein_ca = calcular_y_guardar_anm(pdb_path, pdb_id)
+    # FLUJO TÉCNICO (cada paso queda medido en el perfil):
+    perfil = PerfilEtapas(pdb_id)
+    anm, protein_ca = calcular_y_guardar_anm(pdb_path, pdb_id, solver, perfil)
     
     if anm and protein_ca:
-        r_val = validar_con_datos_experimentales(anm, protein_ca)
-        afinidad, top_res = predecir_con_ia_simulada(anm, protein_ca, info["clave"])
+        with perfil.etapa('validacion'):
+            r_val = validar_con_datos_experimentales(anm, protein_ca)
+        with perfil.etapa('hotspots'):
+            afinidad, top_res = predecir_con_ia_simulada(anm, protein_ca, info["clave"])
         
         print("\n" + "="*45); print(" RESULTADOS VALLY-SCAN v1.6"); print("="*45)
         print(f"Estructura: {pdb_id.upper()} | Pearson r: {r_val:.2f}")
         print(f"Afinidad Predicha: {afinidad:.2f} kcal/mol")
         print("Residuos Críticos:", ", ".join(top_res[:3]))
+        print("Perfil:", formatear(perfil.resumen()))
         print("="*45)
         
-        if args.reporte:
-            generar_reporte_pdf(pdb_id, afinidad, top_res, info["nombre"], r_val, directorio)
-            generar_reporte_json(pdb_id, afinidad, top_res, r_val, directorio)
+        if reporte:
+            with perfil.etapa('render'):
+                generar_reporte_pdf(pdb_id, afinidad, top_res, info["nombre"], r_val, directorio)
+            generar_reporte_json(pdb_id, afinidad, top_res, r_val, directorio, perfil.resumen())
+        return r_val, afinidad, top_res
+    return None
+
+def main(argv=None):
+    """Entrada heredada: equivale a `python vally.py validate ...`."""
+    from vally import main as vally_main
+    return vally_main(['validate'] + list(sys.argv[1:] if argv is None else argv))
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -1,9 +1,6 @@
 import numpy as np
-import pandas as pd
-from prody import *
-import matplotlib.pyplot as plt
-from scipy.spatial.distance import cdist
-from scipy.stats import pearsonr
+import os
+# pandas, ProDy, matplotlib y SciPy se importan dentro de cada función
 
 """
 VALLY-Scan v1.6 (Summit Edition 2026)
@@ -14,17 +11,63 @@ Metodología: Triple Factor de Validación
 3. Validación Cristalográfica (B-Factors)
 """
 
+def exclusion_alosterica(coords, resnums, msf, sitios_activos, umbrales_distancia=15.0, percentil=85):
+    """
+    Factor 2 en bloque para varias definiciones de sitio activo y varios umbrales.
+    Una sola consulta de distancias (N residuos × todos los Cα activos) sustituye
+    al bucle residuo a residuo.
+
+    Devuelve (mascaras [sitios, umbrales, N], distancia_minima [sitios, N]).
+    Un sitio sin ninguno de sus residuos en la estructura queda a distancia
+    inf y con la máscara vacía: no hay nada de lo que estar lejos.
+    """
+    from scipy.spatial.distance import cdist
+    coords = np.asarray(coords, dtype=float)
+    umbrales = np.atleast_1d(np.asarray(umbrales_distancia, dtype=float))
+
+    # Mapa resnum -> índice calculado una vez (primera aparición, como select('resnum X'))
+    unicos, primeros = np.unique(resnums, return_index=True)
+    indices_sitio = []
+    for sitio in sitios_activos:
+        sitio = np.asarray(sitio)
+        presentes = np.isin(sitio, unicos)
+        indices_sitio.append(primeros[np.searchsorted(unicos, sitio[presentes])])
+
+    distancias = np.full((len(indices_sitio), len(coords)), np.inf)
+    con_residuos = [k for k, idx in enumerate(indices_sitio) if len(idx)]
+    if con_residuos:
+        todos = np.concatenate([indices_sitio[k] for k in con_residuos])
+        inicios = np.cumsum([0] + [len(indices_sitio[k]) for k in con_residuos[:-1]])
+        matriz = cdist(coords, coords[todos])
+        distancias[con_residuos] = np.minimum.reduceat(matriz, inicios, axis=1).T
+
+    flexibles = msf >= np.percentile(msf, percentil)
+    mascaras = flexibles[None, None, :] & (distancias[:, None, :] > umbrales[None, :, None])
+    mascaras[[len(idx) == 0 for idx in indices_sitio]] = False
+    return mascaras, distancias
+
 def vally_triple_factor_analysis(pdb_file, active_site_residues):
+    """Triple Factor (ANM + exclusión alostérica + B-factors); devuelve (r, candidatos) o None si falla."""
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    from prody import parsePDB, calcSqFlucts
+    from scipy.stats import pearsonr
+    from vally_solver import calcular_modos
     print(f"\n=== Iniciando Análisis de Triple Factor: {pdb_file} ===")
     
     # --- FACTOR 1: Dinámica Física (ANM) ---
-    structure = parsePDB(pdb_file)
-    calpha = structure.select('protein and name CA')
-    anm = ANM(pdb_file)
-    anm.buildHessian(calpha)
-    anm.calcModes(n_modes=20)
+    try:
+        structure = parsePDB(pdb_file)
+        calpha = structure.select('protein and name CA') if structure is not None else None
+        if calpha is None:
+            print(f"ERROR: {pdb_file} no contiene carbonos alfa de proteína.")
+            return None
+        anm, _ = calcular_modos(calpha, n_modes=20, nombre=pdb_file)
+    except Exception as e:
+        print(f"ERROR: Falló el ANM de {pdb_file}: {e}")
+        return None
     
-    msf_predicted = anm.getMSFs()
+    msf_predicted = calcSqFlucts(anm)
     residues = calpha.getResnums()
     coords = calpha.getCoords()
     
@@ -37,29 +80,22 @@ def vally_triple_factor_analysis(pdb_file, active_site_residues):
     print(f"[VALIDACIÓN] Correlación con Cristalografía (Pearson r): {correlation:.2f}")
 
     # --- FACTOR 2: Heurística de Exclusión Alostérica ---
-    active_coords = []
-    for res_num in active_site_residues:
-        sel = calpha.select(f'resnum {res_num}')
-        if sel:
-            active_coords.append(sel.getCoords()[0])
-    active_coords = np.array(active_coords)
-
-    msf_threshold = np.percentile(msf_predicted, 85)
     dist_threshold = 15.0
+    mascaras, distancias = exclusion_alosterica(coords, residues, msf_predicted,
+                                                [active_site_residues], dist_threshold)
+    sel = mascaras[0, 0]
+    if np.isinf(distancias[0]).all():
+        print(f"[AVISO] Ningún residuo del sitio activo {list(active_site_residues)} está en {pdb_file}: "
+              "sin candidatos alostéricos.")
     
-    allosteric_results = []
-    for i in range(len(residues)):
-        min_dist = np.min(cdist(coords[i].reshape(1, -1), active_coords))
-        
-        # Filtro de Doble Factor: Mucha flexibilidad + Lejos del sitio activo
-        if msf_predicted[i] >= msf_threshold and min_dist > dist_threshold:
-            allosteric_results.append({
-                'Residuo': residues[i],
-                'Nombre': calpha[i].getResname(),
-                'MSF_Pred': round(msf_predicted[i], 4),
-                'B-Factor_Exp': round(b_factors_experimental[i], 2),
-                'Distancia_Activo': round(min_dist, 2)
-            })
+    # Filtro de Doble Factor: Mucha flexibilidad + Lejos del sitio activo
+    allosteric_results = {
+        'Residuo': residues[sel],
+        'Nombre': calpha.getResnames()[sel],
+        'MSF_Pred': np.round(msf_predicted[sel], 4),
+        'B-Factor_Exp': np.round(b_factors_experimental[sel], 2),
+        'Distancia_Activo': np.round(distancias[0, sel], 2)
+    }
 
     # --- SALIDA Y GRAFICACIÓN ---
     df_allosteric = pd.DataFrame(allosteric_results).sort_values(by='MSF_Pred', ascending=False)
@@ -79,7 +115,7 @@ def vally_triple_factor_analysis(pdb_file, active_site_residues):
 
     plt.title(f'Triple Validación VALLY-Scan: {pdb_file}\nPearson r = {correlation:.2f}')
     fig.tight_layout()
-    plt.savefig(f'Triple_Validacion_{pdb_file}.png')
+    plt.savefig(f'Triple_Validacion_{os.path.basename(pdb_file)}.png')
     
     print("\n--- Top Candidatos Alostéricos Detectados ---")
     print(df_results_summary := df_allosteric.head(5))
@@ -87,8 +123,12 @@ def vally_triple_factor_analysis(pdb_file, active_site_residues):
     return correlation, df_allosteric
 
 if __name__ == "__main__":
+    # Entrada heredada: equivale a `python vally.py validate --triple ...`
+    import sys
+    from vally import main as vally_main
     # Prueba con SARS-CoV-2 (6LU7)
-    r_6lu7, sitios_6lu7 = vally_triple_factor_analysis('6LU7.pdb', [41, 144, 145, 163])
-    
+    codigos = [vally_main(['validate', '6LU7.pdb', '--triple', '--active', '41', '144', '145', '163'])]
+
     # Prueba con Dengue (2fom)
-    r_2fom, sitios_2fom = vally_triple_factor_analysis('2fom.pdb', [75, 135, 157])
+    codigos.append(vally_main(['validate', '2fom.pdb', '--triple', '--active', '75', '135', '157']))
+    sys.exit(max(codigo or 0 for codigo in codigos))
@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from prody import *
 from scipy.stats import pearsonr
+from vally_solver import calcular_modos
 
 # 1. Cargar datos reales de 6LU7
 protein = parsePDB('data/6lu7.pdb')
@@ -9,9 +10,7 @@ calphas = protein.select('protein and name CA')
 b_factors_exp = calphas.getBetas() # Datos de Rayos X
 
 # 2. Tu cálculo ANM (lo mismo que hace tu main.py)
-anm = ANM('6LU7 Validation')
-anm.buildHessian(calphas)
-anm.calcModes(n_modes=20)
+anm, _ = calcular_modos(calphas, n_modes=20, nombre='6LU7 Validation')
 sq_flucts_calc = calcSqFlucts(anm) # Tu predicción
 
 # 3. Normalizar para que ambas curvas estén en la misma escala (0 a 1)
@@ -0,0 +1,293 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - CLI Unificada (scan / validate / batch / report / bench / traj / prs / lattice / sweep / archive / serve / cluster / compare)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import time
+_T0 = time.perf_counter()
+
+import os
+import sys
+import json
+import argparse
+import datetime
+
+# Sólo biblioteca estándar a nivel de módulo: cada subcomando importa sus
+# dependencias (ProDy, SciPy, matplotlib, FPDF...) cuando se ejecuta.
+
+RUTA_METRICAS = os.path.join('Database', 'vally_startup.jsonl')
+# Subcomandos cuyo parser vive en su propio módulo (reciben el resto de argv)
+DELEGADOS = ('bench', 'traj', 'prs', 'lattice', 'sweep', 'archive', 'serve', 'cluster', 'compare')
+
+# --- 1. SUBCOMANDOS ---
+
+def cmd_scan(args):
+    """Motor universal v1.7 sobre uno o varios archivos."""
+    from vally_scan_v1_7_universal import vally_universal_engine
+    serie = None
+    if args.serie:
+        from vally_solver import SerieModos
+        serie = SerieModos()
+    marcar('imports')
+    from vally_io import es_contenedor, iterar_estructuras
+    resultados = []
+    for fuente in args.pdb:
+        # Un tar/zip se recorre miembro a miembro sin extraerlo
+        trabajos = iterar_estructuras([fuente]) if es_contenedor(fuente) else [(fuente, fuente, None)]
+        for nombre, ruta, datos in trabajos:
+            resultados.append(vally_universal_engine(
+                ruta if datos is None else nombre, mode=args.mode, solver=args.solver, render=args.render,
+                serie=serie, hotspots=args.hotspots, bloques=args.bloques, msf_metodo=args.msf, datos=datos,
+                precision=args.precision))
+    return 0 if all(r is not None for r in resultados) else 1
+
+def cmd_validate(args):
+    """Validación v1.6 (B-factors + predictor + PDF/JSON) o Triple Factor (--triple)."""
+    pdb = args.pdb or args.pdb_id
+    if pdb is None:
+        print("ERROR: indica la estructura (posicional o --pdb_id).")
+        return 2
+    if args.triple:
+        from main import PROTEINAS, resolver_ruta_pdb
+        from main_v1_6 import vally_triple_factor_analysis
+        marcar('imports')
+        clave = os.path.splitext(os.path.basename(pdb))[0].lower()
+        activos = args.active or PROTEINAS.get(clave, {}).get("clave", [])
+        ruta = resolver_ruta_pdb(pdb, os.getcwd())
+        if not os.path.exists(ruta):
+            print(f"ERROR: No existe {ruta}.")
+            return 1
+        return 0 if vally_triple_factor_analysis(ruta, activos) is not None else 1
+    from main import ejecutar_validacion
+    marcar('imports')
+    return 0 if ejecutar_validacion(pdb, reporte=args.reporte, solver=args.solver) else 1
+
+def cmd_batch(args):
+    """Inventario completo de Input_PDB (vally_batch)."""
+    from vally_batch import run_full_inventory
+    marcar('imports')
+    resultados = run_full_inventory(workers=args.workers, blas_threads=args.blas_threads,
+                                    render=args.render, render_workers=args.render_workers,
+                                    fuentes=args.fuentes, forzar=args.forzar, memoria_mb=args.memoria_mb,
+                                    precision=args.precision)
+    # Cada resultado es (pdb, registro, error, duracion)
+    return 0 if all(error is None for _, _, error, _ in resultados) else 1
+
+def cmd_report(args):
+    """Renderiza los registros diferidos (Records/) y/o regenera el CSV maestro."""
+    if args.export_csv:
+        from vally_store import ResultsStore
+        with ResultsStore() as store:
+            print(f"CSV generado: {store.exportar_csv(args.export_csv)}")
+    from vally_render import renderizar_pendientes
+    marcar('imports')
+    hechos = renderizar_pendientes(workers=args.workers)
+    print(f"--> [REPORT] {len(hechos)} registros renderizados.")
+    return 0
+
+def cmd_bench(args):
+    """Banco de pruebas sobre redes sintéticas (opciones de vally_bench)."""
+    from vally_bench import main as bench_main
+    marcar('imports')
+    return bench_main(args.argumentos)
+
+def cmd_traj(args):
+    """Ensamblajes RMN / trayectorias en streaming (opciones de vally_trajectory)."""
+    from vally_trajectory import main as traj_main
+    marcar('imports')
+    return traj_main(args.argumentos)
+
+def cmd_prs(args):
+    """Perfiles de efectores y sensores (opciones de vally_prs)."""
+    from vally_prs import main as prs_main
+    marcar('imports')
+    return prs_main(args.argumentos)
+
+def cmd_lattice(args):
+    """Modo mineral: dispersión y fluctuaciones de una red periódica (opciones de vally_lattice)."""
+    from vally_lattice import main as lattice_main
+    marcar('imports')
+    return lattice_main(args.argumentos)
+
+def cmd_sweep(args):
+    """Barrido de cutoff × número de modos contra B-factors (opciones de vally_sweep)."""
+    from vally_sweep import main as sweep_main
+    marcar('imports')
+    return sweep_main(args.argumentos)
+
+def cmd_archive(args):
+    """Consultas sobre el archivo de perfiles por residuo (opciones de vally_archivo)."""
+    from vally_archivo import main as archivo_main
+    marcar('imports')
+    return archivo_main(args.argumentos)
+
+def cmd_serve(args):
+    """Servicio HTTP/JSON en localhost con workers precalentados (opciones de vally_servicio)."""
+    from vally_servicio import main as servicio_main
+    marcar('imports')
+    return servicio_main(args.argumentos)
+
+def cmd_cluster(args):
+    """Batch repartido entre máquinas sobre un spool compartido (opciones de vally_cola)."""
+    from vally_cola import main as cola_main
+    marcar('imports')
+    return cola_main(args.argumentos)
+
+def cmd_compare(args):
+    """Similitud entre muchas estructuras a partir de sus modos en caché (opciones de vally_comparacion)."""
+    from vally_comparacion import main as comparacion_main
+    marcar('imports')
+    return comparacion_main(args.argumentos)
+
+def cmd_startup(args):
+    """Resumen de la métrica de arranque registrada en cada invocación."""
+    if not os.path.exists(RUTA_METRICAS):
+        print("Sin métricas de arranque registradas todavía.")
+        return 0
+    por_comando = {}
+    with open(RUTA_METRICAS) as f:
+        for linea in f:
+            m = json.loads(linea)
+            por_comando.setdefault(m['comando'], []).append(m)
+    print(f"{'comando':<10} {'n':>5} {'cli (ms)':>10} {'imports (ms)':>13}")
+    for comando, lista in sorted(por_comando.items()):
+        cli = sorted(m['cli_s'] for m in lista)[len(lista) // 2] * 1000
+        imp = sorted(m.get('imports_s', 0.0) for m in lista)[len(lista) // 2] * 1000
+        print(f"{comando:<10} {len(lista):>5} {cli:>10.1f} {imp:>13.1f}")
+    return 0
+
+# --- 2. MÉTRICA DE ARRANQUE ---
+
+_marcas = {}
+
+def marcar(etapa):
+    """Segundos desde que arrancó el módulo hasta `etapa` ('cli', 'imports')."""
+    _marcas[etapa] = time.perf_counter() - _T0
+
+def registrar_arranque(comando):
+    if os.environ.get('VALLY_NO_METRICS'):
+        return
+    entrada = {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+               'comando': comando, 'cli_s': round(_marcas.get('cli', 0.0), 5)}
+    if 'imports' in _marcas:
+        entrada['imports_s'] = round(_marcas['imports'], 5)
+    try:
+        os.makedirs(os.path.dirname(RUTA_METRICAS), exist_ok=True)
+        with open(RUTA_METRICAS, 'a') as f:
+            f.write(json.dumps(entrada) + "\n")
+    except OSError:
+        pass  # la métrica nunca debe romper un análisis
+
+# --- 3. PARSER ---
+
+def construir_parser():
+    parser = argparse.ArgumentParser(prog='vally', description="VALLY-Scan: CLI unificada del framework R2.")
+    parser.add_argument('--trace', metavar='RUTA',
+                        help="Traza JSONL con tiempo, CPU y memoria de cada etapa (también VALLY_TRACE).")
+    sub = parser.add_subparsers(dest='comando', required=True)
+    solvers = ["auto", "dense", "sparse", "rtb"]
+    renders = ["inline", "async", "lazy", "none"]
+    precisiones = ["float64", "float32"]
+    ayuda_precision = "'float32': Hessiana, autovectores y MSF en precisión simple (mitad de memoria)."
+
+    p = sub.add_parser('scan', help="Motor universal v1.7 sobre archivos PDB/mmCIF.")
+    p.add_argument('pdb', nargs='+',
+                   help="Archivo(s) de estructura, también .gz, 'mirror.tar::miembro' o un tar/zip entero "
+                        "(se buscan también en Input_PDB).")
+    p.add_argument('--mode', choices=['universal', 'viral', 'mineral'], default='universal',
+                   help="'mineral': celda unidad (CRYST1 o CIF) resuelta como red periódica en espacio k.")
+    p.add_argument('--solver', choices=solvers, default='auto',
+                   help="'rtb': bloques rígidos para ensamblajes muy grandes (automático desde 50 000 Cα).")
+    p.add_argument('--bloques', default='segmento',
+                   help="Bloques RTB: 'segmento[:N]' (N residuos), 'ss' (estructura secundaria) o 'cadena'.")
+    p.add_argument('--render', choices=renders, default='inline',
+                   help="Gráfico/PDF en línea, asíncrono, diferido a Records/ o ninguno.")
+    p.add_argument('--serie', action='store_true',
+                   help="Estructuras parecidas (mutantes, homólogos): cada una siembra el eigensolver de la siguiente.")
+    p.add_argument('--hotspots', choices=['msf', 'efector', 'sensor'], default='msf',
+                   help="Ranking por flexibilidad (MSF) o por perfiles PRS de efectores/sensores.")
+    p.add_argument('--msf', choices=['modos', 'directa'], default='modos',
+                   help="'directa': diagonal de la pseudo-inversa por sondas (LU/CG), sin modos, con error en r.")
+    p.add_argument('--precision', choices=precisiones, default='float64', help=ayuda_precision)
+    p.set_defaults(func=cmd_scan)
+
+    p = sub.add_parser('validate', help="Validación contra B-factors (v1.6) o Triple Factor.")
+    p.add_argument('pdb', nargs='?', help="ID PDB en data/ (ej: 6lu7) o ruta a un archivo.")
+    p.add_argument('--pdb_id', help="Alias heredado de main.py.")
+    p.add_argument('--reporte', action='store_true', help="Generar reportes PDF y JSON.")
+    p.add_argument('--solver', choices=solvers, default='auto',
+                   help="Hessiana densa, dispersa (LOBPCG/ARPACK), bloques rígidos (RTB) o selección automática por tamaño.")
+    p.add_argument('--triple', action='store_true', help="Análisis de Triple Factor (main_v1_6).")
+    p.add_argument('--active', type=int, nargs='+', help="Residuos del sitio activo para --triple.")
+    p.set_defaults(func=cmd_validate)
+
+    p = sub.add_parser('batch', help="Inventario completo de Input_PDB.")
+    p.add_argument("--workers", type=int, default=1, help="Procesos en paralelo (1 = secuencial).")
+    p.add_argument("--blas-threads", type=int, default=1, help="Hilos BLAS por worker.")
+    p.add_argument("--render", choices=renders, default="inline",
+                   help="Etapa de gráficos/PDF: en línea, pool asíncrono, diferida a Records/ o ninguna.")
+    p.add_argument("--render-workers", type=int, default=1, help="Procesos del pool de render (modo async).")
+    p.add_argument("--fuentes", nargs='+', default=['Input_PDB'],
+                   help="Directorios, archivos .gz o tar/zip (p.ej. un mirror del PDB) leídos sin extraer.")
+    p.add_argument("--forzar", action='store_true',
+                   help="Recalcular todo aunque el manifiesto (Database/VALLY_Jobs.sqlite) lo dé por hecho.")
+    p.add_argument("--memoria-mb", type=float,
+                   help="Presupuesto de memoria del batch (por defecto, el 80%% de la memoria libre).")
+    p.add_argument("--precision", choices=precisiones, default="float64", help=ayuda_precision)
+    p.set_defaults(func=cmd_batch)
+
+    p = sub.add_parser('report', help="Renderizar registros diferidos de Records/.")
+    p.add_argument('--workers', type=int, default=1, help="Procesos de render.")
+    p.add_argument('--export-csv', metavar='RUTA', help="Regenerar también el CSV maestro clásico.")
+    p.set_defaults(func=cmd_report)
+
+    # Las opciones de bench, traj, prs, lattice, sweep, archive, serve, cluster y compare las interpreta su propio módulo
+    p = sub.add_parser('bench', add_help=False, help="Benchmark de escalado con regresiones frente a baseline.")
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser('traj', add_help=False, help="ANM por fotograma de ensamblajes RMN y trayectorias.")
+    p.set_defaults(func=cmd_traj)
+
+    p = sub.add_parser('prs', add_help=False, help="Perturbation response scanning: efectores y sensores.")
+    p.set_defaults(func=cmd_prs)
+
+    p = sub.add_parser('lattice', add_help=False, help="Red cristalina periódica en espacio k (modo mineral).")
+    p.set_defaults(func=cmd_lattice)
+
+    p = sub.add_parser('sweep', add_help=False, help="Pearson r sobre la rejilla (cutoff, número de modos).")
+    p.set_defaults(func=cmd_sweep)
+
+    p = sub.add_parser('archive', add_help=False, help="Frecuencia de hotspots y re-ranking sobre el archivo de perfiles.")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser('serve', add_help=False, help="Servicio HTTP/JSON local (POST /analyze, GET /status).")
+    p.set_defaults(func=cmd_serve)
+
+    p = sub.add_parser('cluster', add_help=False, help="Batch multi-nodo: encolar, trabajar y fusionar sobre un spool compartido.")
+    p.set_defaults(func=cmd_cluster)
+
+    p = sub.add_parser('compare', add_help=False, help="Solapamientos de modos, RMSIP y correlación de MSF entre estructuras.")
+    p.set_defaults(func=cmd_compare)
+
+    p = sub.add_parser('startup', help="Mediana del tiempo de arranque por subcomando.")
+    p.set_defaults(func=cmd_startup)
+    return parser
+
+def main(argv=None):
+    parser = construir_parser()
+    args, resto = parser.parse_known_args(argv)
+    if args.comando in DELEGADOS:
+        args.argumentos = resto
+    elif resto:
+        parser.error(f"argumentos no reconocidos: {' '.join(resto)}")
+    if args.trace:
+        # Por entorno: los workers 'spawn' del batch y del render también la escriben
+        os.environ['VALLY_TRACE'] = os.path.abspath(args.trace)
+    marcar('cli')
+    try:
+        return args.func(args)
+    finally:
+        registrar_arranque(args.comando)
+
+if __name__ == "__main__":
+    sys.exit(main())
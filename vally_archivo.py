@@ -0,0 +1,280 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Archivo de Perfiles por Residuo (Append-Only, Memory-Mapped)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import sys
+import fnmatch
+import argparse
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos (un solo escritor)
+    fcntl = None
+
+RUTA_ARCHIVO = os.path.join('Database', 'Perfiles')
+
+# Una columna = un archivo binario plano; las estructuras se concatenan
+COLUMNAS = {
+    'msf': np.dtype('<f8'),
+    'b_factors': np.dtype('<f8'),
+    'zscore': np.dtype('<f4'),
+    'resnums': np.dtype('<i4'),
+    'chids': np.dtype('S4'),
+}
+# Índice de desplazamientos: un registro de tamaño fijo por estructura
+TIPO_INDICE = np.dtype([
+    ('resultado_id', '<i8'),
+    ('pdb', 'S64'),
+    ('content_hash', 'S64'),
+    ('timestamp', 'S19'),
+    ('pearson_r', '<f8'),
+    ('inicio', '<i8'),
+    ('n', '<i4'),
+])
+UMBRAL_Z = 2.0
+
+def zscore(msf):
+    """MSF normalizada por estructura: comparable entre proteínas de tamaño y rigidez distintos."""
+    msf = np.asarray(msf, dtype=float)
+    desviacion = msf.std()
+    return (msf - msf.mean()) / desviacion if desviacion > 0 else np.zeros_like(msf)
+
+# --- 1. ARCHIVO ---
+
+class ArchivoPerfiles:
+    """
+    Perfiles por residuo (MSF, B-factors, z-score, resnum, cadena) de todas las
+    estructuras procesadas, en un archivo por columna más `indice.bin`
+    (TIPO_INDICE) con el desplazamiento y la longitud de cada estructura.
+
+    Sólo se añade al final: los datos se escriben antes que su entrada de
+    índice, así que un lector nunca ve una estructura a medias. Las lecturas
+    son np.memmap: consultar miles de estructuras no carga nada que no se use.
+    """
+
+    def __init__(self, ruta=RUTA_ARCHIVO):
+        self.ruta = ruta
+        os.makedirs(ruta, exist_ok=True)
+
+    def _archivo(self, nombre):
+        return os.path.join(self.ruta, f"{nombre}.bin")
+
+    def _memmap(self, nombre, tipo, n):
+        if n == 0:
+            return np.empty(0, dtype=tipo)
+        return np.memmap(self._archivo(nombre), dtype=tipo, mode='r', shape=(n,))
+
+    @property
+    def indice(self):
+        """Entradas completas del índice (memmap de sólo lectura)."""
+        ruta = self._archivo('indice')
+        n = os.path.getsize(ruta) // TIPO_INDICE.itemsize if os.path.exists(ruta) else 0
+        return self._memmap('indice', TIPO_INDICE, n)
+
+    def __len__(self):
+        return len(self.indice)
+
+    def columna(self, nombre):
+        """Columna completa (todas las estructuras) hasta la última entrada indexada."""
+        indice = self.indice
+        total = int(indice['inicio'][-1] + indice['n'][-1]) if len(indice) else 0
+        return self._memmap(nombre, COLUMNAS[nombre], total)
+
+    def perfil(self, i):
+        """Perfiles de la entrada i como vistas del memmap."""
+        entrada = self.indice[i]
+        tramo = slice(int(entrada['inicio']), int(entrada['inicio'] + entrada['n']))
+        return {nombre: self.columna(nombre)[tramo] for nombre in COLUMNAS}
+
+    def agregar(self, registro):
+        """Añade los perfiles de un registro de vally_compute; devuelve su posición en el índice."""
+        msf = np.asarray(registro['msf'], dtype=float)
+        n = len(msf)
+        chids = registro.get('chids')
+        datos = {
+            'msf': msf,
+            'b_factors': registro['b_factors'],
+            'zscore': zscore(msf),
+            'resnums': registro.get('resnums', np.arange(1, n + 1)),
+            'chids': np.asarray(chids if chids is not None else [''] * n, dtype=str),
+        }
+        with open(self._archivo('lock'), 'a') as cerrojo:
+            if fcntl is not None:
+                fcntl.flock(cerrojo, fcntl.LOCK_EX)
+            # El inicio sale del índice (no del tamaño del archivo): un escritor
+            # interrumpido a medias deja basura al final que simplemente se sobrescribe.
+            indice = self.indice
+            repetida = self._repetida(indice, registro.get('content_hash', ''), msf)
+            if repetida is not None:
+                # Re-scan, --forzar o cambio de render: mismo contenido y mismos perfiles, nada que añadir
+                return repetida
+            inicio = int(indice['inicio'][-1] + indice['n'][-1]) if len(indice) else 0
+            for nombre, tipo in COLUMNAS.items():
+                arreglo = np.ascontiguousarray(datos[nombre], dtype=tipo)
+                if len(arreglo) != n:
+                    raise ValueError(f"Perfil '{nombre}' con {len(arreglo)} valores; se esperaban {n}")
+                with open(self._archivo(nombre), 'ab') as f:
+                    f.truncate(inicio * tipo.itemsize)
+                    f.write(arreglo.tobytes())
+            r = registro.get('pearson_r')
+            entrada = np.array([(registro.get('resultado_id') or -1, registro['pdb'][:64].encode(),
+                                 registro.get('content_hash', '')[:64].encode(),
+                                 registro.get('timestamp', '')[:19].encode(),
+                                 np.nan if r is None else r, inicio, n)], dtype=TIPO_INDICE)
+            with open(self._archivo('indice'), 'ab') as f:
+                f.write(entrada.tobytes())
+            return len(indice)
+
+    def _repetida(self, indice, content_hash, msf):
+        """Última entrada con el mismo content_hash y la misma MSF (mismos parámetros), o None."""
+        if not content_hash or not len(indice):
+            return None
+        iguales = np.flatnonzero(indice['content_hash'] == content_hash[:64].encode())
+        if not len(iguales):
+            return None
+        e = int(iguales[-1])
+        tramo = slice(int(indice['inicio'][e]), int(indice['inicio'][e] + indice['n'][e]))
+        return e if np.array_equal(self._memmap('msf', COLUMNAS['msf'], tramo.stop)[tramo], msf) else None
+
+    def importar_base(self, store):
+        """Vuelca al archivo los perfiles ya guardados en la base SQLite (sin recalcular ANM)."""
+        presentes = set(self.indice['resultado_id'].tolist())
+        n = 0
+        for fila in store.consultar():
+            if fila['id'] in presentes:
+                continue
+            perfiles = store.perfil(fila['id'])
+            if perfiles is None or perfiles['msf'] is None:
+                continue
+            self.agregar({'resultado_id': fila['id'], 'pdb': fila['pdb_id'], 'content_hash': fila['content_hash'],
+                          'timestamp': fila['timestamp'], 'pearson_r': fila['pearson_r'], **perfiles})
+            n += 1
+        return n
+
+    # --- 2. CONSULTAS ---
+
+    def vigentes(self):
+        """
+        Máscara de la última entrada de cada estructura (por content_hash; por
+        nombre si no lo tiene): un recálculo con otros parámetros sustituye al
+        anterior en vez de contar dos veces en las estadísticas.
+        """
+        indice = self.indice
+        claves = np.where(indice['content_hash'] != b'', indice['content_hash'], np.char.add(b'pdb:', indice['pdb']))
+        # np.unique da la primera aparición: sobre el índice invertido, la última
+        _, ultimas = np.unique(claves[::-1], return_index=True)
+        mascara = np.zeros(len(indice), dtype=bool)
+        mascara[len(indice) - 1 - ultimas] = True
+        return mascara
+
+    def seleccionar(self, patron=None, r_min=None, historico=False):
+        """
+        Máscara booleana sobre el índice: nombre de archivo (glob, sin mayúsculas)
+        y Pearson r mínimo, sólo entre las entradas vigentes (todas con `historico`).
+        """
+        indice = self.indice
+        mascara = np.ones(len(indice), dtype=bool) if historico else self.vigentes()
+        if patron:
+            nombres = np.char.lower(indice['pdb'].astype(str))
+            mascara &= np.array([fnmatch.fnmatch(nombre, patron.lower()) for nombre in nombres], dtype=bool)
+        if r_min is not None:
+            mascara &= indice['pearson_r'] > r_min
+        return mascara
+
+    def _filas(self, seleccion):
+        """
+        Entradas seleccionadas (por defecto las vigentes), y fila global y
+        entrada de cada uno de sus residuos (agrupados por entrada).
+        """
+        indice = self.indice
+        entradas = np.flatnonzero(self.vigentes() if seleccion is None else seleccion)
+        inicios, longitudes = indice['inicio'][entradas], indice['n'][entradas].astype(np.int64)
+        desplazamiento = np.repeat(np.cumsum(longitudes) - longitudes, longitudes)
+        filas = np.repeat(inicios, longitudes) + np.arange(int(longitudes.sum())) - desplazamiento
+        return entradas, filas, np.repeat(entradas, longitudes)
+
+    def reclasificar(self, seleccion=None, umbral_z=UMBRAL_Z, top=None):
+        """
+        Hotspots por estructura con un criterio nuevo, sólo desde los perfiles:
+        residuos con z-score ≥ umbral_z o, con `top`, los `top` de mayor MSF
+        (en orden de flexibilidad). Devuelve {posición en el índice: índices de residuo}.
+        """
+        entradas, filas, de_entrada = self._filas(seleccion)
+        z = self.columna('zscore')[filas]
+        if top is None:
+            marcadas = z >= umbral_z
+        else:
+            # Orden por (entrada, z descendente): los `top` primeros de cada tramo
+            orden = np.lexsort((-z, de_entrada))
+            filas, de_entrada = filas[orden], de_entrada[orden]
+            primero = np.r_[0, np.flatnonzero(np.diff(de_entrada)) + 1] if len(filas) else np.zeros(0, dtype=int)
+            marcadas = np.arange(len(filas)) - np.repeat(primero, np.diff(np.r_[primero, len(filas)])) < top
+        filas, de_entrada = filas[marcadas], de_entrada[marcadas]
+        # Tramo de cada entrada (sigue agrupado por entrada); las que no tienen hotspots quedan vacías
+        desde = np.searchsorted(de_entrada, entradas, side='left')
+        hasta = np.searchsorted(de_entrada, entradas, side='right')
+        inicio = self.indice['inicio']
+        return {int(e): filas[a:b] - inicio[e] for e, a, b in zip(entradas, desde, hasta)}
+
+    def frecuencia_hotspots(self, seleccion=None, umbral_z=UMBRAL_Z, top=None):
+        """
+        Fracción de estructuras seleccionadas en las que cada (cadena, resnum) es
+        hotspot. Devuelve una lista [(cadena, resnum, veces, fracción)] ordenada.
+        """
+        hotspots = self.reclasificar(seleccion, umbral_z, top)
+        if not hotspots or not any(len(residuos) for residuos in hotspots.values()):
+            return []
+        indice = self.indice
+        filas = np.concatenate([indice['inicio'][e] + residuos for e, residuos in hotspots.items()]).astype(np.int64)
+        claves = np.rec.fromarrays([self.columna('chids')[filas], self.columna('resnums')[filas]])
+        unicas, veces = np.unique(claves, return_counts=True)
+        orden = np.argsort(veces, kind='stable')[::-1]
+        return [(unicas[i][0].decode(), int(unicas[i][1]), int(veces[i]), veces[i] / len(hotspots)) for i in orden]
+
+# --- 3. INTEGRACIÓN CON EL MOTOR Y LÍNEA DE COMANDOS ---
+
+def archivar_perfiles(registro, ruta=RUTA_ARCHIVO):
+    """Añade el registro al archivo; los registros sin perfiles (p.ej. importados de CSV) se ignoran."""
+    if registro.get('msf') is None or registro.get('b_factors') is None:
+        return None
+    return ArchivoPerfiles(ruta).agregar(registro)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vally archive",
+                                     description="Consultas sobre el archivo de perfiles por residuo (sin recalcular ANM).")
+    parser.add_argument('--ruta', default=RUTA_ARCHIVO)
+    parser.add_argument('--importar', action='store_true',
+                        help="Volcar los perfiles que ya están en Database/VALLY_Scan.sqlite.")
+    parser.add_argument('--patron', help="Glob sobre el nombre de archivo (ej: '*mpro*').")
+    parser.add_argument('--min-r', type=float, help="Sólo estructuras con Pearson r mayor que este valor.")
+    parser.add_argument('--umbral-z', type=float, default=UMBRAL_Z, help="Hotspot si z-score(MSF) ≥ umbral.")
+    parser.add_argument('--top', type=int, help="Hotspot = los N residuos más flexibles (ignora --umbral-z).")
+    parser.add_argument('--reclasificar', action='store_true', help="Listar los hotspots de cada estructura.")
+    parser.add_argument('--limite', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    archivo = ArchivoPerfiles(args.ruta)
+    if args.importar:
+        from vally_store import ResultsStore
+        with ResultsStore() as store:
+            print(f"Importadas {archivo.importar_base(store)} estructuras.")
+    seleccion = archivo.seleccionar(args.patron, args.min_r)
+    criterio = f"top {args.top}" if args.top else f"z ≥ {args.umbral_z:g}"
+    print(f"Archivo: {int(archivo.vigentes().sum())} estructuras ({len(archivo)} entradas) | "
+          f"seleccionadas: {int(seleccion.sum())} | hotspot: {criterio}")
+    if args.reclasificar:
+        indice = archivo.indice
+        for entrada, residuos in archivo.reclasificar(seleccion, args.umbral_z, args.top).items():
+            resnums = archivo.perfil(entrada)['resnums'][residuos]
+            print(f"  {indice['pdb'][entrada].decode():<24} | {', '.join(map(str, resnums))}")
+    else:
+        for cadena, resnum, veces, fraccion in archivo.frecuencia_hotspots(seleccion, args.umbral_z,
+                                                                             args.top)[:args.limite]:
+            print(f"  {cadena or '-':>2} {resnum:>6} | {veces:>6} estructuras ({fraccion:.1%})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
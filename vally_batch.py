@@ -1,20 +1,290 @@
 import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 # Importamos su motor sin modificarlo
-from vally_scan_v1_7_universal import vally_universal_engine
-
-def run_full_inventory():
-    pdb_folder = 'Input_PDB'
-    # Listamos los archivos sin alterar nada
-    pdb_files = [f for f in os.listdir(pdb_folder) if f.endswith('.pdb')]
-    
-    print(f"--- INICIANDO PROCESAMIENTO R2 (Total: {len(pdb_files)} archivos) ---")
-    
-    for pdb in pdb_files:
+from vally_scan_v1_7_universal import vally_universal_engine, setup_vally_environment
+from vally_io import iterar_estructuras, contar_calpha
+from vally_manifiesto import ManifiestoTrabajos, RUTA_MANIFIESTO, clave_trabajo, hash_contenido
+from vally_planificador import (VENTANA, Planificador, ajustar_a_presupuesto, estimar_coste,
+                                presupuesto_por_defecto, resumen_plan)
+
+# Variables que fijan los hilos de las distintas implementaciones BLAS/OpenMP
+BLAS_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+             'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+def _fijar_hilos_blas(n_hilos):
+    for var in BLAS_VARS:
+        os.environ[var] = str(n_hilos)
+
+def _init_worker(n_hilos):
+    """Inicializador de cada proceso: BLAS acotado y backend gráfico sin pantalla."""
+    _fijar_hilos_blas(n_hilos)
+    os.environ['MPLBACKEND'] = 'Agg'
+    try:
+        # Si numpy ya cargó su BLAS, threadpoolctl lo limita en caliente
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(n_hilos)
+    except ImportError:
+        pass
+
+def _procesar_archivo(pdb, render='inline', render_pool=None, datos=None, solver='auto', precision='float64'):
+    """
+    Ejecuta el motor sobre un archivo (o sobre los bytes de un miembro de tar/zip);
+    cualquier fallo queda aislado en su resultado.
+    """
+    inicio = time.perf_counter()
+    try:
+        resultado = vally_universal_engine(pdb, solver=solver, render=render, render_pool=render_pool, datos=datos,
+                                           precision=precision)
+        error = None if resultado is not None else "el motor no produjo resultado"
+    except Exception as e:
+        resultado, error = None, str(e)
+    return pdb, resultado, error, time.perf_counter() - inicio
+
+def _trabajo(nombre, ruta, datos):
+    """Lo que recibe el motor: el nombre de siempre en Input_PDB (allí lo busca) y la ruta fuera de él."""
+    if datos is not None or os.path.normpath(os.path.dirname(ruta)) == 'Input_PDB':
+        return nombre
+    return ruta
+
+def _pendientes(fuentes, manifiesto, parametros, forzar, omitidos, render='none', rehacer=None, completo=None):
+    """
+    (trabajo, clave, datos, n_calpha) de cada estructura que falta por hacer: las que el
+    manifiesto da por hechas con el mismo contenido y parámetros se saltan.
+    Las que quedaron 'degradado' se repiten si `completo(n_calpha)` dice que ya
+    caben con el solver sin degradar.
+    Si a una de las saltadas le faltan las salidas de `render`, va a `rehacer`.
+    """
+    for nombre, ruta, datos, (content_hash, n_calpha) in iterar_estructuras(fuentes, preparar=_preparar):
+        clave = clave_trabajo(content_hash, parametros)
+        trabajo = _trabajo(nombre, ruta, datos)
+        estado = None if forzar else manifiesto.estado(clave)
+        if estado == 'degradado' and completo is not None and completo(n_calpha):
+            print(f"--> [PLAN] {trabajo}: se rehace con el solver completo (antes degradado por memoria)")
+        elif estado in ('hecho', 'degradado'):
+            omitidos.append(nombre)
+            if render != 'none' and rehacer is not None:
+                from vally_render import salidas_presentes
+                if not salidas_presentes(trabajo, render):
+                    rehacer.append((trabajo, clave))
+            continue
+        manifiesto.iniciar(clave, trabajo, ruta, content_hash, parametros)
+        yield trabajo, clave, datos, n_calpha
+
+def _preparar(nombre, ruta, datos):
+    """
+    Hash y Cα de cada entrada, en el hilo de prefetch (sin parsear: una búsqueda
+    sobre los bytes); 0 Cα si no se puede leer: fallará en el worker.
+    """
+    try:
+        n_calpha = contar_calpha(ruta, datos)
+    except Exception:
+        n_calpha = 0
+    return hash_contenido(ruta, datos), n_calpha
+
+def _anotar(manifiesto, clave, res, coste=None):
+    pdb, registro, error, duracion = res
+    if error is None:
+        manifiesto.terminar(clave, registro.get('resultado_id'),
+                            {'pearson_r': registro.get('pearson_r'), 'hotspots': registro.get('hotspots'),
+                             'prediccion': coste}, duracion, degradado=bool(coste and coste.get('degradado')))
+    else:
+        manifiesto.fallar(clave, error, duracion)
+
+def _rehacer_salidas(rehacer, manifiesto, render, render_pool=None):
+    """
+    Gráfico, PDF o registro diferido que faltan de trabajos ya hechos, desde
+    el resultado guardado en la base: cambiar de modo de render no recalcula
+    ANM ni añade filas. Devuelve (rehechos, [(pdb, error)]).
+    """
+    from vally_store import ResultsStore
+    from vally_render import guardar_registro, renderizar_registro
+    rehechos, fallos = [], []
+    with ResultsStore() as store:
+        for trabajo, clave in rehacer:
+            resultado_id = manifiesto.resultado(clave)
+            registro = store.registro(resultado_id) if resultado_id is not None else None
+            if registro is None:
+                fallos.append((trabajo, "sin resultado con perfiles en la base (usa --forzar para recalcularlo)"))
+                continue
+            try:
+                if render == 'async':
+                    render_pool.enviar(registro)
+                elif render == 'lazy':
+                    guardar_registro(registro)
+                else:
+                    renderizar_registro(registro)
+                rehechos.append(trabajo)
+            except Exception as e:
+                fallos.append((trabajo, f"{type(e).__name__}: {e}"))
+    return rehechos, fallos
+
+def _imprimir_resumen(resultados, duracion, workers, omitidos=(), diferidos=(), fallos_render=(), rehechos=()):
+    ok = [r for r in resultados if r[2] is None]
+    fallos = [r for r in resultados if r[2] is not None]
+    computo = sum(r[3] for r in resultados)
+    print("\n" + "=" * 55)
+    print(f" RESUMEN BATCH R2 | workers={workers}")
+    print("=" * 55)
+    print(f"Procesados: {len(ok)} OK / {len(fallos)} fallidos / {len(resultados)} total")
+    if omitidos:
+        print(f"Ya hechos (manifiesto): {len(omitidos)} sin cambios de contenido ni de parámetros")
+    if rehechos:
+        print(f"Salidas rehechas desde la base (sin recalcular): {len(rehechos)}")
+    if diferidos:
+        print(f"Diferidos (no caben en el presupuesto de memoria): {', '.join(diferidos)}")
+    print(f"Tiempo total: {duracion:.1f} s | Cómputo acumulado: {computo:.1f} s")
+    if duracion > 0:
+        print(f"Throughput: {len(resultados) / duracion * 60:.2f} estructuras/min "
+              f"| Aceleración efectiva: {computo / duracion:.2f}x")
+    if fallos_render:
+        print(f"Render fallido: {len(fallos_render)} (cómputo y registro guardados; falta gráfico o PDF)")
+    for pdb, _, error, _ in fallos:
+        print(f"--> [FALLO] {pdb}: {error}")
+    for pdb, error in fallos_render:
+        print(f"--> [RENDER FALLO] {pdb}: {error}")
+    print("=" * 55)
+
+def run_full_inventory(workers=1, blas_threads=1, render='inline', render_workers=1, fuentes=('Input_PDB',),
+                       forzar=False, ruta_manifiesto=RUTA_MANIFIESTO, memoria_mb=None, precision='float64'):
+    """
+    render='async' separa el cómputo del render: los workers sólo devuelven el
+    registro y un RenderPool propio genera gráficos y PDF en paralelo.
+    `fuentes` (directorios, .gz, tar/zip) se recorren sin extraer nada a disco:
+    un hilo lee y descomprime por delante mientras los workers calculan.
+    El manifiesto (vally_manifiesto) hace el batch reanudable e incremental:
+    sólo se calcula lo que no está hecho con el mismo contenido y parámetros
+    (`forzar=True` lo recalcula todo). El modo de render no es un parámetro:
+    las salidas que falten de trabajos hechos se rehacen desde la base.
+    La memoria y el tiempo de cada trabajo se predicen por su número de Cα
+    (vally_planificador): se lanzan de mayor a menor dentro de `memoria_mb`
+    (por defecto el 80% de la memoria libre), los que no caben solos pasan a un
+    solver de menos memoria y, si ni así, se difieren.
+    precision='float32' resuelve en precisión simple (y el planificador lo tiene en cuenta).
+    """
+    print(f"--- INICIANDO PROCESAMIENTO R2 (fuentes: {', '.join(map(str, fuentes))}) ---")
+    setup_vally_environment()
+    inicio = time.perf_counter()
+    resultados, omitidos, diferidos, costes, rehacer = [], [], [], [], []
+    manifiesto = ManifiestoTrabajos(ruta_manifiesto)
+    if manifiesto.interrumpidos():
+        print(f"--> [MANIFIESTO] Reanudando: {manifiesto.interrumpidos()} trabajo(s) quedaron a medias")
+    # El render no forma parte de la clave: pasar de 'none' a 'inline' rehace las salidas que faltan
+    # desde la base, sin recalcular ANM ni duplicar filas
+    parametros = {'mode': 'universal', 'solver': 'auto', 'hotspots': 'msf', 'msf': 'modos'}
+    if precision != 'float64':
+        # Sólo entra en la clave si no es la de siempre: los trabajos float64 ya hechos siguen valiendo
+        parametros['precision'] = precision
+    presupuesto = memoria_mb or presupuesto_por_defecto()
+    planificador = Planificador(presupuesto, max(workers, 1))
+    print(f"--> [PLAN] Presupuesto de memoria: {presupuesto:.0f} MB para {max(workers, 1)} worker(s)")
+
+    def completo(n_calpha):
+        """¿Cabe ya sin degradar el solver? (un trabajo 'degradado' se repite entonces)."""
+        coste = ajustar_a_presupuesto(estimar_coste(n_calpha, precision=precision), presupuesto)
+        return coste is not None and not coste.get('degradado')
+
+    entradas = _pendientes(fuentes, manifiesto, parametros, forzar, omitidos, render, rehacer, completo)
+
+    def llenar():
+        """Lee por delante hasta completar la ventana; cada trabajo entra con su coste previsto."""
+        while len(planificador.pendientes) < VENTANA:
+            siguiente = next(entradas, None)
+            if siguiente is None:
+                return
+            trabajo, clave, datos, n_calpha = siguiente
+            coste = ajustar_a_presupuesto(estimar_coste(n_calpha, precision=precision), presupuesto)
+            if coste is None:
+                manifiesto.diferir(clave, f"no cabe en {presupuesto:.0f} MB ni con el solver RTB")
+                diferidos.append(trabajo)
+                print(f"--> [PLAN] Diferido {trabajo}: no cabe en el presupuesto de memoria")
+                continue
+            if coste.get('degradado'):
+                print(f"--> [PLAN] {trabajo}: {coste['n_calpha']} Cα -> solver '{coste['solver']}' "
+                      f"({coste['memoria_mb']:.0f} MB previstos)")
+            costes.append(coste)
+            planificador.encolar((trabajo, clave, datos), coste)
+
+    render_pool = None
+    if render == 'async':
+        from vally_render import RenderPool
+        render_pool = RenderPool(render_workers)
+    render_worker = 'none' if render == 'async' else render
+
+    if workers <= 1:
+        llenar()
+        while planificador.pendientes:
+            (trabajo, clave, datos), coste = job = planificador.siguiente()
+            resultados.append(_procesar_archivo(trabajo, render, render_pool, datos, coste['solver'], precision))
+            planificador.liberar(job[0])
+            _anotar(manifiesto, clave, resultados[-1], coste)
+            if resultados[-1][2] is not None:
+                print(f"--> [AVISO] Saltando {trabajo} por error de formato: {resultados[-1][2]}")
+            llenar()
+    else:
+        # Los procesos 'spawn' heredan el entorno al crearse: las variables BLAS
+        # deben estar fijadas antes de que el hijo importe numpy.
+        entorno_previo = {var: os.environ.get(var) for var in BLAS_VARS}
+        _fijar_hilos_blas(blas_threads)
+
+        def recoger(futuros, hechos):
+            for futuro in hechos:
+                job, coste = futuros.pop(futuro)
+                trabajo, clave, _ = job
+                planificador.liberar(job)
+                try:
+                    res = futuro.result()
+                except Exception as e:  # p.ej. el worker murió (OOM)
+                    res = (trabajo, None, f"worker caído: {e}", 0.0)
+                resultados.append(res)
+                _anotar(manifiesto, clave, res, coste)
+                if render_pool is not None and res[1] is not None:
+                    render_pool.enviar(res[1])
+                estado = "OK" if res[2] is None else "FALLO"
+                print(f"--> [{len(resultados)}] {res[0]} {estado} ({res[3]:.1f} s; previsto "
+                      f"{coste['tiempo_s']:.1f} s, {coste['memoria_mb']:.0f} MB, {coste['solver']})")
+
         try:
-            # Llamada segura al motor que ya validamos
-            vally_universal_engine(pdb)
-        except Exception as e:
-            print(f"--> [AVISO] Saltando {pdb} por error de formato: {e}")
+            contexto = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=contexto,
+                                     initializer=_init_worker, initargs=(blas_threads,)) as pool:
+                # Ventana acotada: un mirror entero no se carga en memoria de golpe
+                futuros = {}
+                llenar()
+                while planificador.pendientes or futuros:
+                    lanzado = planificador.siguiente()
+                    while lanzado is not None:
+                        job, coste = lanzado
+                        trabajo, _, datos = job
+                        futuro = pool.submit(_procesar_archivo, trabajo, render_worker, None, datos, coste['solver'],
+                                             precision)
+                        futuros[futuro] = job, coste
+                        lanzado = planificador.siguiente()
+                    recoger(futuros, wait(futuros, return_when=FIRST_COMPLETED).done)
+                    llenar()
+        finally:
+            for var, valor in entorno_previo.items():
+                if valor is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = valor
+    rehechos, fallos_render = _rehacer_salidas(rehacer, manifiesto, render, render_pool) if rehacer else ([], [])
+    manifiesto.cerrar()
+    print(f"--> [PLAN] {resumen_plan(costes)}")
+
+    duracion_computo = time.perf_counter() - inicio
+    if render_pool is not None:
+        print("--- Esperando a la etapa de render ---")
+        fallos_render += render_pool.cerrar()
+    _imprimir_resumen(resultados, time.perf_counter() - inicio, workers, omitidos, diferidos, fallos_render,
+                      rehechos)
+    if render_pool is not None:
+        print(f"Cómputo terminado en {duracion_computo:.1f} s (antes del render diferido)")
+    return resultados
 
 if __name__ == "__main__":
-    run_full_inventory()
+    # Entrada heredada: equivale a `python vally.py batch ...`
+    import sys
+    from vally import main as vally_main
+    sys.exit(vally_main(['batch'] + sys.argv[1:]))
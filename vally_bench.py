@@ -0,0 +1,349 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Banco de Pruebas de Rendimiento (Redes Sintéticas)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import sys
+import json
+import platform
+import argparse
+import datetime
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+DIRECTORIO_BENCH = 'Benchmarks'
+RUTA_BASELINE = os.path.join(DIRECTORIO_BENCH, 'baseline.json')
+
+# Densidad típica de Cα en una proteína globular: ~1 residuo cada 128 Å³
+VOLUMEN_POR_RESIDUO = 128.0
+ETAPAS = ('parse', 'hessiana', 'modos', 'msf', 'pearson', 'plot', 'pdf')
+SUITES = {
+    'rapida': [300, 1000, 3000],
+    'completa': [300, 1000, 3000, 10000, 20000, 50000],
+}
+# Por debajo de este tiempo una diferencia es ruido del sistema, no regresión
+PISO_RUIDO_S = 0.05
+# Verificación del modo float32 contra float64 sobre las estructuras incluidas
+RUTAS_PRECISION = (os.path.join('data', '6LU7.pdb'), os.path.join('data', '2fom.pdb'))
+TOL_R_PRECISION = 1e-3
+
+# --- 1. REDES Cα SINTÉTICAS ---
+
+def red_globulo(n, semilla=0, centro=(0., 0., 0.)):
+    """Glóbulo aleatorio con la densidad de una proteína y B-factors que crecen hacia la superficie."""
+    rng = np.random.default_rng(semilla)
+    radio = (3 * n * VOLUMEN_POR_RESIDUO / (4 * np.pi)) ** (1 / 3)
+    direcciones = rng.standard_normal((n, 3))
+    direcciones /= np.linalg.norm(direcciones, axis=1)[:, None]
+    r = radio * rng.random(n) ** (1 / 3)
+    coords = direcciones * r[:, None] + np.asarray(centro)
+    betas = 10 + 40 * (r / radio) ** 2 + rng.normal(0, 3, n)
+    return coords, betas
+
+def red_reticula(n, semilla=0):
+    """Retícula cúbica con el mismo espaciado medio que el glóbulo (5.04 Å)."""
+    rng = np.random.default_rng(semilla)
+    lado = int(np.ceil(n ** (1 / 3)))
+    paso = VOLUMEN_POR_RESIDUO ** (1 / 3)
+    ejes = np.arange(lado) * paso
+    coords = np.stack(np.meshgrid(ejes, ejes, ejes, indexing='ij'), -1).reshape(-1, 3)[:n]
+    # Pequeño desorden para que ningún enlace sea exactamente degenerado
+    coords = coords + rng.normal(0, 0.1, coords.shape)
+    borde = np.min(np.minimum(coords, coords.max(axis=0) - coords), axis=1)
+    betas = 10 + 30 * np.exp(-borde / paso) + rng.normal(0, 2, n)
+    return coords, betas
+
+def red_multicadena(n, semilla=0, cadenas=4):
+    """Ensamblaje de `cadenas` glóbulos en contacto (interfaces como en un oligómero)."""
+    tamanos = np.full(cadenas, n // cadenas)
+    tamanos[:n % cadenas] += 1
+    radio = (3 * tamanos[0] * VOLUMEN_POR_RESIDUO / (4 * np.pi)) ** (1 / 3)
+    coords, betas, chids = [], [], []
+    for k, m in enumerate(tamanos):
+        c, b = red_globulo(int(m), semilla + k, centro=(1.8 * radio * k, 0., 0.))
+        coords.append(c); betas.append(b); chids += [k] * int(m)
+    return np.concatenate(coords), np.concatenate(betas), np.asarray(chids)
+
+REDES = {'globulo': red_globulo, 'reticula': red_reticula, 'multicadena': red_multicadena}
+
+def construir_red(tipo, n, semilla=0):
+    """(coords, betas, indice de cadena) de la red sintética pedida."""
+    salida = REDES[tipo](n, semilla)
+    if len(salida) == 3:
+        return salida
+    coords, betas = salida
+    return coords, betas, np.zeros(n, dtype=int)
+
+# El campo resSeq del PDB tiene 4 columnas: una cadena más larga se parte en varias
+MAX_RESIDUOS_CADENA = 9999
+
+def escribir_pdb(ruta, coords, betas, cadenas):
+    """PDB mínimo (sólo Cα de ALA) legible por vally_io y por ProDy."""
+    letras = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    with open(ruta, 'w') as f:
+        indice, resnum, anterior = -1, 0, None
+        for i, ((x, y, z), b, cadena) in enumerate(zip(coords, betas, cadenas)):
+            if cadena != anterior or resnum == MAX_RESIDUOS_CADENA:
+                indice, resnum = indice + 1, 0
+            resnum += 1
+            anterior = cadena
+            f.write(f"ATOM  {(i + 1) % 100000:5d}  CA  ALA {letras[indice % 26]}{resnum:4d}    "
+                    f"{x:8.3f}{y:8.3f}{z:8.3f}  1.00{b:6.2f}           C\n")
+        f.write("END\n")
+
+# --- 2. EJECUCIÓN DE UN CASO (PROCESO AISLADO) ---
+
+def ejecutar_caso(tipo, n, solver='auto', n_modes=20, render=True, semilla=0, precision='float64'):
+    """
+    Recorre el pipeline completo sobre una red sintética cronometrando cada
+    etapa por separado. Se ejecuta en un proceso nuevo para que el pico de RSS
+    corresponda sólo a este caso.
+    """
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    from prody import calcSqFlucts
+    from scipy.stats import pearsonr
+    from vally_io import leer_calpha
+    from vally_profiling import PerfilEtapas, rss_pico_mb
+    from vally_solver import calcular_modos
+
+    coords, betas, cadenas = construir_red(tipo, n, semilla)
+    with tempfile.TemporaryDirectory(prefix='vally_bench_') as tmp:
+        nombre = f"{tipo}_{n}.pdb"
+        ruta = os.path.join(tmp, nombre)
+        escribir_pdb(ruta, coords, betas, cadenas)
+        rss_base = round(rss_pico_mb(), 1)
+        perfil = PerfilEtapas(nombre)
+
+        with perfil.etapa('parse'):
+            calpha = leer_calpha(ruta)
+
+        # El solver del motor tal cual (sin caché: se mide el cálculo real); él cronometra hessiana y modos
+        anm, info = calcular_modos(calpha, n_modes, solver=solver, nombre=nombre, cache=False, perfil=perfil,
+                                   precision=precision)
+        solver, metodo = info['solver'], info['metodo']
+        valores = anm.getEigvals()
+
+        with perfil.etapa('msf'):
+            msf = calcSqFlucts(anm).astype(float)
+
+        with perfil.etapa('pearson'):
+            r_val, _ = pearsonr(msf, calpha.getBetas())
+
+        if render:
+            from vally_render import renderizar_grafico, renderizar_pdf
+            previo = os.getcwd()
+            os.chdir(tmp)
+            try:
+                os.makedirs('Plots'); os.makedirs('Reports')
+                registro = {'pdb': nombre, 'pearson_r': float(r_val), 'msf': msf,
+                            'b_factors': calpha.getBetas(),
+                            'hotspots': [int(i) for i in np.argsort(msf)[-5:][::-1]],
+                            'info_sys': {'cpu': platform.processor() or platform.machine(), 'ram': '-'},
+                            'info_solver': {'solver': solver, 'metodo': metodo,
+                                            'residuo_max': info['residuo_max']}}
+                with perfil.etapa('plot'):
+                    plot_path = renderizar_grafico(registro)
+                with perfil.etapa('pdf'):
+                    renderizar_pdf(registro, plot_path)
+            finally:
+                os.chdir(previo)
+
+    return {
+        'red': tipo, 'n': n, 'dof': 3 * n, 'solver': solver, 'metodo': metodo, 'precision': precision,
+        'n_modes': int(len(valores)), 'residuo_max': info['residuo_max'],
+        'pearson_r': float(r_val), 'tiempos': perfil.tiempos(),
+        'cpu': {m['etapa']: m['cpu_s'] for m in perfil.etapas},
+        'rss_base_mb': rss_base, 'rss_etapa_mb': {m['etapa']: m['rss_pico_mb'] for m in perfil.etapas},
+        'rss_pico_mb': max(rss_base, perfil.resumen()['rss_pico_mb']),
+    }
+
+def ejecutar_aislado(*args, **kwargs):
+    """Ejecuta `ejecutar_caso` en un proceso 'spawn' de un solo uso."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(ejecutar_caso, *args, **kwargs).result()
+
+# --- 3. SUITE, RESULTADOS Y COMPARACIÓN CON BASELINE ---
+
+def info_maquina():
+    import scipy, prody
+    return {
+        'python': platform.python_version(), 'numpy': np.__version__,
+        'scipy': scipy.__version__, 'prody': prody.__version__,
+        'sistema': f"{platform.system()} {platform.release()}",
+        'cpu': platform.processor() or platform.machine(), 'nucleos': os.cpu_count(),
+        'hilos_blas': {v: os.environ[v] for v in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+                       if v in os.environ},
+    }
+
+def ejecutar_suite(tamanos, redes=tuple(REDES), solver='auto', repeticiones=1, render=True, precision='float64'):
+    """Cada (red, tamaño) se mide `repeticiones` veces; se conserva el mínimo por etapa."""
+    casos, fallidos = [], []
+    for tipo in redes:
+        for n in tamanos:
+            try:
+                corridas = [ejecutar_aislado(tipo, n, solver, render=render, precision=precision)
+                            for _ in range(repeticiones)]
+            except Exception as e:
+                # Un caso roto (o un worker sin memoria) no tumba la suite ni la comparación con la baseline
+                fallidos.append({'red': tipo, 'n': n, 'error': str(e) or type(e).__name__})
+                print(f"--> [BENCH] {tipo:<12} n={n:<6} FALLO: {fallidos[-1]['error']}")
+                continue
+            caso = corridas[0]
+            caso['tiempos'] = {e: min(c['tiempos'][e] for c in corridas) for e in caso['tiempos']}
+            caso['rss_pico_mb'] = max(c['rss_pico_mb'] for c in corridas)
+            caso['total_s'] = sum(caso['tiempos'].values())
+            casos.append(caso)
+            print(f"--> [BENCH] {tipo:<12} n={n:<6} {caso['solver']}/{caso['metodo']:<7} "
+                  f"total {caso['total_s']:8.2f} s | modos {caso['tiempos'].get('modos', 0.0):8.2f} s "
+                  f"| RSS pico {caso['rss_pico_mb']:8.1f} MB")
+    return {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'maquina': info_maquina(), 'repeticiones': repeticiones, 'precision': precision, 'casos': casos,
+            'fallidos': fallidos}
+
+def guardar_resultados(resultados, ruta=None):
+    os.makedirs(DIRECTORIO_BENCH, exist_ok=True)
+    if ruta is None:
+        sello = resultados['timestamp'].replace(':', '').replace('-', '')
+        ruta = os.path.join(DIRECTORIO_BENCH, f"bench_{sello}.json")
+    with open(ruta, 'w') as f:
+        json.dump(resultados, f, indent=2)
+    return ruta
+
+def comparar(actual, baseline, tolerancia=0.25):
+    """
+    Regresiones de `actual` frente a `baseline`: etapas (y pico de RSS) que
+    empeoran más de `tolerancia` en términos relativos y del piso de ruido en absoluto.
+    """
+    previos = {(c['red'], c['n']): c for c in baseline['casos']}
+    regresiones = []
+    for caso in actual['casos']:
+        previo = previos.get((caso['red'], caso['n']))
+        if previo is None:
+            continue
+        for etapa, t in caso['tiempos'].items():
+            t0 = previo['tiempos'].get(etapa)
+            if t0 is not None and t > t0 * (1 + tolerancia) and t - t0 > PISO_RUIDO_S:
+                regresiones.append((caso['red'], caso['n'], etapa, t0, t))
+        m0 = previo.get('rss_pico_mb')
+        if m0 and caso['rss_pico_mb'] > m0 * (1 + tolerancia):
+            regresiones.append((caso['red'], caso['n'], 'rss_pico_mb', m0, caso['rss_pico_mb']))
+    return regresiones
+
+def imprimir_tabla(resultados):
+    print("\n" + "=" * 100)
+    print(f"{'red':<12} {'n':>6} {'solver':<14}" + "".join(f"{e:>10}" for e in ETAPAS) + f"{'RSS MB':>10}")
+    print("=" * 100)
+    for c in resultados['casos']:
+        fila = "".join(f"{c['tiempos'][e]:10.3f}" if e in c['tiempos'] else f"{'-':>10}" for e in ETAPAS)
+        print(f"{c['red']:<12} {c['n']:>6} {c['solver'] + '/' + c['metodo']:<14}{fila}{c['rss_pico_mb']:10.1f}")
+    print("=" * 100)
+
+# --- 4. VERIFICACIÓN DEL MODO FLOAT32 ---
+
+def verificar_precision(rutas=RUTAS_PRECISION, solvers=('dense', 'sparse'), n_modes=30, tol_r=TOL_R_PRECISION):
+    """
+    Mismo ANM en float64 y float32 sobre estructuras reales: diferencia en
+    Pearson r, ranking de los 5 hotspots, error relativo máximo de la MSF y
+    memoria de Hessiana + autovectores. Devuelve (filas, todo_igual).
+    """
+    from prody import calcSqFlucts
+    from scipy.stats import pearsonr
+    from vally_io import leer_calpha
+    from vally_solver import construir_hessiana_dispersa, calcular_modos
+
+    filas = []
+    for ruta in rutas:
+        calpha = leer_calpha(ruta)
+        b_factors = calpha.getBetas()
+        for solver in solvers:
+            medidas = {}
+            for precision in ('float64', 'float32'):
+                anm, info = calcular_modos(calpha, n_modes=n_modes, solver=solver, cache=False, precision=precision)
+                msf = calcSqFlucts(anm).astype(float)
+                vectores = anm.getEigvecs()
+                # Lo que ocupa el modelo: Hessiana (densa o CSR) + bloque de autovectores
+                if solver == 'dense':
+                    bytes_hessiana = vectores.shape[0] ** 2 * vectores.itemsize
+                else:
+                    h = construir_hessiana_dispersa(calpha.getCoords(), dtype=vectores.dtype)
+                    bytes_hessiana = h.data.nbytes + h.indices.nbytes + h.indptr.nbytes
+                medidas[precision] = {'msf': msf, 'r': float(pearsonr(msf, b_factors)[0]),
+                                      'hotspots': [int(i) for i in np.argsort(msf)[-5:][::-1]],
+                                      'mb': (bytes_hessiana + vectores.nbytes) / 2 ** 20,
+                                      'residuo_max': info['residuo_max']}
+            doble, simple = medidas['float64'], medidas['float32']
+            fila = {'estructura': os.path.basename(ruta), 'solver': solver, 'n': calpha.numAtoms(),
+                    'r_float64': doble['r'], 'r_float32': simple['r'], 'delta_r': abs(simple['r'] - doble['r']),
+                    'hotspots_iguales': simple['hotspots'] == doble['hotspots'],
+                    'error_msf': float(np.max(np.abs(simple['msf'] - doble['msf']) / doble['msf'])),
+                    'mb_float64': doble['mb'], 'mb_float32': simple['mb'], 'residuo_float32': simple['residuo_max']}
+            fila['ok'] = fila['delta_r'] <= tol_r and fila['hotspots_iguales']
+            filas.append(fila)
+    return filas, all(f['ok'] for f in filas)
+
+def imprimir_precision(filas):
+    print("\n" + "=" * 100)
+    print(f"{'estructura':<12} {'solver':<7} {'n':>5} {'r float64':>10} {'r float32':>10} {'|Δr|':>9} "
+          f"{'hotspots':>9} {'err MSF':>9} {'MB f64':>8} {'MB f32':>8}")
+    print("=" * 100)
+    for f in filas:
+        print(f"{f['estructura']:<12} {f['solver']:<7} {f['n']:>5} {f['r_float64']:10.5f} {f['r_float32']:10.5f} "
+              f"{f['delta_r']:9.1e} {'iguales' if f['hotspots_iguales'] else 'DISTINTOS':>9} {f['error_msf']:9.1e} "
+              f"{f['mb_float64']:8.2f} {f['mb_float32']:8.2f}")
+    print("=" * 100)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vally bench",
+                                     description="Banco de pruebas VALLY-Scan sobre redes Cα sintéticas.")
+    parser.add_argument('--suite', choices=sorted(SUITES), default='rapida',
+                        help="Tamaños predefinidos (completa: hasta 50 000 nodos).")
+    parser.add_argument('--tamanos', type=int, nargs='+', help="Tamaños explícitos (sustituye a --suite).")
+    parser.add_argument('--redes', nargs='+', choices=sorted(REDES), default=list(REDES))
+    parser.add_argument('--solver', choices=['auto', 'dense', 'sparse', 'rtb'], default='auto')
+    parser.add_argument('--repeticiones', type=int, default=1)
+    parser.add_argument('--sin-render', action='store_true', help="Omitir las etapas de gráfico y PDF.")
+    parser.add_argument('--salida', help="Ruta del JSON de resultados (por defecto Benchmarks/bench_<fecha>.json).")
+    parser.add_argument('--baseline', default=RUTA_BASELINE, help="Baseline con la que comparar.")
+    parser.add_argument('--guardar-baseline', action='store_true', help="Convertir esta corrida en la baseline.")
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="Empeoramiento relativo aceptado.")
+    parser.add_argument('--precision', choices=['float64', 'float32'], default='float64',
+                        help="Precisión de Hessiana, autovectores y MSF en la suite.")
+    parser.add_argument('--verificar-precision', action='store_true',
+                        help="Comparar float32 con float64 (r, hotspots, MSF, memoria) sobre data/6LU7 y data/2fom.")
+    args = parser.parse_args(argv)
+
+    if args.verificar_precision:
+        filas, iguales = verificar_precision()
+        imprimir_precision(filas)
+        print(f"float32 {'equivalente' if iguales else 'NO equivalente'} a float64 "
+              f"(|Δr| ≤ {TOL_R_PRECISION:g} y mismos 5 hotspots en el mismo orden).")
+        return 0 if iguales else 1
+
+    resultados = ejecutar_suite(args.tamanos or SUITES[args.suite], args.redes, args.solver,
+                                args.repeticiones, render=not args.sin_render, precision=args.precision)
+    imprimir_tabla(resultados)
+    print(f"Resultados: {guardar_resultados(resultados, args.salida)}")
+
+    for fallo in resultados['fallidos']:
+        print(f"--> [FALLO] {fallo['red']} n={fallo['n']}: {fallo['error']}")
+    codigo_fallos = 1 if resultados['fallidos'] else 0
+
+    if args.guardar_baseline:
+        print(f"Baseline actualizada: {guardar_resultados(resultados, args.baseline)}")
+        return codigo_fallos
+    if not os.path.exists(args.baseline):
+        print("Sin baseline para comparar (usa --guardar-baseline).")
+        return codigo_fallos
+    with open(args.baseline) as f:
+        regresiones = comparar(resultados, json.load(f), args.tolerancia)
+    for red, n, etapa, antes, ahora in regresiones:
+        print(f"--> [REGRESIÓN] {red} n={n} {etapa}: {antes:.3f} -> {ahora:.3f} (+{(ahora / antes - 1) * 100:.0f}%)")
+    if not regresiones:
+        print(f"Sin regresiones frente a {args.baseline} (tolerancia {args.tolerancia:.0%}).")
+    return 1 if regresiones else codigo_fallos
+
+if __name__ == "__main__":
+    sys.exit(main())
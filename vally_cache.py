@@ -0,0 +1,105 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Caché de Modos Normales (Content-Addressed)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+DIRECTORIO_CACHE = os.environ.get('VALLY_CACHE_DIR', os.path.join('Cache', 'modes'))
+LIMITE_MB = float(os.environ.get('VALLY_CACHE_MAX_MB', 2048))
+
+# --- 1. CLAVE DE CONTENIDO ---
+
+def clave_modos(coords, **parametros):
+    """SHA-256 de las coordenadas Cα (float64) más los parámetros del modelo."""
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(coords, dtype=np.float64).tobytes())
+    h.update(json.dumps(parametros, sort_keys=True).encode())
+    return h.hexdigest()
+
+# --- 2. ALMACÉN EN DISCO (.npy mapeables en memoria) ---
+
+class ModeCache:
+    """
+    Un directorio por entrada: values.npy, vectors.npy, coords.npy y meta.json.
+    Los vectores se devuelven como np.memmap de sólo lectura; la expulsión es LRU
+    por fecha de último acceso hasta respetar el límite de tamaño.
+    """
+
+    def __init__(self, directorio=None, limite_mb=None):
+        self.directorio = directorio or DIRECTORIO_CACHE
+        self.limite_bytes = int((LIMITE_MB if limite_mb is None else limite_mb) * 1024 ** 2)
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], clave)
+
+    def obtener(self, clave):
+        """Devuelve (valores, vectores, meta) o None si la entrada no existe."""
+        ruta = self._ruta(clave)
+        try:
+            with open(os.path.join(ruta, 'meta.json')) as f:
+                meta = json.load(f)
+            valores = np.load(os.path.join(ruta, 'values.npy'))
+            vectores = np.load(os.path.join(ruta, 'vectors.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(ruta)  # marca de uso para la política LRU
+        except OSError:
+            pass  # otro proceso la expulsó tras leerla: los arrays ya cargados siguen valiendo
+        return valores, vectores, meta
+
+    def guardar(self, clave, valores, vectores, coords, meta):
+        """Escribe la entrada en un directorio temporal y la publica con un rename atómico."""
+        ruta = self._ruta(clave)
+        if os.path.isdir(ruta):
+            return ruta
+        temporal = f"{ruta}.tmp-{os.getpid()}"
+        os.makedirs(temporal, exist_ok=True)
+        np.save(os.path.join(temporal, 'values.npy'), np.asarray(valores))
+        np.save(os.path.join(temporal, 'vectors.npy'), np.asarray(vectores))
+        np.save(os.path.join(temporal, 'coords.npy'), np.asarray(coords, dtype=np.float64))
+        with open(os.path.join(temporal, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        try:
+            os.rename(temporal, ruta)
+        except OSError:
+            # Otro proceso publicó la misma clave primero: su contenido es idéntico
+            shutil.rmtree(temporal, ignore_errors=True)
+        self.expulsar()
+        return ruta
+
+    def entradas(self):
+        """Lista (última_fecha_de_uso, bytes, ruta) de todas las entradas publicadas."""
+        lista = []
+        if not os.path.isdir(self.directorio):
+            return lista
+        for prefijo in os.listdir(self.directorio):
+            carpeta = os.path.join(self.directorio, prefijo)
+            if not os.path.isdir(carpeta):
+                continue
+            for nombre in os.listdir(carpeta):
+                ruta = os.path.join(carpeta, nombre)
+                if '.tmp-' in nombre or not os.path.isdir(ruta):
+                    continue
+                try:
+                    tam = sum(e.stat().st_size for e in os.scandir(ruta))
+                    lista.append((os.stat(ruta).st_mtime, tam, ruta))
+                except OSError:
+                    continue  # expulsada por otro proceso mientras se recorría
+        return lista
+
+    def expulsar(self):
+        """Borra las entradas menos usadas hasta quedar por debajo del límite."""
+        lista = sorted(self.entradas())
+        total = sum(tam for _, tam, _ in lista)
+        for _, tam, ruta in lista:
+            if total <= self.limite_bytes:
+                break
+            shutil.rmtree(ruta, ignore_errors=True)
+            total -= tam
+        return total
@@ -0,0 +1,368 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Cola Compartida entre Nodos (Directorio Spool)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import secrets
+import argparse
+import datetime
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import fcntl
+except ImportError:  # Windows: sin cerrojo entre procesos
+    fcntl = None
+
+from vally_io import iterar_estructuras
+from vally_manifiesto import RUTA_MANIFIESTO, clave_trabajo, hash_contenido
+
+# Un trabajo reclamado cuyo lease no se renueva en este tiempo se da por abandonado
+LEASE_S = 120.0
+# Intentos antes de dar por fallido un trabajo que tumba a sus workers (OOM, kill)
+MAX_INTENTOS = 3
+# Espera entre sondeos cuando no hay nada que reclamar
+ESPERA_S = 2.0
+# Estados = subdirectorios del spool; reclamar es un rename atómico entre ellos
+ESTADOS = ('pendientes', 'reclamados', 'hechos', 'fallidos')
+# Mismos parámetros (y por tanto misma clave) que `vally.py batch`: los workers no renderizan
+PARAMETROS = {'mode': 'universal', 'solver': 'auto', 'hotspots': 'msf', 'msf': 'modos'}
+
+def _ahora():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+# --- 1. SPOOL COMPARTIDO ---
+
+class ColaCompartida:
+    """
+    Cola de trabajos en un directorio compartido (NFS, disco local...). Cada
+    trabajo es un JSON que pasa de pendientes/ a reclamados/<clave>@<token>
+    con os.rename, atómico en el mismo sistema de archivos: sólo un worker
+    gana. El mtime del archivo reclamado es el lease; su dueño lo renueva y
+    cualquier worker devuelve a pendientes/ los vencidos. Los resultados se
+    dejan en resultados/ y una sola fusión los vuelca en la base.
+    El token (máquina-pid-aleatorio) identifica al dueño de cada lease.
+    """
+
+    def __init__(self, spool, lease_s=LEASE_S):
+        self.spool, self.lease_s = spool, lease_s
+        for sub in ESTADOS + ('resultados', 'entradas', 'tmp'):
+            os.makedirs(os.path.join(spool, sub), exist_ok=True)
+        self.token = f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(3)}"
+
+    def _ruta(self, estado, nombre=''):
+        return os.path.join(self.spool, estado, nombre)
+
+    def _temporal(self, sufijo='.json'):
+        return self._ruta('tmp', f"{self.token}-{secrets.token_hex(4)}{sufijo}")
+
+    def _escribir(self, ruta, trabajo, exclusivo=False):
+        """JSON completo o nada: se escribe aparte y se publica con replace (o link si `exclusivo`)."""
+        tmp = self._temporal()
+        with open(tmp, 'w') as f:
+            json.dump(trabajo, f)
+            f.flush()
+            os.fsync(f.fileno())
+        if not exclusivo:
+            os.replace(tmp, ruta)
+            return True
+        try:
+            os.link(tmp, ruta)  # falla si ya existe: dos productores no duplican un trabajo
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp)
+
+    @staticmethod
+    def _leer(ruta):
+        with open(ruta) as f:
+            return json.load(f)
+
+    def _reloj(self):
+        """Hora del servidor de archivos (la misma que fija los mtime), inmune al desfase entre nodos."""
+        ruta = self._ruta('tmp', f".reloj-{self.token}")
+        with open(ruta, 'a'):
+            os.utime(ruta)
+        return os.stat(ruta).st_mtime
+
+    def claves(self, estado):
+        return {nombre.split('@')[0].rsplit('.', 1)[0] for nombre in os.listdir(self._ruta(estado))
+                if nombre.endswith('.json')}
+
+    def contar(self):
+        return {estado: len(os.listdir(self._ruta(estado))) for estado in ESTADOS}
+
+    # --- Productor ---
+
+    def encolar(self, fuentes, parametros=PARAMETROS, forzar=False):
+        """
+        Un JSON por estructura (clave = contenido + parámetros, la del manifiesto).
+        Los miembros de tar/zip se copian a entradas/ para que ningún worker
+        recorra el contenedor; los archivos sueltos se citan por ruta absoluta
+        (todos los nodos deben montar el almacenamiento en la misma ruta).
+        """
+        conocidas = self.claves('pendientes') | self.claves('reclamados')
+        if not forzar:
+            conocidas |= self.claves('hechos') | self.claves('fallidos')
+        nuevos = ya = 0
+        for nombre, ruta, datos in iterar_estructuras(fuentes):
+            content_hash = hash_contenido(ruta, datos)
+            clave = clave_trabajo(content_hash, parametros)
+            if clave in conocidas:
+                ya += 1
+                continue
+            trabajo = {'clave': clave, 'nombre': nombre, 'content_hash': content_hash,
+                       'parametros': parametros, 'intentos': 0, 'encolado': _ahora()}
+            if datos is not None:
+                trabajo['entrada'] = os.path.abspath(self._ruta('entradas', f"{clave}.bin"))
+                trabajo['origen'] = ruta
+                with open(trabajo['entrada'], 'wb') as f:
+                    f.write(datos)
+            else:
+                trabajo['origen'] = os.path.abspath(ruta)
+            if forzar:
+                for estado in ('hechos', 'fallidos'):
+                    if os.path.exists(self._ruta(estado, f"{clave}.json")):
+                        os.remove(self._ruta(estado, f"{clave}.json"))
+            if self._escribir(self._ruta('pendientes', f"{clave}.json"), trabajo, exclusivo=True):
+                nuevos += 1
+            conocidas.add(clave)
+        return nuevos, ya
+
+    # --- Worker ---
+
+    def reclamar(self):
+        """(trabajo, ruta del lease) o None si no queda nada pendiente."""
+        nombres = sorted(os.listdir(self._ruta('pendientes')))
+        # Cada worker empieza en un punto distinto: menos colisiones al reclamar
+        inicio = random.randrange(len(nombres)) if nombres else 0
+        for nombre in nombres[inicio:] + nombres[:inicio]:
+            pendiente = self._ruta('pendientes', nombre)
+            lease = self._ruta('reclamados', f"{nombre[:-5]}@{self.token}.json")
+            try:
+                # El rename conserva el mtime: se refresca antes para no nacer vencido
+                os.utime(pendiente)
+                os.rename(pendiente, lease)
+            except FileNotFoundError:
+                continue  # otro worker lo reclamó antes
+            trabajo = self._leer(lease)
+            trabajo.update(intentos=trabajo.get('intentos', 0) + 1, worker=self.token, reclamado=_ahora())
+            if trabajo['intentos'] > MAX_INTENTOS:
+                trabajo['error'] = f"abandonado {MAX_INTENTOS} veces (¿el worker muere con esta entrada?)"
+                self._cerrar(lease, trabajo, 'fallidos')
+                continue
+            self._escribir(lease, trabajo)
+            return trabajo, lease
+        return None
+
+    def renovar(self, lease):
+        """False si el lease se perdió (venció y otro worker lo devolvió a la cola)."""
+        try:
+            os.utime(lease)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _cerrar(self, lease, trabajo, estado):
+        final = self._ruta(estado, f"{trabajo['clave']}.json")
+        try:
+            if self.renovar(lease):
+                self._escribir(lease, trabajo)
+                os.rename(lease, final)
+                return
+            # Lease perdido: si el trabajo sigue pendiente nadie lo ha empezado, se cierra igual
+            os.rename(self._ruta('pendientes', f"{trabajo['clave']}.json"), final)
+            self._escribir(final, trabajo)
+        except FileNotFoundError:
+            pass  # otro worker lo tiene: su cierre será el que cuente
+
+    def terminar(self, lease, trabajo, registro):
+        """El resultado se publica antes que el 'hecho': la fusión nunca ve un hecho sin resultado."""
+        from vally_render import guardar_registro
+        tmp = guardar_registro(registro, self._ruta('tmp'), nombre=f"{self.token}-{trabajo['clave']}")
+        os.replace(tmp, self._ruta('resultados', f"{trabajo['clave']}.npz"))
+        trabajo['terminado'] = _ahora()
+        self._cerrar(lease, trabajo, 'hechos')
+
+    def fallar(self, lease, trabajo, error):
+        trabajo.update(error=str(error), terminado=_ahora())
+        self._cerrar(lease, trabajo, 'fallidos')
+
+    def recuperar_vencidos(self):
+        """Devuelve a pendientes/ los leases sin renovar (workers muertos o máquinas caídas)."""
+        ahora, recuperados = self._reloj(), 0
+        for nombre in os.listdir(self._ruta('reclamados')):
+            lease = self._ruta('reclamados', nombre)
+            try:
+                if ahora - os.stat(lease).st_mtime <= self.lease_s:
+                    continue
+                os.rename(lease, self._ruta('pendientes', f"{nombre.split('@')[0]}.json"))
+                recuperados += 1
+                print(f"--> [COLA] Lease vencido de {nombre.split('@')[1][:-5]}: devuelto a pendientes")
+            except FileNotFoundError:
+                pass  # lo renovó su dueño, lo cerró o lo recuperó otro worker
+        return recuperados
+
+    # --- Fusión en la base de resultados ---
+
+    def fusionar(self, ruta_db=None, ruta_manifiesto=RUTA_MANIFIESTO):
+        """
+        Vuelca resultados/ en la base (SQLite no debe compartirse por red), el
+        archivo de perfiles y el manifiesto local, con un cerrojo para que sólo
+        fusione un proceso. Un resultado ya insertado (mismo hash y fecha) no se repite.
+        """
+        from vally_render import cargar_registro
+        from vally_store import RUTA_DB, ResultsStore
+        from vally_archivo import archivar_perfiles
+        from vally_manifiesto import ManifiestoTrabajos
+        fusionados = 0
+        with open(os.path.join(self.spool, 'fusion.lock'), 'a') as cerrojo:
+            if fcntl is not None:
+                fcntl.flock(cerrojo, fcntl.LOCK_EX)
+            with ResultsStore(ruta_db or RUTA_DB) as store, ManifiestoTrabajos(ruta_manifiesto) as manifiesto:
+                for nombre in sorted(os.listdir(self._ruta('resultados'))):
+                    clave, ruta = nombre[:-4], self._ruta('resultados', nombre)
+                    if not nombre.endswith('.npz') or not os.path.exists(self._ruta('hechos', f"{clave}.json")):
+                        continue
+                    trabajo, registro = self._leer(self._ruta('hechos', f"{clave}.json")), cargar_registro(ruta)
+                    previos = [fila['id'] for fila in store.consultar(content_hash=registro.get('content_hash', ''))
+                               if fila['timestamp'] == registro['timestamp'] and fila['pdb_id'] == registro['pdb']]
+                    if previos:
+                        registro['resultado_id'] = previos[0]
+                    else:
+                        registro['resultado_id'] = store.insertar(registro)
+                        archivar_perfiles(registro)
+                    manifiesto.iniciar(clave, trabajo['nombre'], trabajo['origen'], trabajo['content_hash'],
+                                       trabajo['parametros'])
+                    manifiesto.terminar(clave, registro['resultado_id'],
+                                        {'pearson_r': registro.get('pearson_r'), 'hotspots': registro.get('hotspots'),
+                                         'worker': trabajo.get('worker')})
+                    os.remove(ruta)
+                    if trabajo.get('entrada') and os.path.exists(trabajo['entrada']):
+                        os.remove(trabajo['entrada'])
+                    fusionados += 1
+        return fusionados
+
+# --- 2. BUCLE DEL WORKER ---
+
+class _Latido(threading.Thread):
+    """Renueva el lease mientras el cómputo corre en el hilo principal."""
+
+    def __init__(self, cola, lease):
+        super().__init__(daemon=True)
+        self.cola, self.lease = cola, lease
+        self.parar, self.perdido = threading.Event(), False
+
+    def run(self):
+        while not self.parar.wait(self.cola.lease_s / 4):
+            if not self.cola.renovar(self.lease):
+                self.perdido = True
+                return
+
+def trabajar(spool, lease_s=LEASE_S, esperar=False, max_trabajos=None):
+    """
+    Reclama y calcula trabajos hasta vaciar la cola (o indefinidamente con
+    `esperar`). Devuelve (hechos, fallidos) de este worker.
+    """
+    from vally_scan_v1_7_universal import vally_compute
+    cola = ColaCompartida(spool, lease_s)
+    hechos = fallidos = 0
+    while max_trabajos is None or hechos + fallidos < max_trabajos:
+        cola.recuperar_vencidos()
+        tomado = cola.reclamar()
+        if tomado is None:
+            cuenta = cola.contar()
+            if not esperar and not cuenta['pendientes'] and not cuenta['reclamados']:
+                break
+            time.sleep(ESPERA_S)  # quedan leases ajenos: si su worker muere, se recuperan aquí
+            continue
+        trabajo, lease = tomado
+        parametros = trabajo['parametros']
+        latido = _Latido(cola, lease)
+        latido.start()
+        try:
+            # La ruta sólo sirve para leer: el id del resultado es el nombre, como en `batch`
+            with open(trabajo.get('entrada') or trabajo['origen'], 'rb') as f:
+                datos = f.read()
+            registro = vally_compute(trabajo['nombre'], mode=parametros['mode'], solver=parametros['solver'],
+                                     hotspots=parametros['hotspots'], msf_metodo=parametros['msf'], datos=datos,
+                                     precision=parametros.get('precision', 'float64'))
+            cola.terminar(lease, trabajo, registro)
+            hechos += 1
+            aviso = " (lease perdido: otro worker pudo repetirlo)" if latido.perdido else ""
+            print(f"--> [COLA] {cola.token}: {trabajo['nombre']} OK{aviso}")
+        except Exception as e:
+            cola.fallar(lease, trabajo, e)
+            fallidos += 1
+            print(f"--> [COLA] {cola.token}: {trabajo['nombre']} FALLO: {e}")
+        finally:
+            latido.parar.set()
+    return hechos, fallidos
+
+def lanzar_trabajadores(spool, workers=1, blas_threads=1, lease_s=LEASE_S, esperar=False):
+    """Varios workers de esta máquina sobre el mismo spool (cada uno con su propio token)."""
+    if workers <= 1:
+        return [trabajar(spool, lease_s, esperar)]
+    from vally_batch import _init_worker
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=contexto,
+                             initializer=_init_worker, initargs=(blas_threads,)) as pool:
+        futuros = [pool.submit(trabajar, spool, lease_s, esperar) for _ in range(workers)]
+        return [futuro.result() for futuro in futuros]
+
+# --- 3. CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vally cluster",
+                                     description="Batch repartido entre máquinas que montan el mismo directorio.")
+    sub = parser.add_subparsers(dest='accion', required=True)
+    p = sub.add_parser('encolar', help="Publicar en el spool las estructuras de las fuentes.")
+    p.add_argument('spool')
+    p.add_argument('--fuentes', nargs='+', default=['Input_PDB'], help="Directorios, archivos .gz o tar/zip.")
+    p.add_argument('--solver', choices=['auto', 'dense', 'sparse', 'rtb'], default='auto')
+    p.add_argument('--precision', choices=['float64', 'float32'], default='float64')
+    p.add_argument('--forzar', action='store_true', help="Volver a encolar también lo hecho o fallido.")
+    p = sub.add_parser('trabajar', help="Reclamar y calcular trabajos hasta vaciar la cola.")
+    p.add_argument('spool')
+    p.add_argument('--workers', type=int, default=1, help="Procesos worker en esta máquina.")
+    p.add_argument('--blas-threads', type=int, default=1, help="Hilos BLAS por worker.")
+    p.add_argument('--lease', type=float, default=LEASE_S, help="Segundos sin renovar tras los que un trabajo se recupera.")
+    p.add_argument('--esperar', action='store_true', help="No salir con la cola vacía (esperar trabajos nuevos).")
+    p.add_argument('--fusionar', action='store_true', help="Fusionar los resultados en la base al terminar.")
+    p = sub.add_parser('fusionar', help="Volcar resultados/ en Database/ (base, archivo de perfiles y manifiesto).")
+    p.add_argument('spool')
+    p = sub.add_parser('estado', help="Trabajos por estado y fallos.")
+    p.add_argument('spool')
+    args = parser.parse_args(argv)
+
+    cola = ColaCompartida(args.spool, getattr(args, 'lease', LEASE_S))
+    if args.accion == 'encolar':
+        parametros = dict(PARAMETROS, solver=args.solver)
+        if args.precision != 'float64':
+            parametros['precision'] = args.precision  # misma clave que `batch --precision float32`
+        nuevos, ya = cola.encolar(args.fuentes, parametros, args.forzar)
+        print(f"--> [COLA] {nuevos} trabajos encolados ({ya} ya estaban en el spool)")
+    elif args.accion == 'trabajar':
+        cuentas = lanzar_trabajadores(args.spool, args.workers, args.blas_threads, args.lease, args.esperar)
+        print(f"--> [COLA] Esta máquina: {sum(h for h, _ in cuentas)} hechos / {sum(f for _, f in cuentas)} fallidos")
+        if args.fusionar:
+            print(f"--> [COLA] {cola.fusionar()} resultados fusionados en la base")
+    elif args.accion == 'fusionar':
+        print(f"--> [COLA] {cola.fusionar()} resultados fusionados en la base")
+    else:
+        print("Estado: " + ", ".join(f"{k}={v}" for k, v in cola.contar().items())
+              + f", sin fusionar={len(os.listdir(cola._ruta('resultados')))}")
+        for nombre in sorted(os.listdir(cola._ruta('fallidos'))):
+            trabajo = cola._leer(cola._ruta('fallidos', nombre))
+            print(f"--> [FALLO] {trabajo['nombre']} (intentos {trabajo.get('intentos')}): {trabajo.get('error')}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
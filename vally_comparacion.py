@@ -0,0 +1,314 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Comparación de Modos entre Estructuras (Por Lotes)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import sys
+import csv
+import argparse
+import numpy as np
+
+DIRECTORIO_COMPARACIONES = 'Comparaciones'
+# Los modos del pipeline (y por tanto los de la caché de scan/batch)
+N_MODOS_CACHE = 30
+# Modos más bajos que entran en el solapamiento y en el RMSIP
+MODOS_COMPARADOS = 10
+# Por debajo de estos residuos comunes un par no se compara (NaN)
+MIN_COMUNES = 20
+# Identidad mínima con la referencia (idénticos emparejados / cadena más corta): por debajo no hay pareja
+MIN_IDENTIDAD = 0.3
+# Memoria de cada bloque de productos de solapamiento
+MB_BLOQUE = 256
+TRES_A_UNA = {'ALA': 'A', 'ARG': 'R', 'ASN': 'N', 'ASP': 'D', 'CYS': 'C', 'GLN': 'Q', 'GLU': 'E', 'GLY': 'G',
+              'HIS': 'H', 'ILE': 'I', 'LEU': 'L', 'LYS': 'K', 'MET': 'M', 'PHE': 'F', 'PRO': 'P', 'SER': 'S',
+              'THR': 'T', 'TRP': 'W', 'TYR': 'Y', 'VAL': 'V', 'MSE': 'M', 'SEC': 'U', 'PYL': 'O'}
+
+# --- 1. CORRESPONDENCIA DE RESIDUOS CON LA REFERENCIA ---
+
+def secuencia(calpha):
+    return ''.join(TRES_A_UNA.get(nombre, 'X') for nombre in calpha.getResnames())
+
+def mapear(calpha, referencia, alineacion='residuo'):
+    """
+    Posición en la referencia de cada Cα (-1 si no tiene pareja).
+    'residuo': misma cadena, número e inserción (mutantes, fotogramas, numeración común);
+    'secuencia': bloques idénticos de la alineación de secuencias (homólogos con otra numeración).
+    """
+    from vally_solver import claves_residuo
+    if alineacion == 'residuo':
+        indice = {clave: i for i, clave in enumerate(claves_residuo(referencia))}
+        return np.array([indice.get(clave, -1) for clave in claves_residuo(calpha)], dtype=int)
+    if alineacion != 'secuencia':
+        raise ValueError(f"Alineación desconocida: {alineacion}")
+    import difflib
+    mapa = np.full(calpha.numAtoms(), -1, dtype=int)
+    emparejador = difflib.SequenceMatcher(None, secuencia(referencia), secuencia(calpha), autojunk=False)
+    for a, b, n in emparejador.get_matching_blocks():
+        mapa[b:b + n] = np.arange(a, a + n)
+    return mapa
+
+def identidad(calpha, referencia, mapa):
+    """
+    Residuos emparejados con el mismo aminoácido que su pareja, sobre la
+    longitud de la más corta de las dos: una numeración que coincide por azar
+    entre proteínas no relacionadas da identidades de ~5-10%.
+    """
+    con_pareja = mapa >= 0
+    iguales = np.sum(calpha.getResnames()[con_pareja] == referencia.getResnames()[mapa[con_pareja]])
+    return float(iguales) / max(min(calpha.numAtoms(), referencia.numAtoms()), 1)
+
+def cargar_modos(fuentes):
+    """
+    (nombre, calpha, valores, vectores) de cada estructura de las fuentes
+    (archivos, .gz, directorios, tar/zip). Los modos salen de la caché de
+    vally_cache: tras un scan o batch no se recalcula ninguno.
+    """
+    from vally_io import fuente_en_memoria, iterar_estructuras, leer_calpha
+    from vally_solver import calcular_modos
+    conjuntos = []
+    for nombre, ruta, datos in iterar_estructuras(fuentes):
+        calpha = leer_calpha(ruta if datos is None else fuente_en_memoria(nombre, datos))
+        anm, _ = calcular_modos(calpha, n_modes=N_MODOS_CACHE, nombre=nombre)
+        conjuntos.append((nombre, calpha, np.asarray(anm.getEigvals()), np.asarray(anm.getEigvecs())))
+    return conjuntos
+
+def apilar(conjuntos, referencia=0, alineacion='residuo', modos=MODOS_COMPARADOS, min_identidad=MIN_IDENTIDAD):
+    """
+    Todas las estructuras sobre los M residuos de la referencia, rellenando con
+    ceros lo que falta: máscara W (S×M), coordenadas (S×M×3), los `modos` más
+    bajos (S×M×3×K), la MSF con todos los modos de la caché (S×M) y la
+    identidad de cada una con la referencia (S). Las que no llegan a
+    `min_identidad` quedan sin residuos: todos sus pares salen NaN.
+    """
+    calpha_ref = conjuntos[referencia][1]
+    s, m = len(conjuntos), calpha_ref.numAtoms()
+    mascara = np.zeros((s, m))
+    coords = np.zeros((s, m, 3))
+    vectores = np.zeros((s, m, 3, modos))
+    msf = np.zeros((s, m))
+    identidades = np.zeros(s)
+    for k, (_, calpha, valores, modos_k) in enumerate(conjuntos):
+        mapa = mapear(calpha, calpha_ref, alineacion)
+        identidades[k] = identidad(calpha, calpha_ref, mapa)
+        if identidades[k] < min_identidad:
+            continue
+        con_pareja = mapa >= 0
+        destino = mapa[con_pareja]
+        por_residuo = modos_k.reshape(calpha.numAtoms(), 3, -1)
+        mascara[k, destino] = 1.0
+        coords[k, destino] = calpha.getCoords()[con_pareja]
+        kk = min(modos, por_residuo.shape[2])
+        vectores[k, destino, :, :kk] = por_residuo[con_pareja, :, :kk]
+        msf[k, destino] = ((por_residuo ** 2).sum(axis=1) @ (1.0 / valores))[con_pareja]
+    return mascara, coords, vectores, msf, identidades
+
+# --- 2. SUPERPOSICIÓN (KABSCH POR LOTES) ---
+
+def superponer(coords, mascara, referencia=0):
+    """
+    Rotaciones óptimas (S×3×3) de todas las estructuras sobre la referencia
+    y su RMSD, con los residuos comunes de cada una: covarianzas con einsum
+    y una sola SVD por lotes de S matrices 3×3.
+    """
+    y = coords[referencia]
+    peso = mascara * mascara[referencia]
+    n = np.maximum(peso.sum(axis=1), 1.0)
+    cx = np.einsum('sm,smi->si', peso, coords) / n[:, None]
+    cy = np.einsum('sm,mi->si', peso, y) / n[:, None]
+    x0 = coords - cx[:, None, :]
+    y0 = y[None, :, :] - cy[:, None, :]
+    covarianza = np.einsum('sm,smi,smj->sij', peso, x0, y0)
+    u, _, vt = np.linalg.svd(covarianza)
+    # Sin reflexiones: se invierte el último eje singular si det < 0
+    d = np.sign(np.linalg.det(np.einsum('sji,skj->sik', vt, u)))
+    u[:, :, 2] *= d[:, None]
+    rotaciones = np.einsum('sji,skj->sik', vt, u)
+    alineadas = np.einsum('sij,smj->smi', rotaciones, x0)
+    rmsd = np.sqrt(np.einsum('sm,smi->s', peso, (alineadas - y0) ** 2) / n)
+    return rotaciones, rmsd
+
+# --- 3. MATRICES DE SIMILITUD (PRODUCTOS MATRICIALES POR BLOQUES) ---
+
+def _raiz_inversa(gram):
+    """G^(-1/2) de una pila de matrices de Gram K×K; las direcciones degeneradas (o vacías) se anulan."""
+    valores, vectores = np.linalg.eigh(gram)
+    utiles = valores > valores[..., -1:] * 1e-10
+    inversa = np.where(utiles, 1.0 / np.sqrt(np.where(utiles, valores, 1.0)), 0.0)
+    return (vectores * inversa[..., None, :]) @ np.swapaxes(vectores, -1, -2)
+
+def solapamientos(vectores, mascara, mb_bloque=MB_BLOQUE, tensor=False):
+    """
+    Solapamientos |cos| entre todos los modos de todas las estructuras con un
+    GEMM (S·K × 3M)·(3M × S·K) por bloques de filas. Restringidos a los
+    residuos comunes de un par, los K modos de cada estructura dejan de ser
+    ortonormales: se ortonormalizan por par (simétricamente, G^(-1/2) con la
+    matriz de Gram K×K sobre esos residuos, que sale de otro GEMM de productos
+    por residuo × máscaras). Así el RMSIP queda acotado por 1 y vale 1 en la diagonal.
+    Devuelve el mejor emparejamiento medio (S×S), el RMSIP de los K modos (S×S)
+    y, con `tensor`, el tensor completo S×K×S×K (float32).
+    """
+    s, m, _, k = vectores.shape
+    plano = vectores.transpose(0, 3, 1, 2).reshape(s * k, 3 * m)
+    # Productos por residuo de cada par de modos de una estructura: (S·K·K × M)
+    por_residuo = np.einsum('smxi,smxj->sijm', vectores, vectores).reshape(s * k * k, m)
+    mejor, rmsip = np.empty((s, s)), np.empty((s, s))
+    completo = np.empty((s, k, s, k), dtype=np.float32) if tensor else None
+    # Producto, dos Gram, sus raíces y el solapamiento: ~6 bloques de K·S·K por fila
+    filas = max(1, int(mb_bloque * 2 ** 20 // (6 * 8 * k * s * k)))
+    for inicio in range(0, s, filas):
+        bloque = slice(inicio, min(inicio + filas, s))
+        n = bloque.stop - bloque.start
+        # Todas las matrices quedan indexadas [a, b, i, j] con a en el bloque
+        producto = (plano[bloque.start * k:bloque.stop * k] @ plano.T).reshape(n, k, s, k).transpose(0, 2, 1, 3)
+        # Gram de a sobre los residuos de b, y de b sobre los de a
+        gram_a = (por_residuo[bloque.start * k * k:bloque.stop * k * k] @ mascara.T).reshape(n, k, k, s)
+        gram_b = (por_residuo @ mascara[bloque].T).reshape(s, k, k, n)
+        o = np.minimum(np.abs(_raiz_inversa(gram_a.transpose(0, 3, 1, 2)) @ producto
+                              @ _raiz_inversa(gram_b.transpose(3, 0, 1, 2))), 1.0)
+        # Consigo misma da la identidad (ceros en modos ausentes): exacta, sin el redondeo de eigh
+        propios = np.arange(n), np.arange(bloque.start, bloque.stop)
+        o[propios] = np.round(o[propios])
+        mejor[bloque] = o.max(axis=3).mean(axis=2)
+        rmsip[bloque] = np.sqrt((o ** 2).sum(axis=(2, 3)) / k)
+        if tensor:
+            completo[bloque] = o.transpose(0, 2, 1, 3)
+    return (mejor + mejor.T) / 2, rmsip, completo
+
+def correlacion_msf(msf, mascara):
+    """
+    r de Pearson de los perfiles de MSF de todos los pares sobre sus residuos
+    comunes: las sumas (n, Σx, Σy, Σx², Σy², Σxy) de cada par salen de seis
+    productos matriciales con las máscaras. Devuelve (r, residuos comunes).
+    """
+    # Escala propia de cada perfil (unidades arbitrarias): r no cambia y se evita cancelación
+    media = (msf * mascara).sum(axis=1) / np.maximum(mascara.sum(axis=1), 1.0)
+    x = msf * mascara / np.where(media > 0, media, 1.0)[:, None]
+    x2 = x ** 2
+    n = mascara @ mascara.T
+    sx = x @ mascara.T
+    sxx = x2 @ mascara.T
+    sxy = x @ x.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = (n * sxy - sx * sx.T) / np.sqrt((n * sxx - sx ** 2) * (n * sxx.T - sx.T ** 2))
+    return r, n
+
+def comparar(fuentes, referencia=None, alineacion='residuo', modos=MODOS_COMPARADOS, tensor=False, perfil=None,
+             min_identidad=MIN_IDENTIDAD):
+    """Etapa completa: modos de la caché -> residuos comunes -> Kabsch -> matrices de similitud."""
+    from vally_profiling import PerfilNulo
+    perfil = perfil or PerfilNulo()
+    with perfil.etapa('modos'):
+        conjuntos = cargar_modos(fuentes)
+    if len(conjuntos) < 2:
+        raise ValueError("Hacen falta al menos dos estructuras para comparar")
+    nombres = [c[0] for c in conjuntos]
+    ref = 0 if referencia is None else nombres.index(referencia)
+    with perfil.etapa('alineacion'):
+        mascara, coords, vectores, msf, identidades = apilar(conjuntos, ref, alineacion, modos, min_identidad)
+    with perfil.etapa('kabsch'):
+        rotaciones, rmsd = superponer(coords, mascara, ref)
+        # Los modos giran con su estructura: todos quedan en el marco de la referencia
+        vectores = np.einsum('sij,smjk->smik', rotaciones, vectores)
+    with perfil.etapa('solapamientos'):
+        mejor, rmsip, completo = solapamientos(vectores, mascara, tensor=tensor)
+    with perfil.etapa('msf'):
+        r_msf, comunes = correlacion_msf(msf, mascara)
+    insuficientes = comunes < MIN_COMUNES
+    for matriz in (mejor, rmsip, r_msf):
+        matriz[insuficientes] = np.nan
+    rmsd[mascara.sum(axis=1) < MIN_COMUNES] = np.nan
+    return {'nombres': nombres, 'referencia': nombres[ref], 'alineacion': alineacion, 'modos': modos,
+            'solapamiento': mejor, 'rmsip': rmsip, 'msf_r': r_msf, 'comunes': comunes.astype(int),
+            'rmsd_referencia': rmsd, 'cobertura': mascara.sum(axis=1).astype(int), 'identidad': identidades,
+            'tensor': completo}
+
+# --- 4. SALIDAS ---
+
+MATRICES = {'solapamiento': 'Mejor solapamiento medio de modos', 'rmsip': 'RMSIP (subespacio de modos)',
+            'msf_r': 'Pearson r de MSF (residuos comunes)'}
+
+def guardar_matrices(resultado, etiqueta, directorio=DIRECTORIO_COMPARACIONES):
+    """Un CSV cuadrado por matriz (con los nombres) y un .npz con todo."""
+    os.makedirs(directorio, exist_ok=True)
+    rutas = []
+    for clave in tuple(MATRICES) + ('comunes',):
+        ruta = os.path.join(directorio, f"{etiqueta}_{clave}.csv")
+        with open(ruta, 'w', newline='') as f:
+            escritor = csv.writer(f)
+            escritor.writerow([''] + resultado['nombres'])
+            for nombre, fila in zip(resultado['nombres'], resultado[clave]):
+                escritor.writerow([nombre] + ['' if np.isnan(v) else round(float(v), 5) for v in fila])
+        rutas.append(ruta)
+    ruta = os.path.join(directorio, f"{etiqueta}.npz")
+    np.savez_compressed(ruta, **{k: v for k, v in resultado.items() if v is not None})
+    return rutas + [ruta]
+
+def graficar_matrices(resultado, etiqueta, directorio='Plots'):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(directorio, exist_ok=True)
+    fig, ejes = plt.subplots(1, len(MATRICES), figsize=(6 * len(MATRICES), 5))
+    etiquetas = resultado['nombres'] if len(resultado['nombres']) <= 30 else None
+    for eje, (clave, titulo) in zip(ejes, MATRICES.items()):
+        imagen = eje.imshow(resultado[clave], cmap='viridis', vmin=-1 if clave == 'msf_r' else 0, vmax=1)
+        eje.set_title(titulo)
+        if etiquetas:
+            eje.set_xticks(range(len(etiquetas)), etiquetas, rotation=90, fontsize=7)
+            eje.set_yticks(range(len(etiquetas)), etiquetas, fontsize=7)
+        fig.colorbar(imagen, ax=eje, fraction=0.046)
+    fig.suptitle(f"VALLY Compare: {etiqueta} ({len(resultado['nombres'])} estructuras, ref. {resultado['referencia']})")
+    fig.tight_layout()
+    ruta = os.path.join(directorio, f"Compare_{etiqueta}.png")
+    fig.savefig(ruta, dpi=200)
+    plt.close(fig)
+    return ruta
+
+def pares_mas_parecidos(resultado, clave='rmsip', top=10):
+    """Los `top` pares (i < j) con mayor valor de la matriz, sin recorrer pares."""
+    matriz = resultado[clave]
+    i, j = np.triu_indices(len(matriz), k=1)
+    valores = matriz[i, j]
+    orden = np.argsort(np.where(np.isnan(valores), -np.inf, valores))[::-1][:top]
+    return [(resultado['nombres'][i[o]], resultado['nombres'][j[o]], valores[o]) for o in orden]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vally compare",
+                                     description="Solapamientos de modos, RMSIP y correlación de MSF entre muchas estructuras.")
+    parser.add_argument('fuentes', nargs='+', help="Archivos PDB/mmCIF (también .gz), directorios o tar/zip.")
+    parser.add_argument('--referencia', help="Estructura que fija los residuos y el marco (por defecto, la primera).")
+    parser.add_argument('--alineacion', choices=['residuo', 'secuencia'], default='residuo',
+                        help="Emparejar por cadena+número de residuo o por alineación de secuencias.")
+    parser.add_argument('--modos', type=int, default=MODOS_COMPARADOS, help="Modos más bajos comparados.")
+    parser.add_argument('--min-identidad', type=float, default=MIN_IDENTIDAD,
+                        help="Identidad de secuencia mínima con la referencia; por debajo, sus pares salen NaN.")
+    parser.add_argument('--etiqueta', default='comparacion', help="Prefijo de los archivos de salida.")
+    parser.add_argument('--tensor', action='store_true', help="Guardar también el tensor completo S×K×S×K.")
+    parser.add_argument('--sin-grafico', action='store_true')
+    args = parser.parse_args(argv)
+
+    from vally_profiling import PerfilEtapas
+    perfil = PerfilEtapas(args.etiqueta)
+    resultado = comparar(args.fuentes, args.referencia, args.alineacion, args.modos, args.tensor, perfil,
+                         args.min_identidad)
+    s = len(resultado['nombres'])
+    print(f"\n--> [COMPARE] {s} estructuras | referencia {resultado['referencia']} | alineación {args.alineacion} "
+          f"| {args.modos} modos | {s * (s - 1) // 2} pares")
+    print(f"    Residuos con pareja en la referencia: mín {resultado['cobertura'].min()} / "
+          f"máx {resultado['cobertura'].max()} | RMSD máx a la referencia {np.nanmax(resultado['rmsd_referencia']):.2f} Å")
+    for nombre, valor in zip(resultado['nombres'], resultado['identidad']):
+        if valor < args.min_identidad:
+            print(f"    [SIN PAREJA] {nombre}: identidad {valor:.0%} con la referencia (< {args.min_identidad:.0%})")
+    print("    Perfil: " + " | ".join(f"{etapa} {t:.2f} s" for etapa, t in perfil.tiempos().items()))
+    for a, b, valor in pares_mas_parecidos(resultado):
+        print(f"    {a:<24} {b:<24} RMSIP {valor:.3f}")
+    for ruta in guardar_matrices(resultado, args.etiqueta):
+        print(f"    Tabla: {ruta}")
+    if not args.sin_grafico:
+        print(f"    Mapa: {graficar_matrices(resultado, args.etiqueta)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
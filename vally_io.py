@@ -0,0 +1,367 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Lector Ligero de Carbonos Alfa (PDB / mmCIF)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import io
+import os
+import re
+import gzip
+import queue
+import shlex
+import tarfile
+import zipfile
+import threading
+import numpy as np
+
+# Extensiones de estructura (cada una puede ir además comprimida en .gz)
+EXT_ESTRUCTURA = ('.pdb', '.ent', '.cif', '.mmcif')
+EXT_CONTENEDOR = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.zip')
+# 'mirror.tar::ab/pdb1abc.ent.gz' = miembro de un tar/zip
+SEPARADOR_MIEMBRO = '::'
+# Estructuras leídas por adelantado de un contenedor mientras otras se calculan
+PREFETCH = 8
+
+# Residuos que cuentan como 'protein' (estándar + variantes frecuentes en el PDB/MD)
+RESIDUOS_PROTEINA = frozenset("""
+ALA ARG ASN ASP CYS GLN GLU GLY HIS ILE LEU LYS MET PHE PRO SER THR TRP TYR VAL
+ASX GLX CSO HIP HSD HSE HSP HID HIE CYX CYM ASH GLH LYN MSE SEP TPO PTR SEC PYL
+ACE NME NLE MLY M3L KCX CME CSD OCS HYP PCA
+""".split())
+
+# --- 1. CONTENEDOR COMPATIBLE CON LA INTERFAZ DE PRODY ---
+
+class ResiduoCA:
+    """Vista de un único Cα (equivalente a indexar una selección ProDy)."""
+
+    def __init__(self, conjunto, indice):
+        self._c, self._i = conjunto, indice
+
+    def getResname(self): return self._c._resnames[self._i]
+    def getResnum(self): return int(self._c._resnums[self._i])
+    def getChid(self): return self._c._chids[self._i]
+    def getBeta(self): return float(self._c._betas[self._i])
+    def getCoords(self): return self._c._coords[self._i].copy()
+
+class CalphaSet:
+    """
+    Cα de una estructura en arreglos NumPy. Expone los mismos getters que
+    `structure.select('protein and name CA')`, así que el resto del pipeline
+    (ANM, calcSqFlucts, B-factors) lo usa sin cambios.
+    """
+
+    def __init__(self, coords, resnames, resnums, chids, betas, icodes=None, titulo=''):
+        self._coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        self._resnames = np.asarray(resnames, dtype='U4')
+        self._resnums = np.asarray(resnums, dtype=int)
+        self._chids = np.asarray(chids, dtype='U4')
+        self._betas = np.asarray(betas, dtype=float)
+        self._icodes = np.asarray(icodes if icodes is not None else [''] * len(self._coords), dtype='U1')
+        self._titulo = titulo
+
+    def getCoords(self): return self._coords.copy()
+    def _getCoords(self): return self._coords
+    def getResnames(self): return self._resnames.copy()
+    def getResnums(self): return self._resnums.copy()
+    def getChids(self): return self._chids.copy()
+    def getBetas(self): return self._betas.copy()
+    def getIcodes(self): return self._icodes.copy()
+    def getTitle(self): return self._titulo
+    def numAtoms(self): return len(self._coords)
+
+    def __len__(self):
+        return len(self._coords)
+
+    def __getitem__(self, indice):
+        if isinstance(indice, (int, np.integer)):
+            return ResiduoCA(self, int(indice))
+        return CalphaSet(self._coords[indice], self._resnames[indice], self._resnums[indice],
+                         self._chids[indice], self._betas[indice], self._icodes[indice], self._titulo)
+
+    def __repr__(self):
+        return f"<CalphaSet: {self._titulo} ({self.numAtoms()} Cα)>"
+
+# --- 2. LECTURA EN STREAMING ---
+
+def _abrir(fuente):
+    """
+    Devuelve (iterador de líneas, nombre) para una ruta, una ruta .gz (se
+    descomprime al vuelo), un miembro 'contenedor::miembro' de un tar/zip o un
+    objeto tipo archivo. El nombre no lleva el sufijo .gz.
+    """
+    if hasattr(fuente, 'read'):
+        return fuente, getattr(fuente, 'name', 'stream')
+    fuente = str(fuente)
+    if SEPARADOR_MIEMBRO in fuente:
+        contenedor, miembro = fuente.split(SEPARADOR_MIEMBRO, 1)
+        texto = fuente_en_memoria(miembro, _leer_miembro(contenedor, miembro))
+        return texto, texto.name
+    if fuente.lower().endswith('.gz'):
+        return gzip.open(fuente, 'rt', errors='replace'), fuente[:-3]
+    return open(fuente, 'r', errors='replace'), fuente
+
+def abrir_estructura(fuente):
+    """Versión pública de _abrir para otros lectores (celdas, trayectorias)."""
+    return _abrir(fuente)
+
+def _es_mmcif(nombre, primera_linea):
+    base = os.path.basename(str(nombre)).lower()
+    return base.endswith(('.cif', '.mmcif')) or primera_linea.startswith('data_')
+
+def _leer_pdb(lineas, columnas):
+    """
+    Registros ATOM/HETATM con nombre CA de residuos proteicos hasta el primer
+    ENDMDL. Devuelve True si quedan modelos: sobre el mismo iterador, una nueva
+    llamada lee el siguiente.
+    """
+    for linea in lineas:
+        registro = linea[:6]
+        if registro == 'ENDMDL':
+            return True
+        if registro not in ('ATOM  ', 'HETATM') or linea[12:16].strip() != 'CA':
+            continue
+        resname = linea[17:21].strip()
+        if resname not in RESIDUOS_PROTEINA or linea[16] not in ' A':
+            continue
+        columnas[0].append((float(linea[30:38]), float(linea[38:46]), float(linea[46:54])))
+        columnas[1].append(resname)
+        columnas[2].append(int(linea[22:26]))
+        columnas[3].append(linea[21].strip())
+        b = linea[60:66].strip()
+        columnas[4].append(float(b) if b else 0.0)
+        columnas[5].append(linea[26].strip())
+    return False
+
+def _modelos_mmcif(lineas):
+    """Bucle _atom_site de un mmCIF, con el mismo filtro que el lector PDB; un bloque de columnas por modelo."""
+    cabecera, en_bucle, modelo = [], False, None
+    columnas = ([], [], [], [], [], [])
+    for linea in lineas:
+        if linea.startswith('_atom_site.'):
+            cabecera.append(linea.split('.', 1)[1].strip())
+            en_bucle = True
+            continue
+        if not en_bucle:
+            continue
+        if linea.startswith(('#', 'loop_', '_')):
+            break  # fin del bucle _atom_site
+        if not linea.strip():
+            continue
+        campos = shlex.split(linea) if ('"' in linea or "'" in linea) else linea.split()
+        fila = dict(zip(cabecera, campos))
+        num_modelo = fila.get('pdbx_PDB_model_num')
+        if modelo is None:
+            modelo = num_modelo
+        elif num_modelo != modelo:
+            yield columnas
+            modelo, columnas = num_modelo, ([], [], [], [], [], [])
+        atomo = fila.get('auth_atom_id', fila.get('label_atom_id'))
+        resname = fila.get('auth_comp_id', fila.get('label_comp_id', ''))
+        if atomo != 'CA' or resname not in RESIDUOS_PROTEINA or fila.get('label_alt_id', '.') not in '.?A':
+            continue
+        columnas[0].append((float(fila['Cartn_x']), float(fila['Cartn_y']), float(fila['Cartn_z'])))
+        columnas[1].append(resname)
+        columnas[2].append(int(fila.get('auth_seq_id', fila.get('label_seq_id'))))
+        columnas[3].append(fila.get('auth_asym_id', fila.get('label_asym_id', '')))
+        b = fila.get('B_iso_or_equiv', '0')
+        columnas[4].append(float(b) if b not in '.?' else 0.0)
+        icode = fila.get('pdbx_PDB_ins_code', '?')
+        columnas[5].append('' if icode in '.?' else icode)
+    if columnas[0]:
+        yield columnas
+
+def _leer_mmcif(lineas, columnas):
+    """Sólo el primer modelo del mmCIF."""
+    primero = next(_modelos_mmcif(lineas), None)
+    for destino, origen in zip(columnas, primero or ()):
+        destino.extend(origen)
+
+def leer_calpha(fuente):
+    """
+    Lee un PDB o mmCIF línea a línea y conserva únicamente los Cα de proteína.
+    Sustituto directo de parsePDB(...).select('protein and name CA').
+    """
+    lineas, nombre = _abrir(fuente)
+    columnas = ([], [], [], [], [], [])
+    try:
+        iterador = iter(lineas)
+        primera = next(iterador, '')
+        if _es_mmcif(nombre, primera):
+            _leer_mmcif(_encadenar(primera, iterador), columnas)
+        else:
+            _leer_pdb(_encadenar(primera, iterador), columnas)
+    finally:
+        if lineas is not fuente:
+            lineas.close()
+
+    return _construir(columnas, nombre)
+
+def iterar_modelos(fuente):
+    """
+    Un CalphaSet por MODEL (PDB) o por pdbx_PDB_model_num (mmCIF), leídos en
+    streaming: ensamblajes RMN o trayectorias multi-modelo sin cargar el archivo.
+    """
+    lineas, nombre = _abrir(fuente)
+    try:
+        iterador = iter(lineas)
+        primera = next(iterador, '')
+        if _es_mmcif(nombre, primera):
+            yield from (_construir(c, nombre) for c in _modelos_mmcif(_encadenar(primera, iterador)))
+            return
+        iterador = _encadenar(primera, iterador)
+        quedan = True
+        while quedan:
+            columnas = ([], [], [], [], [], [])
+            quedan = _leer_pdb(iterador, columnas)
+            if columnas[0]:
+                yield _construir(columnas, nombre)
+    finally:
+        if lineas is not fuente:
+            lineas.close()
+
+def _construir(columnas, nombre):
+    titulo = os.path.splitext(os.path.basename(str(nombre)))[0]
+    coords = np.array(columnas[0], dtype=float).reshape(-1, 3)
+    return CalphaSet(coords, columnas[1], columnas[2], columnas[3], columnas[4], columnas[5], titulo)
+
+def _encadenar(primera, resto):
+    yield primera
+    yield from resto
+
+# --- 3. ARCHIVOS COMPRIMIDOS Y CONTENEDORES (tar / zip) ---
+
+def _sin_gz(nombre):
+    return nombre[:-3] if nombre.lower().endswith('.gz') else nombre
+
+def es_estructura(nombre):
+    return _sin_gz(os.path.basename(str(nombre))).lower().endswith(EXT_ESTRUCTURA)
+
+def es_contenedor(ruta):
+    return os.path.isfile(ruta) and str(ruta).lower().endswith(EXT_CONTENEDOR)
+
+def nombre_estructura(fuente):
+    """'mirror.tar::ab/pdb1abc.ent.gz' -> 'pdb1abc'; '6LU7.pdb' -> '6LU7'."""
+    nombre = str(fuente).split(SEPARADOR_MIEMBRO)[-1]
+    return os.path.splitext(_sin_gz(os.path.basename(nombre)))[0]
+
+def fuente_en_memoria(nombre, datos):
+    """Flujo de texto sobre los bytes de una estructura (gzip si empiezan por la firma 1f 8b)."""
+    if datos[:2] == b'\x1f\x8b':
+        datos = gzip.decompress(datos)
+    texto = io.StringIO(datos.decode('utf-8', errors='replace'))
+    texto.name = _sin_gz(nombre)
+    return texto
+
+# Cα sin parsear: columnas fijas en PDB; en mmCIF, el orden estándar group_PDB id type_symbol label_atom_id
+_CA_PDB = re.compile(rb'^(?:ATOM  |HETATM).{6} CA [ A]', re.M)
+_CA_MMCIF = re.compile(rb'^(?:ATOM|HETATM)\s+\S+\s+C\s+CA\s.*$', re.M)
+
+def contar_calpha(ruta, datos=None):
+    """
+    Número de Cα del primer modelo con una búsqueda sobre los bytes, sin
+    construir nada: lo que el planificador del batch necesita para estimar
+    memoria y tiempo. Es una estimación (no filtra por tipo de residuo).
+    """
+    if datos is None:
+        with open(ruta, 'rb') as f:
+            datos = f.read()
+    if datos[:2] == b'\x1f\x8b':
+        datos = gzip.decompress(datos)
+    if not (datos.startswith(b'data_') or b'\n_atom_site.' in datos):
+        fin = datos.find(b'\nENDMDL')
+        return len(_CA_PDB.findall(datos if fin < 0 else datos[:fin]))
+    lineas = _CA_MMCIF.findall(datos)
+    # pdbx_PDB_model_num es la última columna del bucle _atom_site: sólo el primer modelo
+    modelo = lineas[0].rsplit(None, 1)[-1] if lineas else None
+    return sum(1 for linea in lineas if linea.rsplit(None, 1)[-1] == modelo)
+
+def _leer_miembro(contenedor, miembro):
+    """Acceso directo a un miembro (en un tar comprimido implica leerlo desde el principio)."""
+    if contenedor.lower().endswith('.zip'):
+        with zipfile.ZipFile(contenedor) as z:
+            return z.read(miembro)
+    with tarfile.open(contenedor, 'r:*') as tar:
+        archivo = tar.extractfile(miembro)
+        if archivo is None:
+            raise ValueError(f"{miembro} no es un archivo regular en {contenedor}")
+        return archivo.read()
+
+def _miembros(contenedor):
+    """(nombre, localizador, bytes) de cada estructura de un tar/zip, en una sola pasada secuencial."""
+    if contenedor.lower().endswith('.zip'):
+        with zipfile.ZipFile(contenedor) as z:
+            for info in z.infolist():
+                if not info.is_dir() and es_estructura(info.filename):
+                    yield (os.path.basename(info.filename), f"{contenedor}{SEPARADOR_MIEMBRO}{info.filename}",
+                           z.read(info))
+        return
+    # Modo flujo ('r|*'): un tar.gz de todo un mirror se descomprime una única vez
+    with tarfile.open(contenedor, 'r|*') as tar:
+        for miembro in tar:
+            if miembro.isfile() and es_estructura(miembro.name):
+                yield (os.path.basename(miembro.name), f"{contenedor}{SEPARADOR_MIEMBRO}{miembro.name}",
+                       tar.extractfile(miembro).read())
+
+def _recorrer(fuentes):
+    """
+    (nombre, localizador, bytes o None) de cada estructura: los archivos sueltos
+    (también .gz) se leen después desde su ruta; los miembros de contenedores
+    viajan como bytes (todavía comprimidos si el miembro es .gz). Los
+    directorios se recorren enteros (un mirror en disco: divided/pdb/ab/...),
+    en orden alfabético para que el recorrido sea reproducible.
+    """
+    for fuente in fuentes:
+        if os.path.isdir(fuente):
+            for raiz, directorios, archivos in os.walk(fuente):
+                directorios.sort()
+                for nombre in sorted(archivos):
+                    ruta = os.path.join(raiz, nombre)
+                    if es_contenedor(ruta):
+                        yield from _miembros(ruta)
+                    elif os.path.isfile(ruta) and es_estructura(nombre):
+                        yield nombre, ruta, None
+        elif es_contenedor(fuente):
+            yield from _miembros(fuente)
+        else:
+            yield os.path.basename(str(fuente)), fuente, None
+
+def iterar_estructuras(fuentes, prefetch=PREFETCH, preparar=None):
+    """
+    Recorre directorios, archivos .gz y contenedores tar/zip sin extraer nada a
+    disco. Un hilo lee por delante hasta `prefetch` estructuras (la lectura y la
+    descompresión del tar liberan el GIL), así que la E/S se solapa con el cálculo.
+    `preparar(nombre, ruta, datos)` corre también en ese hilo y su resultado se
+    añade a cada tupla (p.ej. hash y tamaño para el planificador del batch).
+    """
+    cola = queue.Queue(maxsize=max(prefetch, 1))
+    fin, parar = object(), threading.Event()
+
+    def productor():
+        try:
+            for elemento in _recorrer(fuentes):
+                if preparar is not None:
+                    elemento = elemento + (preparar(*elemento),)
+                while not parar.is_set():
+                    try:
+                        cola.put(elemento, timeout=0.5)
+                        break
+                    except queue.Full:
+                        pass
+                if parar.is_set():
+                    return
+            cola.put(fin)
+        except Exception as e:  # se relanza en el consumidor
+            cola.put(e)
+
+    hilo = threading.Thread(target=productor, name='vally-prefetch', daemon=True)
+    hilo.start()
+    try:
+        while True:
+            elemento = cola.get()
+            if elemento is fin:
+                return
+            if isinstance(elemento, Exception):
+                raise elemento
+            yield elemento
+    finally:
+        parar.set()
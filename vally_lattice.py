@@ -0,0 +1,393 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Modo Mineral: Red Periódica en Espacio k (Bloch)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import re
+import sys
+import shlex
+import argparse
+import multiprocessing
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+DIRECTORIO_RED = 'Lattice'
+# Los sitios de un mineral son átomos, no residuos: alcance de resorte más corto que el ANM Cα
+CUTOFF_RED = 8.0
+REJILLA_K = (6, 6, 6)
+# Recorrido de la dispersión en coordenadas fraccionarias de la red recíproca
+CAMINO_K = (('Γ', (0, 0, 0)), ('X', (0.5, 0, 0)), ('M', (0.5, 0.5, 0)), ('Γ', (0, 0, 0)), ('R', (0.5, 0.5, 0.5)))
+PUNTOS_POR_TRAMO = 30
+# Memoria de trabajo por tanda de matrices dinámicas (complejas)
+TANDA_MB = 128
+CERO = 1e-6
+# Dos sitios a menos de esta distancia fraccionaria (mod 1) son el mismo
+TOLERANCIA_SITIO = 1e-3
+
+# --- 1. CELDA UNIDAD ---
+
+class CeldaUnidad:
+    """Sitios de la celda unidad (cartesianos, Å) y vectores de red (filas a1, a2, a3)."""
+
+    def __init__(self, vectores, coords, elementos, betas, titulo=''):
+        self.vectores = np.asarray(vectores, dtype=float)
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 3)
+        self.elementos = np.asarray(elementos, dtype='<U4')
+        self.betas = np.asarray(betas, dtype=float)
+        self.titulo = titulo
+
+    def numSitios(self):
+        return len(self.coords)
+
+    def __repr__(self):
+        return f"<CeldaUnidad: {self.titulo} ({self.numSitios()} sitios)>"
+
+def vectores_red(a, b, c, alfa, beta, gamma):
+    """Vectores de red con el convenio de CRYST1: a1 sobre x, a2 en el plano xy."""
+    alfa, beta, gamma = np.radians([alfa, beta, gamma])
+    cx = np.cos(beta)
+    cy = (np.cos(alfa) - np.cos(beta) * np.cos(gamma)) / np.sin(gamma)
+    return np.array([[a, 0.0, 0.0],
+                     [b * np.cos(gamma), b * np.sin(gamma), 0.0],
+                     [c * cx, c * cy, c * np.sqrt(max(1.0 - cx ** 2 - cy ** 2, 0.0))]])
+
+def _sin_duplicados(fraccionarias, *columnas):
+    """Lleva los sitios a [0, 1) y elimina los repetidos (caras/aristas de la celda, simetría)."""
+    fraccionarias = np.mod(fraccionarias, 1.0)
+    conservar = []
+    for i, f in enumerate(fraccionarias):
+        delta = fraccionarias[conservar] - f
+        delta -= np.round(delta)
+        if not conservar or np.min(np.abs(delta).max(axis=1)) > TOLERANCIA_SITIO:
+            conservar.append(i)
+    return (fraccionarias[conservar],) + tuple(np.asarray(c)[conservar] for c in columnas)
+
+def _leer_pdb_celda(lineas):
+    """CRYST1 + todos los ATOM/HETATM (la celda completa, P 1)."""
+    parametros, coords, elementos, betas = None, [], [], []
+    for linea in lineas:
+        registro = linea[:6]
+        if registro == 'CRYST1':
+            parametros = [float(linea[i:j]) for i, j in ((6, 15), (15, 24), (24, 33), (33, 40), (40, 47), (47, 54))]
+        elif registro in ('ATOM  ', 'HETATM') and linea[16] in ' A':
+            coords.append((float(linea[30:38]), float(linea[38:46]), float(linea[46:54])))
+            elemento = linea[76:78].strip() or linea[12:16].strip().rstrip('0123456789')
+            elementos.append(elemento)
+            b = linea[60:66].strip()
+            betas.append(float(b) if b else 0.0)
+        elif registro == 'ENDMDL':
+            break
+    if parametros is None:
+        raise ValueError("El modo mineral necesita el registro CRYST1 (celda unidad)")
+    vectores = vectores_red(*parametros)
+    fraccionarias = np.asarray(coords, dtype=float).reshape(-1, 3) @ np.linalg.inv(vectores)
+    return vectores, fraccionarias, elementos, betas
+
+def _numero_cif(valor):
+    """'5.4310(2)' -> 5.431; '.' y '?' (sin dato) -> 0."""
+    valor = valor.split('(')[0]
+    return float(valor) if valor not in ('.', '?', '') else 0.0
+
+def _operacion_simetria(texto):
+    """'-x+1/2, y, -z' -> (R 3×3, t 3) en coordenadas fraccionarias."""
+    rotacion, traslacion = np.zeros((3, 3)), np.zeros(3)
+    for fila, componente in enumerate(texto.replace(' ', '').lower().split(',')):
+        for termino in re.findall(r'[+-]?[^+-]+', componente):
+            signo = -1.0 if termino[0] == '-' else 1.0
+            termino = termino.lstrip('+-')
+            if termino[-1] in 'xyz':
+                factor = termino[:-1].rstrip('*')
+                rotacion[fila, 'xyz'.index(termino[-1])] += signo * (float(Fraction(factor)) if factor else 1.0)
+            else:
+                traslacion[fila] += signo * float(Fraction(termino))
+    return rotacion, traslacion
+
+def _bucles_cif(lineas):
+    """Pares (claves, filas) de cada loop_ más los valores sueltos '_clave valor'."""
+    sueltos, bucles = {}, []
+    claves, tokens, en_bucle, en_texto = None, [], False, False
+    for linea in lineas:
+        # Campos de texto multilínea entre ';' (títulos, referencias): se ignoran
+        if linea.startswith(';'):
+            en_texto = not en_texto
+            continue
+        linea = linea.strip()
+        if en_texto or not linea or linea.startswith('#'):
+            continue
+        if linea.startswith('loop_'):
+            if claves:
+                bucles.append((claves, tokens))
+            claves, tokens, en_bucle = [], [], True
+        elif linea.startswith('_'):
+            if en_bucle and not tokens:
+                claves.append(linea.split()[0].lower())
+                continue
+            if claves:
+                bucles.append((claves, tokens))
+            claves, tokens, en_bucle = None, [], False
+            partes = shlex.split(linea, posix=True)
+            if len(partes) > 1:
+                sueltos[partes[0].lower()] = partes[1]
+        elif en_bucle:
+            tokens.extend(shlex.split(linea, posix=True))
+    if claves:
+        bucles.append((claves, tokens))
+    tablas = []
+    for claves, tokens in bucles:
+        n = len(claves)
+        tablas.append({c: tokens[i::n] for i, c in enumerate(claves)})
+    return sueltos, tablas
+
+def _leer_cif_celda(lineas):
+    """CIF cristalográfico: _cell_*, sitios fraccionarios y operaciones de simetría."""
+    sueltos, tablas = _bucles_cif(lineas)
+    try:
+        parametros = [_numero_cif(sueltos[f'_cell_{k}']) for k in
+                      ('length_a', 'length_b', 'length_c', 'angle_alpha', 'angle_beta', 'angle_gamma')]
+    except KeyError:
+        raise ValueError("El modo mineral necesita _cell_length_* y _cell_angle_* en el CIF")
+    sitios = next((t for t in tablas if '_atom_site_fract_x' in t), None)
+    if sitios is None:
+        raise ValueError("El CIF no contiene _atom_site_fract_x/y/z")
+    fraccionarias = np.array([[_numero_cif(v) for v in sitios[f'_atom_site_fract_{e}']] for e in 'xyz']).T
+    etiquetas = sitios.get('_atom_site_type_symbol', sitios.get('_atom_site_label'))
+    elementos = [re.match(r'[A-Za-z]+', e).group(0) for e in etiquetas]
+    if '_atom_site_b_iso_or_equiv' in sitios:
+        betas = [_numero_cif(v) for v in sitios['_atom_site_b_iso_or_equiv']]
+    elif '_atom_site_u_iso_or_equiv' in sitios:
+        betas = [8 * np.pi ** 2 * _numero_cif(v) for v in sitios['_atom_site_u_iso_or_equiv']]
+    else:
+        betas = [0.0] * len(elementos)
+
+    operaciones = next((t[c] for t in tablas for c in ('_symmetry_equiv_pos_as_xyz', '_space_group_symop_operation_xyz')
+                        if c in t), ['x,y,z'])
+    expandidas, elementos_celda, betas_celda = [], [], []
+    for texto in operaciones:
+        rotacion, traslacion = _operacion_simetria(texto)
+        expandidas.append(fraccionarias @ rotacion.T + traslacion)
+        elementos_celda.extend(elementos)
+        betas_celda.extend(betas)
+    return vectores_red(*parametros), np.vstack(expandidas), elementos_celda, betas_celda
+
+def leer_celda(ruta):
+    """Celda unidad de un PDB (CRYST1 + átomos) o de un CIF cristalográfico (con su simetría)."""
+    from vally_io import abrir_estructura
+    # Rutas .gz y miembros de tar/zip igual que en el lector de Cα
+    flujo, nombre = abrir_estructura(ruta)
+    with flujo:
+        lineas = flujo.readlines()
+    es_cif = str(nombre).lower().endswith('.cif') or any(l.startswith('_cell_length_a') for l in lineas)
+    vectores, fraccionarias, elementos, betas = (_leer_cif_celda if es_cif else _leer_pdb_celda)(lineas)
+    if len(fraccionarias) == 0:
+        raise ValueError(f"No se encontraron sitios en {nombre}")
+    fraccionarias, elementos, betas = _sin_duplicados(fraccionarias, elementos, betas)
+    titulo = os.path.splitext(os.path.basename(str(nombre)))[0]
+    return CeldaUnidad(vectores, fraccionarias @ vectores, elementos, betas, titulo)
+
+# --- 2. RESORTES ENTRE IMÁGENES PERIÓDICAS ---
+
+def pares_periodicos(celda, cutoff=CUTOFF_RED):
+    """
+    Resortes (s, t, n): sitio s de la celda origen con la imagen de t en la celda
+    n = (n1, n2, n3). Cada resorte aparece en ambos sentidos, (s, t, n) y (t, s, -n).
+    Devuelve (s, t, n, d̂) con d̂ el vector unitario de s a la imagen de t.
+    """
+    from scipy.spatial import cKDTree
+
+    vectores, coords = celda.vectores, celda.coords
+    volumen = abs(np.linalg.det(vectores))
+    # Distancia entre planos de la red: cuántas celdas hacen falta en cada dirección
+    espaciado = volumen / np.linalg.norm(np.cross(vectores[[1, 2, 0]], vectores[[2, 0, 1]]), axis=1)
+    alcance = np.ceil(cutoff / espaciado).astype(int) + 1
+    celdas = np.stack(np.meshgrid(*(np.arange(-m, m + 1) for m in alcance), indexing='ij'), -1).reshape(-1, 3)
+    n_sitios = len(coords)
+    imagenes = (coords[None, :, :] + (celdas @ vectores)[:, None, :]).reshape(-1, 3)
+    vecinos = cKDTree(imagenes).query_ball_point(coords, cutoff)
+    s = np.repeat(np.arange(n_sitios), [len(v) for v in vecinos])
+    indice = np.concatenate([np.asarray(v, dtype=np.int64) for v in vecinos]) if len(s) else np.zeros(0, np.int64)
+    t, n = indice % n_sitios, celdas[indice // n_sitios]
+    d = imagenes[indice] - coords[s]
+    distancia = np.linalg.norm(d, axis=1)
+    validos = distancia > 1e-8
+    return s[validos], t[validos], n[validos], d[validos] / distancia[validos, None]
+
+# --- 3. MATRICES DINÁMICAS Y DIAGONALIZACIÓN POR LOTES ---
+
+def rejilla_k(rejilla=REJILLA_K):
+    """
+    Rejilla centrada en Γ (k = m/N): equivale a una supercelda periódica N1×N2×N3.
+    Como D(-k) = D(k)* (mismos autovalores y |autovectores|), de cada pareja ±k
+    sólo se conserva uno con peso 2. Devuelve (puntos k, pesos); los pesos suman N1·N2·N3.
+    """
+    rejilla = np.asarray(rejilla)
+    enteros = np.stack(np.meshgrid(*(np.arange(n) for n in rejilla), indexing='ij'), -1).reshape(-1, 3)
+    opuestos = np.mod(-enteros, rejilla)
+    codigo = lambda m: (m[:, 0] * rejilla[1] + m[:, 1]) * rejilla[2] + m[:, 2]
+    propio, opuesto = codigo(enteros), codigo(opuestos)
+    conservar = propio <= opuesto
+    pesos = np.where(propio == opuesto, 1.0, 2.0)[conservar]
+    return enteros[conservar] / rejilla, pesos
+
+def camino_k(camino=CAMINO_K, puntos=PUNTOS_POR_TRAMO):
+    """Puntos k a lo largo de un recorrido de alta simetría y posición de cada etiqueta."""
+    nodos = np.array([k for _, k in camino], dtype=float)
+    tramos = [nodos[i] + np.linspace(0, 1, puntos, endpoint=False)[:, None] * (nodos[i + 1] - nodos[i])
+              for i in range(len(nodos) - 1)]
+    ks = np.vstack(tramos + [nodos[-1:]])
+    return ks, [etiqueta for etiqueta, _ in camino], [i * puntos for i in range(len(camino))]
+
+def matrices_dinamicas(pares, n_sitios, ks, gamma=1.):
+    """
+    D(k) = Σ_n H(0, n)·e^{2πi k·n} para una tanda de puntos k (K × 3n × 3n),
+    en una sola multiplicación dispersa: la suma por par (s, t) de todas las imágenes.
+    """
+    from scipy import sparse
+
+    s, t, n, d = pares
+    bloques = -gamma * (d[:, :, None] * d[:, None, :]).reshape(-1, 9)
+    fases = np.exp(2j * np.pi * (n @ np.asarray(ks, dtype=float).T))
+    suma = sparse.csr_matrix((np.ones(len(s)), (s * n_sitios + t, np.arange(len(s)))),
+                             shape=(n_sitios * n_sitios, len(s)))
+    k = len(ks)
+    D = suma @ (fases[:, :, None] * bloques[:, None, :]).reshape(len(s), k * 9)
+    D = D.reshape(n_sitios, n_sitios, k, 3, 3).transpose(2, 0, 3, 1, 4).reshape(k, 3 * n_sitios, 3 * n_sitios)
+    # Diagonal: cada sitio acumula, con signo opuesto, los resortes que salen de él
+    propio = np.zeros((n_sitios, 9))
+    np.add.at(propio, s, -bloques)
+    for i in range(n_sitios):
+        D[:, 3 * i:3 * i + 3, 3 * i:3 * i + 3] += propio[i].reshape(3, 3)
+    return D
+
+def _tamano_tanda(n_pares, n_sitios):
+    por_k = 16 * max(9 * n_pares, 2 * (3 * n_sitios) ** 2)
+    return max(1, int(TANDA_MB * 2 ** 20 // por_k))
+
+def _resolver_tanda(pares, n_sitios, ks, gamma, pesos):
+    """Autovalores y contribución (ponderada) a la MSF por sitio de una tanda de puntos k."""
+    valores, vectores = np.linalg.eigh(matrices_dinamicas(pares, n_sitios, ks, gamma))
+    # Se excluyen los modos acústicos de Γ (traslación rígida de todo el cristal)
+    inversos = np.where(valores > CERO, 1.0 / np.where(valores > CERO, valores, 1.0), 0.0)
+    peso = np.abs(vectores) ** 2 * (inversos * pesos[:, None])[:, None, :]
+    msf = peso.sum(axis=(0, 2)).reshape(n_sitios, 3).sum(axis=1)
+    return valores, msf
+
+def _resolver_valores(pares, n_sitios, ks, gamma, pesos):
+    return np.linalg.eigvalsh(matrices_dinamicas(pares, n_sitios, ks, gamma))
+
+def _mapear(funcion, pares, n_sitios, ks, pesos, tamano, gamma, workers):
+    """Tandas de puntos k en secuencia o repartidas en procesos 'spawn'."""
+    tandas = [(pares, n_sitios, ks[i:i + tamano], gamma, pesos[i:i + tamano]) for i in range(0, len(ks), tamano)]
+    if workers <= 1 or len(tandas) == 1:
+        return [funcion(*tanda) for tanda in tandas]
+    contexto = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=contexto) as pool:
+        return list(pool.map(funcion, *zip(*tandas)))
+
+def analizar_red(celda, rejilla=REJILLA_K, cutoff=CUTOFF_RED, gamma=1., workers=1, camino=True, perfil=None):
+    """
+    Modos de la red periódica: matrices dinámicas 3n × 3n (n = sitios de la celda)
+    sobre una rejilla de puntos k, diagonalizadas por lotes. La MSF por sitio es la
+    media sobre la rejilla (idéntica a la de una supercelda periódica del mismo
+    tamaño), y el camino de alta simetría da la dispersión ω(k) = √λ.
+    """
+    from vally_profiling import PerfilNulo
+
+    perfil = perfil or PerfilNulo()
+    n_sitios = celda.numSitios()
+    with perfil.etapa('red'):
+        pares = pares_periodicos(celda, cutoff)
+    if len(pares[0]) == 0:
+        raise ValueError(f"Ningún par de sitios a menos de {cutoff} Å: aumenta el cutoff")
+    tamano = _tamano_tanda(len(pares[0]), n_sitios)
+
+    ks, pesos = rejilla_k(rejilla)
+    with perfil.etapa('modos'):
+        partes = _mapear(_resolver_tanda, pares, n_sitios, ks, pesos, tamano, gamma, workers)
+    valores = np.vstack([v for v, _ in partes])
+    msf = sum(m for _, m in partes) / pesos.sum()
+    resultado = {
+        'msf': msf,
+        'kpuntos': ks,
+        'pesos_k': pesos,
+        'frecuencias': np.sqrt(np.clip(valores, 0, None)),
+        'n_sitios': n_sitios,
+        'n_resortes': len(pares[0]) // 2,
+        'rejilla': tuple(rejilla),
+    }
+    if camino:
+        ks_camino, etiquetas, posiciones = camino_k()
+        with perfil.etapa('dispersion'):
+            partes = _mapear(_resolver_valores, pares, n_sitios, ks_camino, np.ones(len(ks_camino)), tamano,
+                             gamma, workers)
+        resultado.update(dispersion=np.sqrt(np.clip(np.vstack(partes), 0, None)), camino=ks_camino,
+                         camino_etiquetas=etiquetas, camino_posiciones=posiciones)
+    perfil.anotar(solver='bloch', n_sitios=n_sitios, n_kpuntos=len(ks), n_resortes=resultado['n_resortes'])
+    return resultado
+
+# --- 4. SALIDAS ---
+
+def guardar_resultado(resultado, nombre, directorio=DIRECTORIO_RED):
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"{nombre}_red.npz")
+    np.savez(ruta, **{k: np.asarray(v) for k, v in resultado.items()})
+    return ruta
+
+def graficar_dispersion(resultado, nombre, directorio='Plots'):
+    """Curvas de dispersión ω(k) a lo largo del camino de alta simetría."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(directorio, exist_ok=True)
+    plt.figure(figsize=(8, 5))
+    plt.plot(resultado['dispersion'], color='#4a6fa5', linewidth=0.8)
+    for posicion in resultado['camino_posiciones']:
+        plt.axvline(posicion, color='grey', linewidth=0.5)
+    plt.xticks(resultado['camino_posiciones'], resultado['camino_etiquetas'])
+    plt.xlim(0, len(resultado['dispersion']) - 1)
+    plt.ylabel('ω (unidades ANM)')
+    plt.title(f"VALLY Mineral: Dispersión de {nombre}")
+    ruta = os.path.join(directorio, f"Dispersion_{nombre}.png")
+    plt.savefig(ruta, dpi=200)
+    plt.close()
+    return ruta
+
+def imprimir_resumen(celda, resultado, top=10):
+    print("\n" + "=" * 55)
+    print(f" RED PERIÓDICA | {celda.titulo} | {resultado['n_sitios']} sitios | "
+          f"rejilla {'×'.join(map(str, resultado['rejilla']))}")
+    print("=" * 55)
+    print(f"Resortes por celda: {resultado['n_resortes']} | "
+          f"ω máx = {resultado['frecuencias'].max():.3f}")
+    print("Sitios más móviles:")
+    for i in np.argsort(resultado['msf'])[-top:][::-1]:
+        print(f"  {celda.elementos[i]}{i + 1}: MSF {resultado['msf'][i]:.4f} | B {celda.betas[i]:.2f}")
+    print("=" * 55)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vally lattice",
+                                     description="Modo mineral: dispersión y fluctuaciones de una red periódica.")
+    parser.add_argument('celda', nargs='+', help="PDB con CRYST1 (celda completa) o CIF cristalográfico.")
+    parser.add_argument('--rejilla', type=int, nargs=3, default=list(REJILLA_K), metavar=('N1', 'N2', 'N3'))
+    parser.add_argument('--cutoff', type=float, default=CUTOFF_RED, help="Alcance de los resortes (Å).")
+    parser.add_argument('--workers', type=int, default=1, help="Procesos para repartir los puntos k.")
+    parser.add_argument('--sin-grafico', action='store_true')
+    args = parser.parse_args(argv)
+
+    from vally_profiling import PerfilEtapas, formatear
+    for ruta in args.celda:
+        perfil = PerfilEtapas(ruta)
+        with perfil.etapa('parse'):
+            celda = leer_celda(ruta)
+        resultado = analizar_red(celda, args.rejilla, args.cutoff, workers=args.workers, perfil=perfil)
+        imprimir_resumen(celda, resultado)
+        print(f"Perfil: {formatear(perfil.resumen())}")
+        print(f"Resultados guardados: {guardar_resultado(resultado, celda.titulo)}")
+        if not args.sin_grafico:
+            print(f"Dispersión: {graficar_dispersion(resultado, celda.titulo)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Manifiesto de Trabajos del Batch (Reanudable e Incremental)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import json
+import hashlib
+import sqlite3
+import argparse
+import datetime
+
+RUTA_MANIFIESTO = os.path.join('Database', 'VALLY_Jobs.sqlite')
+# Parte de la clave: un cambio de versión del motor invalida los trabajos hechos
+VERSION_MOTOR = 'v1.7'
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    clave         TEXT PRIMARY KEY,
+    nombre        TEXT NOT NULL,
+    origen        TEXT,
+    content_hash  TEXT NOT NULL,
+    parametros    TEXT NOT NULL,
+    estado        TEXT NOT NULL,
+    intentos      INTEGER NOT NULL DEFAULT 0,
+    resultado_id  INTEGER,
+    salidas       TEXT,
+    error         TEXT,
+    duracion_s    REAL,
+    ejecucion     TEXT,
+    actualizado   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_trabajos_estado ON trabajos(estado);
+CREATE INDEX IF NOT EXISTS ix_trabajos_nombre ON trabajos(nombre);
+"""
+
+# 'degradado': hecho con un solver más ligero del previsto por falta de memoria
+ESTADOS = ('en_curso', 'hecho', 'degradado', 'fallido', 'diferido')
+
+# --- 1. CLAVE DE TRABAJO ---
+
+def hash_contenido(ruta=None, datos=None, bloque=2 ** 20):
+    """SHA-256 de los bytes de entrada tal cual están en disco (comprimidos incluidos)."""
+    h = hashlib.sha256()
+    if datos is not None:
+        h.update(datos)
+    else:
+        with open(ruta, 'rb') as f:
+            for trozo in iter(lambda: f.read(bloque), b''):
+                h.update(trozo)
+    return h.hexdigest()
+
+def clave_trabajo(content_hash, parametros):
+    """Contenido + parámetros del motor: renombrar un archivo no repite el trabajo, cambiar un ajuste sí."""
+    h = hashlib.sha256(content_hash.encode())
+    h.update(json.dumps(dict(parametros, version=VERSION_MOTOR), sort_keys=True).encode())
+    return h.hexdigest()
+
+def _ahora():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+# --- 2. MANIFIESTO ---
+
+class ManifiestoTrabajos:
+    """
+    Estado de cada trabajo del batch en SQLite (WAL, como la base de
+    resultados). Cada cambio de estado se confirma al momento: tras un kill,
+    los trabajos 'hecho' se saltan y los que quedaron 'en_curso' se repiten.
+    Los 'degradado' tienen resultado, pero se repiten cuando el presupuesto
+    permite el solver completo.
+    """
+
+    def __init__(self, ruta=RUTA_MANIFIESTO, timeout=60.0):
+        self.ruta = ruta
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        self.con = sqlite3.connect(ruta, timeout=timeout)
+        self.con.row_factory = sqlite3.Row
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=NORMAL')
+        self.con.executescript(ESQUEMA)
+        self.ejecucion = _ahora()
+
+    def cerrar(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def estado(self, clave):
+        fila = self.con.execute("SELECT estado FROM trabajos WHERE clave = ?", (clave,)).fetchone()
+        return None if fila is None else fila['estado']
+
+    def hecho(self, clave):
+        return self.estado(clave) == 'hecho'
+
+    def resultado(self, clave):
+        """resultado_id del trabajo hecho o degradado (para rehacer sus salidas sin recalcular), o None."""
+        fila = self.con.execute("SELECT resultado_id FROM trabajos WHERE clave = ? "
+                                "AND estado IN ('hecho', 'degradado')", (clave,)).fetchone()
+        return None if fila is None else fila['resultado_id']
+
+    def iniciar(self, clave, nombre, origen, content_hash, parametros):
+        with self.con:
+            self.con.execute(
+                "INSERT INTO trabajos (clave, nombre, origen, content_hash, parametros, estado, intentos, "
+                "ejecucion, actualizado) VALUES (?, ?, ?, ?, ?, 'en_curso', 1, ?, ?) "
+                "ON CONFLICT(clave) DO UPDATE SET nombre = excluded.nombre, origen = excluded.origen, "
+                "estado = 'en_curso', intentos = intentos + 1, error = NULL, "
+                "ejecucion = excluded.ejecucion, actualizado = excluded.actualizado",
+                (clave, nombre, origen, content_hash, json.dumps(parametros, sort_keys=True),
+                 self.ejecucion, _ahora()))
+
+    def terminar(self, clave, resultado_id=None, salidas=None, duracion=None, degradado=False):
+        with self.con:
+            self.con.execute(
+                "UPDATE trabajos SET estado = ?, resultado_id = ?, salidas = ?, duracion_s = ?, "
+                "actualizado = ? WHERE clave = ?",
+                ('degradado' if degradado else 'hecho', resultado_id, json.dumps(salidas or {}), duracion,
+                 _ahora(), clave))
+
+    def fallar(self, clave, error, duracion=None):
+        with self.con:
+            self.con.execute(
+                "UPDATE trabajos SET estado = 'fallido', error = ?, duracion_s = ?, actualizado = ? "
+                "WHERE clave = ?", (str(error), duracion, _ahora(), clave))
+
+    def diferir(self, clave, motivo):
+        """No cabe en el presupuesto de memoria ni con el solver más ligero: se intentará en otra ejecución."""
+        with self.con:
+            self.con.execute("UPDATE trabajos SET estado = 'diferido', error = ?, actualizado = ? WHERE clave = ?",
+                             (str(motivo), _ahora(), clave))
+
+    def interrumpidos(self):
+        """Trabajos que una ejecución anterior dejó a medias (proceso muerto o Ctrl+C)."""
+        return self.con.execute("SELECT COUNT(*) FROM trabajos WHERE estado = 'en_curso' "
+                                "AND ejecucion != ?", (self.ejecucion,)).fetchone()[0]
+
+    def resumen(self):
+        filas = self.con.execute("SELECT estado, COUNT(*) AS n FROM trabajos GROUP BY estado")
+        return {fila['estado']: fila['n'] for fila in filas}
+
+    def listar(self, estado=None, limite=None):
+        sql, valores = "SELECT * FROM trabajos", []
+        if estado:
+            sql += " WHERE estado = ?"
+            valores.append(estado)
+        sql += " ORDER BY actualizado DESC"
+        if limite:
+            sql += f" LIMIT {int(limite)}"
+        return [dict(fila) for fila in self.con.execute(sql, valores)]
+
+    def olvidar(self, estado=None):
+        """Borra entradas (todas o las de un estado) para forzar que se repitan."""
+        with self.con:
+            if estado:
+                return self.con.execute("DELETE FROM trabajos WHERE estado = ?", (estado,)).rowcount
+            return self.con.execute("DELETE FROM trabajos").rowcount
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estado del manifiesto de trabajos del batch VALLY-Scan.")
+    parser.add_argument("--manifiesto", default=RUTA_MANIFIESTO)
+    parser.add_argument("--estado", choices=ESTADOS, help="Listar sólo los trabajos en este estado.")
+    parser.add_argument("--limite", type=int, default=20)
+    parser.add_argument("--olvidar", action='store_true',
+                        help="Borrar las entradas listadas (todas o las de --estado) para que se repitan.")
+    args = parser.parse_args()
+
+    with ManifiestoTrabajos(args.manifiesto) as manifiesto:
+        if args.olvidar:
+            print(f"Entradas borradas: {manifiesto.olvidar(args.estado)}")
+        print("Resumen: " + (", ".join(f"{k}={v}" for k, v in manifiesto.resumen().items()) or "vacío"))
+        for fila in manifiesto.listar(args.estado, args.limite):
+            detalle = fila['error'] if fila['estado'] in ('fallido', 'diferido') else f"resultado {fila['resultado_id']}"
+            print(f"{fila['actualizado']} | {fila['estado']:<9} | {fila['nombre']:<24} | "
+                  f"intentos {fila['intentos']} | {detalle}")
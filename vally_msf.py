@@ -0,0 +1,169 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - MSF Directa (Diagonal de la Pseudo-inversa) sin Modos
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import numpy as np
+from scipy import sparse
+
+# Hasta estos grados de libertad se factoriza (LU) la Hessiana; por encima,
+# gradiente conjugado por bloques (sólo la Hessiana y las sondas en memoria).
+DOF_LU = 60000
+MODOS_DEFLACION = 10
+SONDAS_POR_TANDA = 16
+MAX_SONDAS = 256
+# Error estándar relativo (mediana por residuo) al que se deja de añadir sondas
+TOLERANCIA_MSF = 0.02
+TOL_CG = 1e-6
+MAX_ITER_CG = 5000
+
+# --- 1. APLICACIÓN DE LA PSEUDO-INVERSA A UN BLOQUE DE SONDAS ---
+
+def _proyector(base):
+    """X -> X - Q·QᵀX: elimina las componentes de cuerpo rígido (y de los modos deflactados)."""
+    return lambda X: X - base @ (base.T @ X)
+
+def _pcg_bloque(hessiana, B, proyectar, tol=TOL_CG, max_iter=MAX_ITER_CG):
+    """
+    Gradiente conjugado con precondicionador de Jacobi sobre todas las columnas a
+    la vez (un producto disperso H·P por iteración para todo el bloque). El
+    precondicionador se proyecta para que las iteraciones no salgan del subespacio.
+    Devuelve (X, iteraciones, residuo relativo máximo).
+    """
+    inversa_diagonal = (1.0 / hessiana.diagonal())[:, None]
+    X = np.zeros_like(B)
+    R = B.copy()
+    Z = proyectar(inversa_diagonal * R)
+    P = Z.copy()
+    rz = np.einsum('ij,ij->j', R, Z)
+    norma_b = np.linalg.norm(B, axis=0)
+    norma_b[norma_b == 0] = 1.0
+    residuo = np.ones(B.shape[1])
+    for iteracion in range(1, max_iter + 1):
+        HP = hessiana @ P
+        alfa = rz / np.einsum('ij,ij->j', P, HP)
+        X += P * alfa
+        R -= HP * alfa
+        residuo = np.linalg.norm(R, axis=0) / norma_b
+        if np.all(residuo < tol):
+            break
+        Z = proyectar(inversa_diagonal * R)
+        rz_nuevo = np.einsum('ij,ij->j', R, Z)
+        P = Z + P * (rz_nuevo / rz)
+        rz = rz_nuevo
+    return proyectar(X), iteracion, float(residuo.max())
+
+def _resolvente_lu(hessiana, proyectar):
+    """Factoriza H + εI una vez; cada bloque de sondas es sólo sustitución hacia atrás."""
+    from scipy.sparse.linalg import splu
+    dof = hessiana.shape[0]
+    # ε mínimo para que la factorización exista; las componentes rígidas se proyectan fuera
+    epsilon = 1e-8 * float(np.mean(hessiana.diagonal()))
+    lu = splu((hessiana + epsilon * sparse.identity(dof, format='csc')).tocsc(), permc_spec='MMD_AT_PLUS_A',
+              diag_pivot_thresh=0., options=dict(SymmetricMode=True))
+    return lambda Z: (proyectar(lu.solve(proyectar(Z))), 0, 0.0)
+
+# --- 2. ESTIMADOR DE HUTCHINSON CON DEFLACIÓN ---
+
+def estimar_msf(calpha, cutoff=15., gamma=1., modos_deflacion=MODOS_DEFLACION, tolerancia=TOLERANCIA_MSF,
+                max_sondas=MAX_SONDAS, sondas_por_tanda=SONDAS_POR_TANDA, resolvente='auto', semilla=0,
+                perfil=None):
+    """
+    MSF de cada residuo = traza de su bloque 3×3 en la diagonal de H⁺ (todos los
+    modos, no sólo los n_modes del pipeline), sin descomposición completa:
+
+      - los `modos_deflacion` modos más bajos se calculan exactamente (LOBPCG) y
+        aportan su parte de la diagonal; son los que crean las correlaciones de
+        largo alcance que hacen ruidoso al estimador,
+      - el resto se estima con sondas de Rademacher z: diag(A) ≈ media(z ⊙ A·z),
+        resolviendo H·x = z por LU dispersa o gradiente conjugado por bloques,
+      - se añaden tandas de sondas hasta que el error estándar relativo (mediana)
+        baja de `tolerancia` o se llega a `max_sondas`.
+    """
+    from vally_profiling import PerfilNulo
+    from vally_solver import base_cuerpo_rigido, construir_hessiana_dispersa, resolver_modos_lobpcg
+
+    # Al menos una tanda completa, y dos sondas para que exista la varianza
+    if sondas_por_tanda < 2:
+        raise ValueError(f"sondas_por_tanda debe ser ≥ 2 (recibido {sondas_por_tanda})")
+    if max_sondas < sondas_por_tanda:
+        raise ValueError(f"max_sondas ({max_sondas}) no alcanza para una tanda de {sondas_por_tanda} sondas")
+    perfil = perfil or PerfilNulo()
+    coords = np.asarray(calpha.getCoords() if hasattr(calpha, 'getCoords') else calpha, dtype=float)
+    n_atoms, dof = len(coords), 3 * len(coords)
+    with perfil.etapa('hessiana'):
+        hessiana = construir_hessiana_dispersa(coords, cutoff, gamma)
+
+    exacta = np.zeros(n_atoms)
+    base = base_cuerpo_rigido(coords)
+    modos_deflacion = min(modos_deflacion, max(dof // 5 - 6, 0))
+    with perfil.etapa('deflacion'):
+        if modos_deflacion:
+            valores, vectores = resolver_modos_lobpcg(hessiana, coords, modos_deflacion)
+            exacta = ((vectores ** 2) / valores).reshape(n_atoms, 3, -1).sum(axis=(1, 2))
+            base = np.hstack([base, vectores])
+    proyectar = _proyector(base)
+
+    if resolvente == 'auto':
+        resolvente = 'lu' if dof <= DOF_LU else 'cg'
+    with perfil.etapa('factorizacion'):
+        if resolvente == 'lu':
+            aplicar = _resolvente_lu(hessiana, proyectar)
+        elif resolvente == 'cg':
+            aplicar = lambda Z: _pcg_bloque(hessiana, proyectar(Z), proyectar)
+        else:
+            raise ValueError(f"Resolvente desconocido: {resolvente}")
+
+    rng = np.random.default_rng(semilla)
+    suma, suma_cuadrados, tandas = np.zeros(n_atoms), np.zeros(n_atoms), []
+    iteraciones, residuo_max = 0, 0.0
+    with perfil.etapa('sondas'):
+        while len(tandas) * sondas_por_tanda < max_sondas:
+            Z = rng.choice([-1.0, 1.0], size=(dof, sondas_por_tanda))
+            X, iters, residuo = aplicar(Z)
+            iteraciones, residuo_max = iteraciones + iters, max(residuo_max, residuo)
+            muestras = (Z * X).reshape(n_atoms, 3, -1).sum(axis=1)  # N × sondas
+            suma += muestras.sum(axis=1)
+            suma_cuadrados += (muestras ** 2).sum(axis=1)
+            tandas.append(muestras.mean(axis=1))
+            k = len(tandas) * sondas_por_tanda
+            varianza = np.maximum(suma_cuadrados / k - (suma / k) ** 2, 0) * k / (k - 1)
+            error = np.sqrt(varianza / k)
+            msf = exacta + suma / k
+            if len(tandas) >= 2 and np.median(error / msf) < tolerancia:
+                break
+
+    perfil.anotar(msf_metodo='hutchinson', resolvente=resolvente, n_sondas=k, modos_deflacion=modos_deflacion,
+                  n_atoms=n_atoms, dof=dof, nnz_hessiana=int(hessiana.nnz))
+    return {
+        'msf': msf,
+        'msf_error': error,
+        'exacta': exacta,
+        'tandas': np.array(tandas).T,  # N × T: medias por tanda para el jackknife
+        'n_sondas': k,
+        'resolvente': resolvente,
+        'modos_deflacion': modos_deflacion,
+        'iteraciones_cg': iteraciones,
+        'residuo_max': residuo_max,
+    }
+
+# --- 3. PEARSON CON BARRA DE ERROR ---
+
+def _pearson_columnas(M, b):
+    M = M - M.mean(axis=0)
+    b = b - b.mean()
+    normas = np.linalg.norm(M, axis=0) * np.linalg.norm(b)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(normas > 0, (b @ M) / normas, np.nan)
+
+def pearson_con_error(estimacion, b_factors):
+    """r de Pearson de la MSF estimada y su error estándar jackknife (dejando fuera una tanda de sondas)."""
+    b = np.asarray(b_factors, dtype=float)
+    tandas, exacta = estimacion['tandas'], estimacion['exacta']
+    t = tandas.shape[1]
+    r = float(_pearson_columnas(estimacion['msf'][:, None], b)[0])
+    if t < 2:
+        return r, float('nan')
+    sin_una = exacta[:, None] + (tandas.sum(axis=1, keepdims=True) - tandas) / (t - 1)
+    r_jack = _pearson_columnas(sin_una, b)
+    return r, float(np.sqrt((t - 1) / t * np.sum((r_jack - r_jack.mean()) ** 2)))
@@ -0,0 +1,122 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Planificador del Batch con Control de Memoria
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import numpy as np
+
+# Modelo de coste calibrado con las redes sintéticas de vally_bench (glóbulo, 1 hilo BLAS):
+#   denso:    la Hessiana 3N×3N y la copia de eigh -> ~2·72·N² bytes; tiempo ∝ N³
+#   disperso: Hessiana CSR (ensamblado con índices int32) + bloque LOBPCG -> ~30 KB por Cα; tiempo ∝ N^1.6
+#   RTB:      tandas de resortes de tamaño fijo (~250 MB) + ~10 KB por Cα
+MB_BASE_WORKER = 150.0
+BYTES_DENSO_POR_N2 = 144.0
+KB_DISPERSO_POR_CA = 30.0
+MB_RTB_TANDAS, KB_RTB_POR_CA = 250.0, 10.0
+SEGUNDOS_DENSO_POR_N3 = 6.6e-9
+SEGUNDOS_DISPERSO_3000, EXPONENTE_DISPERSO = 8.4, 1.6
+SEGUNDOS_RTB_POR_CA = 1.5e-3
+# precision='float32': Hessiana y autovectores ocupan la mitad (los índices CSR no cambian)
+FACTOR_MEMORIA = {'float64': 1.0, 'float32': 0.5}
+# Cadena de solvers de menor memoria a la que se degrada un trabajo que no cabe
+DEGRADACION = {'dense': 'sparse', 'sparse': 'rtb', 'rtb': None}
+# Estructuras leídas por delante para ordenar por tamaño sin cargar todo el inventario
+VENTANA = 32
+# Veces que el trabajo mayor puede ser adelantado por otros antes de reservarle la memoria
+MAX_ADELANTOS = 4
+
+# --- 1. PREDICCIÓN DE COSTE ---
+
+def resolver_solver(n_calpha, solver='auto'):
+    """La misma elección que calcular_modos con solver='auto' (sin serie)."""
+    from vally_solver import UMBRAL_DISPERSO, UMBRAL_RTB
+    if solver != 'auto':
+        return solver
+    return 'rtb' if n_calpha > UMBRAL_RTB else 'sparse' if n_calpha > UMBRAL_DISPERSO else 'dense'
+
+def estimar_coste(n_calpha, solver='auto', precision='float64'):
+    """Memoria pico (MB, incluido el proceso) y tiempo (s) previstos antes de construir nada."""
+    solver = resolver_solver(n_calpha, solver)
+    n = float(n_calpha)
+    if solver == 'dense':
+        memoria = BYTES_DENSO_POR_N2 * n ** 2 / 2 ** 20
+        tiempo = SEGUNDOS_DENSO_POR_N3 * n ** 3
+    elif solver == 'sparse':
+        memoria = KB_DISPERSO_POR_CA * n / 1024
+        tiempo = SEGUNDOS_DISPERSO_3000 * (n / 3000) ** EXPONENTE_DISPERSO
+    else:
+        memoria = MB_RTB_TANDAS + KB_RTB_POR_CA * n / 1024
+        tiempo = SEGUNDOS_RTB_POR_CA * n
+    return {'solver': solver, 'n_calpha': int(n_calpha), 'precision': precision,
+            'memoria_mb': MB_BASE_WORKER + memoria * FACTOR_MEMORIA[precision], 'tiempo_s': tiempo}
+
+def ajustar_a_presupuesto(coste, presupuesto_mb):
+    """
+    Degrada el solver (denso -> disperso -> RTB) hasta que el trabajo quepa solo
+    en el presupuesto. Devuelve el coste ajustado o None si ni así cabe (se difiere).
+    """
+    while coste['memoria_mb'] > presupuesto_mb:
+        siguiente = DEGRADACION[coste['solver']]
+        if siguiente is None:
+            return None
+        coste = dict(estimar_coste(coste['n_calpha'], siguiente, coste['precision']), degradado=True)
+    return coste
+
+def presupuesto_por_defecto(fraccion=0.8):
+    """Una fracción de la memoria disponible ahora mismo (MB)."""
+    import psutil
+    return fraccion * psutil.virtual_memory().available / 2 ** 20
+
+# --- 2. ADMISIÓN: EMPAQUETADO DE MAYOR A MENOR ---
+
+class Planificador:
+    """
+    Ventana de trabajos pendientes ordenada por memoria prevista. Se lanza el
+    mayor que cabe en lo que queda del presupuesto (y con worker libre); los
+    pequeños rellenan los huecos. Para que el mayor no espere indefinidamente,
+    tras MAX_ADELANTOS adelantamientos se le reserva la memoria que va quedando.
+    """
+
+    def __init__(self, presupuesto_mb, workers=1):
+        self.presupuesto_mb, self.workers = presupuesto_mb, workers
+        self.pendientes, self.en_curso = [], {}
+        self._adelantos = 0
+
+    @property
+    def memoria_en_uso(self):
+        return sum(coste['memoria_mb'] for coste in self.en_curso.values())
+
+    def encolar(self, trabajo, coste):
+        self.pendientes.append((trabajo, coste))
+        self.pendientes.sort(key=lambda t: (t[1]['memoria_mb'], t[1]['tiempo_s']), reverse=True)
+
+    def siguiente(self):
+        """(trabajo, coste) a lanzar ahora, o None si hay que esperar a que termine alguno."""
+        if not self.pendientes or len(self.en_curso) >= self.workers:
+            return None
+        libre = self.presupuesto_mb - self.memoria_en_uso
+        for posicion, (trabajo, coste) in enumerate(self.pendientes):
+            if coste['memoria_mb'] <= libre:
+                if posicion == 0:
+                    self._adelantos = 0
+                elif self._adelantos >= MAX_ADELANTOS:
+                    return None
+                else:
+                    self._adelantos += 1
+                del self.pendientes[posicion]
+                self.en_curso[id(trabajo)] = coste
+                return trabajo, coste
+        return None
+
+    def liberar(self, trabajo):
+        self.en_curso.pop(id(trabajo), None)
+
+def resumen_plan(costes):
+    """Texto con la previsión de un conjunto de trabajos (para el log del batch)."""
+    if not costes:
+        return "sin trabajos"
+    memoria = np.array([c['memoria_mb'] for c in costes])
+    tiempo = sum(c['tiempo_s'] for c in costes)
+    degradados = sum(1 for c in costes if c.get('degradado'))
+    return (f"{len(costes)} trabajos | memoria prevista máx {memoria.max():.0f} MB "
+            f"| tiempo previsto {tiempo:.0f} s | degradados a solver de menos memoria: {degradados}")
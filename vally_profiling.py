@@ -0,0 +1,161 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Instrumentación por Etapas (Tiempo / CPU / Memoria)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+from contextlib import contextmanager
+
+# Traza JSONL opcional (una línea por etapa); los workers 'spawn' la heredan por entorno
+VARIABLE_TRAZA = 'VALLY_TRACE'
+
+# --- 1. MEMORIA PICO ---
+
+def _leer_hwm_mb():
+    """VmHWM de Linux (pico de RSS desde el último reinicio), o None si no existe."""
+    try:
+        with open('/proc/self/status') as f:
+            for linea in f:
+                if linea.startswith('VmHWM:'):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _reiniciar_hwm():
+    """En Linux, escribir '5' en clear_refs reinicia el pico: así cada etapa mide el suyo."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+# El pico (VmHWM) es uno por proceso: reiniciarlo para una etapa borraría el de
+# las etapas abiertas alrededor (anidadas o en otros hilos: render, prefetch).
+# Antes de cada reinicio el pico vigente se guarda en todas las etapas abiertas.
+_etapas_abiertas = {}
+_cerrojo_pico = threading.Lock()
+
+def _abrir_pico():
+    """Empieza la medida de pico de una etapa; devuelve (testigo, si el SO permitió reiniciarlo)."""
+    testigo = object()
+    with _cerrojo_pico:
+        hwm = _leer_hwm_mb()
+        if hwm is not None:
+            for abierta, pico in _etapas_abiertas.items():
+                _etapas_abiertas[abierta] = max(pico, hwm)
+        reiniciado = _reiniciar_hwm()
+        _etapas_abiertas[testigo] = 0.0
+    return testigo, reiniciado
+
+def _cerrar_pico(testigo):
+    """Pico de RSS de la etapa: el mayor entre lo guardado en reinicios ajenos y el VmHWM actual."""
+    with _cerrojo_pico:
+        return max(_etapas_abiertas.pop(testigo), rss_pico_mb())
+
+def rss_pico_mb():
+    """Pico de memoria residente del proceso en MB (acumulado si el SO no permite reiniciarlo)."""
+    hwm = _leer_hwm_mb()
+    if hwm is not None:
+        return hwm
+    try:
+        import resource
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / 1024 if sys.platform != 'darwin' else pico / 1024 ** 2
+    except ImportError:  # Windows
+        import psutil
+        memoria = psutil.Process().memory_info()
+        return getattr(memoria, 'peak_wset', memoria.rss) / 1024 ** 2
+
+# --- 2. PERFIL DE UNA EJECUCIÓN ---
+
+class PerfilEtapas:
+    """
+    Tiempo de pared, tiempo de CPU y pico de memoria de cada etapa del pipeline,
+    más anotaciones libres (tamaño de la Hessiana, solver, caché...).
+    Las etapas pueden anidarse o solaparse entre hilos; el pico es el del
+    proceso durante la etapa (incluye lo que asignen otros hilos a la vez).
+
+        perfil = PerfilEtapas('6LU7.pdb')
+        with perfil.etapa('parse'):
+            calpha = leer_calpha(ruta)
+        perfil.anotar(n_atoms=calpha.numAtoms())
+    """
+
+    def __init__(self, nombre='', traza=None):
+        self.nombre = nombre
+        self.etapas = []
+        self.anotaciones = {}
+        self.traza = traza if traza is not None else os.environ.get(VARIABLE_TRAZA)
+
+    @contextmanager
+    def etapa(self, nombre, **extra):
+        testigo, pico_por_etapa = _abrir_pico()
+        inicio_pared, inicio_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield self
+        finally:
+            medida = {
+                'etapa': nombre,
+                'wall_s': round(time.perf_counter() - inicio_pared, 6),
+                'cpu_s': round(time.process_time() - inicio_cpu, 6),
+                'rss_pico_mb': round(_cerrar_pico(testigo), 1),
+                'pico_por_etapa': pico_por_etapa,
+            }
+            medida.update(extra)
+            self.etapas.append(medida)
+            if self.traza:
+                self._escribir_traza(medida)
+
+    def anotar(self, **valores):
+        self.anotaciones.update(valores)
+
+    def tiempos(self):
+        """{etapa: segundos de pared} (las etapas repetidas se suman)."""
+        salida = {}
+        for m in self.etapas:
+            salida[m['etapa']] = salida.get(m['etapa'], 0.0) + m['wall_s']
+        return salida
+
+    def resumen(self):
+        """Diccionario serializable a JSON para reportes, base de resultados y benchmarks."""
+        return {
+            'etapas': list(self.etapas),
+            'total_wall_s': round(sum(m['wall_s'] for m in self.etapas), 6),
+            'total_cpu_s': round(sum(m['cpu_s'] for m in self.etapas), 6),
+            'rss_pico_mb': max((m['rss_pico_mb'] for m in self.etapas), default=0.0),
+            **self.anotaciones,
+        }
+
+    def _escribir_traza(self, medida):
+        linea = dict(medida, nombre=self.nombre, pid=os.getpid(),
+                     timestamp=datetime.datetime.now().isoformat(timespec='milliseconds'))
+        try:
+            directorio = os.path.dirname(self.traza)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            # Líneas cortas en modo 'a': varios procesos pueden compartir la traza
+            with open(self.traza, 'a') as f:
+                f.write(json.dumps(linea) + "\n")
+        except OSError:
+            pass  # la instrumentación nunca debe romper un análisis
+
+class PerfilNulo:
+    """Misma interfaz que PerfilEtapas sin medir nada (valor por defecto en las funciones)."""
+
+    @contextmanager
+    def etapa(self, nombre, **extra):
+        yield self
+
+    def anotar(self, **valores):
+        pass
+
+def formatear(resumen):
+    """Una línea legible: 'parse 0.01 s | hessiana 0.40 s | ...'."""
+    return " | ".join(f"{m['etapa']} {m['wall_s']:.2f} s" for m in resumen.get('etapas', []))
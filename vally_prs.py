@@ -0,0 +1,162 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Perturbation Response Scanning (PRS) por Bloques
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import sys
+import argparse
+import numpy as np
+
+DIRECTORIO_PRS = 'PRS'
+# Memoria de trabajo de cada bloque G[filas, columnas] (float64)
+BLOQUE_MB = 64
+CRITERIOS_HOTSPOT = ('msf', 'efector', 'sensor')
+
+# --- 1. MATRIZ DE RESPUESTA ---
+
+def _modos_ponderados(modelo, valores=None):
+    """U = V·λ^(-1/2): así la covarianza (pseudo-inversa de la Hessiana) es G = U·Uᵀ."""
+    if valores is None:
+        vectores, valores = modelo.getEigvecs(), modelo.getEigvals()
+    else:
+        vectores = modelo
+    vectores = np.asarray(vectores, dtype=float)
+    valores = np.asarray(valores, dtype=float)
+    if vectores.ndim != 2 or vectores.shape[0] % 3:
+        raise ValueError(f"Se esperaban eigenvectores 3N × k; recibido {vectores.shape}")
+    return vectores / np.sqrt(valores)
+
+def matriz_respuesta(modelo, valores=None, bloque_mb=BLOQUE_MB):
+    """
+    Matriz PRS cruda P[i, j] = ||G_ij||²_F: respuesta media del residuo j a una
+    fuerza unitaria de dirección aleatoria en i (límite de muchas fuerzas,
+    igual que calcPerturbResponse de ProDy con turbo=True).
+
+    Una sola descomposición: G = U·Uᵀ se evalúa por bloques de residuos con
+    GEMMs (U[filas]·U[columnas]ᵀ) sin formar la covarianza 3N × 3N completa.
+    Como G es simétrica sólo se calculan los bloques j ≥ i y se refleja.
+    `modelo` es un ANM (o similar) o la matriz de eigenvectores con `valores`.
+    """
+    U = _modos_ponderados(modelo, valores)
+    n = U.shape[0] // 3
+    # Residuos por bloque para que G[filas, columnas] quepa en bloque_mb
+    paso = max(1, int(bloque_mb * 2 ** 20 / (8 * 9 * n)))
+    P = np.empty((n, n))
+    for a in range(0, n, paso):
+        b = min(a + paso, n)
+        G = U[3 * a:3 * b] @ U[3 * a:].T
+        G *= G
+        # Suma de los bloques 3×3: (filas, 3, columnas, 3) -> (filas, columnas)
+        P[a:b, a:] = G.reshape(b - a, 3, n - a, 3).sum(axis=(1, 3))
+        P[b:, a:b] = P[a:b, b:].T
+    return P
+
+def perfiles_prs(P, normalizar=True):
+    """
+    Efectividad (capacidad de un residuo para perturbar al resto, media por fila)
+    y sensibilidad (cuánto responde a perturbaciones ajenas, media por columna),
+    excluyendo la auto-respuesta. Con normalizar=True cada fila se divide por su
+    diagonal, como en ProDy; la normalización se hace sobre P en sitio.
+    """
+    n = P.shape[0]
+    if normalizar:
+        diagonal = np.diag(P).copy()
+        diagonal[diagonal == 0] = 1.0
+        P /= diagonal[:, None]
+    propia = np.diag(P).copy()
+    divisor = max(n - 1, 1)
+    efectividad = (P.sum(axis=1) - propia) / divisor
+    sensibilidad = (P.sum(axis=0) - propia) / divisor
+    return efectividad, sensibilidad
+
+def escanear(modelo, valores=None, bloque_mb=BLOQUE_MB, devolver_matriz=False):
+    """Matriz + perfiles en un paso. Devuelve (efectividad, sensibilidad[, matriz normalizada])."""
+    P = matriz_respuesta(modelo, valores, bloque_mb)
+    efectividad, sensibilidad = perfiles_prs(P)
+    if devolver_matriz:
+        return efectividad, sensibilidad, P
+    return efectividad, sensibilidad
+
+# --- 2. RANKING DE HOTSPOTS ---
+
+def ranking_hotspots(msf, efectividad=None, sensibilidad=None, criterio='msf', top=5):
+    """
+    Índices de los `top` residuos según el criterio: 'msf' (flexibilidad, el
+    ranking clásico), 'efector' (propagan perturbaciones: candidatos alostéricos)
+    o 'sensor' (responden a ellas).
+    """
+    perfiles = {'msf': msf, 'efector': efectividad, 'sensor': sensibilidad}
+    if criterio not in perfiles:
+        raise ValueError(f"Criterio de hotspots desconocido: {criterio}")
+    puntuacion = perfiles[criterio]
+    if puntuacion is None:
+        raise ValueError(f"El criterio '{criterio}' necesita los perfiles PRS")
+    return np.argsort(puntuacion)[-top:][::-1]
+
+# --- 3. LÍNEA DE COMANDOS ---
+
+def analizar_estructura(ruta, n_modes=30, solver='auto', perfil=None):
+    """Lectura + ANM + PRS de un archivo. Devuelve un diccionario con los perfiles."""
+    from vally_io import leer_calpha
+    from vally_solver import calcular_modos
+    from vally_profiling import PerfilEtapas
+
+    perfil = perfil or PerfilEtapas(ruta)
+    with perfil.etapa('parse'):
+        calpha = leer_calpha(ruta)
+    if calpha.numAtoms() == 0:
+        raise ValueError(f"No se encontraron Carbonos Alfa en {ruta}")
+    anm, info = calcular_modos(calpha, n_modes=n_modes, solver=solver, nombre=ruta, perfil=perfil)
+    with perfil.etapa('prs'):
+        efectividad, sensibilidad = escanear(anm)
+    return {
+        'efectividad': efectividad,
+        'sensibilidad': sensibilidad,
+        'resnums': calpha.getResnums(),
+        'resnames': calpha.getResnames(),
+        'chids': calpha.getChids(),
+        'n_modes': info['n_modes'],
+        'solver': f"{info['solver']}/{info['metodo']}",
+        'perfil': perfil.resumen(),
+    }
+
+def imprimir_resumen(resultado, top=10):
+    print("\n" + "=" * 55)
+    print(f" PRS | {len(resultado['resnums'])} residuos | {resultado['n_modes']} modos ({resultado['solver']})")
+    print("=" * 55)
+    for titulo, clave in (("Efectores", 'efectividad'), ("Sensores", 'sensibilidad')):
+        print(f"{titulo} principales:")
+        for i in np.argsort(resultado[clave])[-top:][::-1]:
+            print(f"  {resultado['resnames'][i]} {resultado['resnums'][i]} ({resultado['chids'][i]}): "
+                  f"{resultado[clave][i]:.4f}")
+    print("=" * 55)
+
+def guardar_resultado(resultado, nombre, directorio=DIRECTORIO_PRS):
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"{nombre}_prs.npz")
+    np.savez(ruta, **{k: resultado[k] for k in ('efectividad', 'sensibilidad', 'resnums', 'resnames', 'chids')})
+    return ruta
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vally prs",
+                                     description="Perfiles de efectores y sensores (PRS) desde una descomposición ANM.")
+    parser.add_argument('pdb', nargs='+', help="Archivo(s) PDB/mmCIF.")
+    parser.add_argument('--modos', type=int, default=30,
+                        help="Modos de la pseudo-inversa (0 = todos: PRS exacto, Hessiana densa).")
+    parser.add_argument('--solver', choices=['auto', 'dense', 'sparse', 'rtb'], default='auto')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    from vally_profiling import formatear
+    n_modes, solver = (args.modos, args.solver) if args.modos > 0 else (None, 'dense')
+    for ruta in args.pdb:
+        resultado = analizar_estructura(ruta, n_modes, solver)
+        imprimir_resumen(resultado, args.top)
+        print(f"Perfil: {formatear(resultado['perfil'])}")
+        nombre = os.path.splitext(os.path.basename(ruta))[0]
+        print(f"Perfiles guardados: {guardar_resultado(resultado, nombre)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Etapa de Renderizado (Gráficos y Reportes PDF)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import json
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fpdf import FPDF
+from vally_profiling import PerfilEtapas
+from vally_io import nombre_estructura
+
+# --- 1. MOTOR DE RENDERIZADO PREMIUM (Identidad Visual VALLY) ---
+class VALLY_Premium_Report(FPDF):
+    def __init__(self, pdb_id):
+        super().__init__()
+        self.pdb_id = pdb_id
+        self.logo_path = 'logo_proyecto.png'
+
+    def header(self):
+        # Banner Superior: Azul Oxford (Identidad Corporativa)
+        self.set_fill_color(0, 32, 63); self.rect(0, 0, 210, 45, 'F')
+        # Banner de Lema: Azul Soberanía
+        self.set_fill_color(0, 50, 90); self.rect(0, 45, 210, 8, 'F')
+        self.set_xy(0, 46.5); self.set_text_color(255, 255, 255); self.set_font("Helvetica", 'B', 9)
+        self.cell(210, 5, "CIENCIA Y SOBERANIA EN SALUD | PROYECTO VALLY", 0, 0, 'C')
+        
+        logo_x = 15
+        if os.path.exists(self.logo_path):
+            self.image(self.logo_path, 15, 10, 28); logo_x = 48
+            
+        self.set_xy(logo_x, 12); self.set_text_color(255, 255, 255); self.set_font("Helvetica", 'B', 22)
+        self.cell(0, 10, "VALLY-SCAN INSTRUMENT", ln=True)
+        self.set_font("Helvetica", '', 10); self.set_x(logo_x)
+        self.cell(0, 5, "VIBRATIONAL ANALYSIS & LOCAL LIGAND YIELDING", ln=True)
+        self.set_font("Helvetica", 'I', 9); self.set_x(logo_x)
+        self.cell(0, 5, "FRAMEWORK v1.7 | UNIVERSAL EDITION | R2 SYSTEM", ln=True)
+
+    def footer(self):
+        self.set_y(-25); self.set_draw_color(0, 32, 63); self.line(10, self.get_y(), 200, self.get_y())
+        self.set_font("Helvetica", 'I', 8); self.set_text_color(100); self.ln(2)
+        self.cell(0, 10, "PROYECTO VALLY - PROPIEDAD INTELECTUAL DE LIONELL E. NAVA RAMOS", align='C')
+        self.set_y(-15); self.cell(0, 10, f"Pagina {self.page_no()}", align='R')
+
+# --- 2. RENDERIZADO A PARTIR DE UN REGISTRO DE RESULTADOS ---
+
+def ruta_grafico(pdb_file):
+    return os.path.join('Plots', f"Plot_{nombre_estructura(pdb_file)}.png")
+
+def ruta_pdf(pdb_file):
+    return os.path.join('Reports', f"VALLY_Scan_Report_{nombre_estructura(pdb_file)}.pdf")
+
+def renderizar_grafico(registro):
+    """Figura X del preprint (dpi=300) a partir del registro del motor."""
+    import matplotlib.pyplot as plt
+    pdb_file, r_val = registro['pdb'], registro['pearson_r']
+    msf, b_factors = registro['msf'], registro['b_factors']
+
+    # --- GENERACIÓN DE GRÁFICO (FIGURE X PREPRINT) ---
+    plt.figure(figsize=(10, 5))
+    m_z = (msf - np.mean(msf)) / np.std(msf)
+    b_z = (b_factors - np.mean(b_factors)) / np.std(b_factors)
+    plt.plot(m_z, color='#00203F', label='VALLY Simulation (ANM)', lw=2)
+    plt.plot(b_z, color='#32CD32', label='Experimental Data (B-factors)', ls='--', alpha=0.6)
+    plt.title(f"R2 Validation System | {pdb_file.upper()} | r = {round(r_val, 3)}")
+    plt.legend(loc='best', frameon=True, shadow=True)
+    plt.grid(True, alpha=0.25); plt.xlabel("Residue Index"); plt.ylabel("Standardized Fluctuation")
+
+    plot_path = ruta_grafico(pdb_file)
+    plt.savefig(plot_path, dpi=300); plt.close()
+    return plot_path
+
+def renderizar_pdf(registro, plot_path):
+    """Reporte técnico VALLY_Premium_Report con la figura ya renderizada."""
+    pdb_file, r_val = registro['pdb'], registro['pearson_r']
+    info_sys, info_solver = registro['info_sys'], registro['info_solver']
+    top_indices = registro['hotspots']
+
+    # --- CONSTRUCCIÓN DEL REPORTE TÉCNICO ---
+    pdf = VALLY_Premium_Report(pdb_file.upper())
+    pdf.add_page(); pdf.set_xy(10, 60)
+
+    # Bloque I: Validación R2 y Trazabilidad
+    pdf.set_font("Helvetica", 'B', 14); pdf.set_text_color(0, 32, 63)
+    pdf.cell(0, 10, "I. R2 VALIDATION PROTOCOL & HARDWARE LOG", ln=True)
+    pdf.set_font("Helvetica", '', 10); pdf.set_text_color(0, 0, 0)
+    # MSF directa (estimador estocástico): r con su error estándar jackknife
+    r_error = (registro.get('extra') or {}).get('pearson_r_error')
+    r_texto = f"{round(r_val, 4)}" if r_error is None else f"{round(r_val, 4)} +/- {r_error:.4f}"
+    pdf.cell(55, 7, "Pearson Correlation (r):", 0); pdf.cell(0, 7, r_texto, ln=True)
+    pdf.cell(55, 7, "System CPU:", 0); pdf.cell(0, 7, info_sys['cpu'], ln=True)
+    pdf.cell(55, 7, "Memory Architecture:", 0); pdf.cell(0, 7, info_sys['ram'], ln=True)
+    pdf.cell(55, 7, "Eigensolver:", 0)
+    pdf.cell(0, 7, f"{info_solver['solver']}/{info_solver['metodo']} | max residual {info_solver['residuo_max']:.2e}", ln=True)
+    perfil = registro.get('perfil')
+    if perfil and perfil.get('etapas'):
+        lenta = max(perfil['etapas'], key=lambda m: m['wall_s'])
+        pdf.cell(55, 7, "Compute Profile:", 0)
+        pdf.cell(0, 7, f"{perfil['total_wall_s']:.2f} s wall | {perfil['total_cpu_s']:.2f} s CPU | "
+                       f"slowest: {lenta['etapa']} {lenta['wall_s']:.2f} s | peak {perfil['rss_pico_mb']:.0f} MB", ln=True)
+
+    # Bloque II: Hotspots (Plasticidad Regulatoria)
+    pdf.ln(5); pdf.set_font("Helvetica", 'B', 14); pdf.set_text_color(0, 32, 63)
+    pdf.cell(0, 10, "II. VIBRATIONAL HOTSPOTS MAPPING", ln=True)
+    pdf.set_font("Helvetica", '', 10); pdf.set_text_color(0, 0, 0)
+    for i, idx in enumerate(top_indices, 1):
+        pdf.cell(0, 7, f"Rank {i} -> Index: {idx} | Allosteric/Regulatory Plasticity Site", ln=True)
+
+    # Bloque III: Figure X y Gráfico
+    pdf.ln(5); pdf.image(plot_path, x=15, y=pdf.get_y(), w=180)
+    pdf.set_y(pdf.get_y() + 95)
+    pdf.set_font("Helvetica", 'I', 8); pdf.set_text_color(100)
+    caption = (f"Figure X. Validation of the R2 System through comparative flexibility analysis ({pdb_file.upper()}). "
+               "The solid blue line represents theoretical fluctuations, while the green dashed line represents "
+               f"experimental B-factor data. Correlation r={round(r_val, 3)} confirms predictive accuracy.")
+    pdf.multi_cell(180, 4, caption, align='C')
+
+    # Bloque IV: Executive Summary (Technical Update Text)
+    pdf.ln(5); pdf.set_font("Helvetica", 'B', 12); pdf.set_text_color(0, 32, 63)
+    pdf.cell(0, 8, "III. EXECUTIVE SUMMARY", ln=True)
+    pdf.set_font("Helvetica", '', 10); pdf.set_text_color(0, 0, 0)
+    summary = (f"El framework VALLY-Scan v1.7 ha ejecutado el protocolo R2 sobre {pdb_file.upper()}. "
+               f"Los resultados demuestran que el sistema captura la varianza dinamica experimental. "
+               "La alineacion de picos identifica dominios de alta structural plasticity, validando la "
+               "capacidad del software para mapear alosterismo molecular.")
+    pdf.multi_cell(0, 5, summary)
+
+    pdf_path = ruta_pdf(pdb_file)
+    pdf.output(pdf_path)
+    return pdf_path
+
+def renderizar_registro(registro):
+    """Gráfico + PDF de un registro; devuelve las rutas generadas."""
+    os.makedirs('Plots', exist_ok=True)
+    os.makedirs('Reports', exist_ok=True)
+    perfil = PerfilEtapas(registro['pdb'])
+    with perfil.etapa('render'):
+        plot_path = renderizar_grafico(registro)
+        rutas = plot_path, renderizar_pdf(registro, plot_path)
+    if registro.get('resultado_id') is not None:
+        # El render puede ocurrir en otro proceso o sesión: su medida se añade al resultado ya guardado
+        from vally_store import ResultsStore
+        with ResultsStore() as store:
+            store.agregar_etapas(registro['resultado_id'], perfil.etapas)
+    return rutas
+
+# --- 3. MODO DIFERIDO: REGISTROS EN DISCO ---
+
+DIRECTORIO_REGISTROS = 'Records'
+CAMPOS_ARREGLO = ('msf', 'b_factors', 'resnums', 'chids')
+
+def guardar_registro(registro, directorio=DIRECTORIO_REGISTROS, nombre=None):
+    """Guarda el registro compacto (.npz) para renderizarlo más tarde o nunca."""
+    os.makedirs(directorio, exist_ok=True)
+    meta = {k: v for k, v in registro.items() if k not in CAMPOS_ARREGLO}
+    ruta = os.path.join(directorio, f"{nombre or nombre_estructura(registro['pdb'])}.npz")
+    np.savez(ruta, meta=json.dumps(meta), **{k: registro[k] for k in CAMPOS_ARREGLO if registro.get(k) is not None})
+    return ruta
+
+def salidas_presentes(pdb_file, render):
+    """¿Están ya en disco las salidas que pide el modo de render? ('lazy' también vale con el PDF hecho)."""
+    renderizado = os.path.exists(ruta_grafico(pdb_file)) and os.path.exists(ruta_pdf(pdb_file))
+    if render == 'lazy':
+        return renderizado or os.path.exists(os.path.join(DIRECTORIO_REGISTROS, f"{nombre_estructura(pdb_file)}.npz"))
+    return render == 'none' or renderizado
+
+def cargar_registro(ruta):
+    with np.load(ruta) as datos:
+        registro = json.loads(str(datos['meta']))
+        registro.update({k: datos[k] for k in CAMPOS_ARREGLO if k in datos})
+    return registro
+
+def renderizar_pendientes(directorio=DIRECTORIO_REGISTROS, workers=1):
+    """Renderiza todos los registros diferidos y los elimina al terminar."""
+    if not os.path.isdir(directorio):
+        return []
+    rutas = sorted(os.path.join(directorio, f) for f in os.listdir(directorio) if f.endswith('.npz'))
+    with RenderPool(workers) as pool:
+        futuros = [(ruta, pool.enviar(cargar_registro(ruta))) for ruta in rutas]
+    hechos = []
+    for ruta, futuro in futuros:
+        if futuro.exception() is None:
+            os.remove(ruta)
+            hechos.append(futuro.result())
+        else:
+            print(f"--> [AVISO] No se pudo renderizar {ruta}: {futuro.exception()}")
+    return hechos
+
+# --- 4. POOL DE RENDERIZADO ASÍNCRONO ---
+
+def _init_render():
+    os.environ['MPLBACKEND'] = 'Agg'
+
+class RenderPool:
+    """
+    Procesos dedicados a gráficos y PDF, desacoplados de los workers de cómputo.
+    Los fallos de render se recogen al terminar cada tarea (`fallos`) y
+    `cerrar` los devuelve: un gráfico o PDF roto no pasa por un OK.
+    """
+
+    def __init__(self, workers=1):
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_render,
+                                         mp_context=multiprocessing.get_context('spawn'))
+        self.fallos = []
+
+    def enviar(self, registro):
+        futuro = self._pool.submit(renderizar_registro, registro)
+        futuro.add_done_callback(lambda f, pdb=registro.get('pdb'): self._recoger(pdb, f))
+        return futuro
+
+    def _recoger(self, pdb, futuro):
+        # Sólo se retienen los fallos: un batch enorme no acumula futuros
+        error = None if futuro.cancelled() else futuro.exception()
+        if error is not None:
+            self.fallos.append((pdb, f"{type(error).__name__}: {error}"))
+
+    def cerrar(self, esperar=True):
+        """Espera (por defecto) a los renders pendientes; devuelve [(pdb, error)] de los que fallaron."""
+        self._pool.shutdown(wait=esperar)
+        return list(self.fallos)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+_pool_global = None
+
+def pool_por_defecto():
+    """Pool compartido del proceso para render='async' sin pool explícito."""
+    global _pool_global
+    if _pool_global is None:
+        _pool_global = RenderPool()
+        atexit.register(_cerrar_pool_global)
+    return _pool_global
+
+def _cerrar_pool_global():
+    for pdb, error in _pool_global.cerrar():
+        print(f"--> [RENDER FALLO] {pdb}: {error}")
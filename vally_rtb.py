@@ -0,0 +1,193 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - ANM de Bloques Rígidos (RTB) para Grandes Ensamblajes
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+ESQUEMAS_BLOQUE = ('segmento', 'ss', 'cadena')
+RESIDUOS_POR_SEGMENTO = 10
+# Distancia Cα–Cα por encima de la cual se considera un corte de cadena
+DISTANCIA_ENLACE = 4.2
+# Pares de resortes procesados a la vez al proyectar la Hessiana (acota la memoria)
+PARES_POR_TANDA = 50000
+# Dimensión reducida hasta la que se usa eigh denso; por encima, LOBPCG disperso
+# (ya a ~5000 grados de libertad es más rápido y ocupa un tercio de la memoria).
+DOF_DENSO = 3000
+
+# --- 1. ASIGNACIÓN DE BLOQUES ---
+
+def _tramos(coords, chids):
+    """Etiqueta de tramo continuo: cambia con la cadena o con un hueco en la cadena principal."""
+    salto = np.ones(len(coords), dtype=bool)
+    if len(coords) > 1:
+        distancia = np.linalg.norm(np.diff(coords, axis=0), axis=1)
+        salto[1:] = (chids[1:] != chids[:-1]) | (distancia > DISTANCIA_ENLACE)
+    return np.cumsum(salto) - 1
+
+def _estructura_secundaria(coords, tramos):
+    """
+    Hélice / hebra / lazo sólo con geometría Cα (el lector en streaming no guarda
+    HELIX/SHEET): d(i, i+3) < 6 Å marca hélice y d(i, i+2) > 6.4 Å hebra extendida.
+    """
+    n = len(coords)
+    ss = np.zeros(n, dtype=np.int8)  # 0 lazo, 1 hélice, 2 hebra
+    for salto, codigo, umbral, es_menor in ((2, 2, 6.4, False), (3, 1, 6.0, True)):
+        if n <= salto:
+            continue
+        d = np.linalg.norm(coords[salto:] - coords[:-salto], axis=1)
+        cumple = (d < umbral) if es_menor else (d > umbral)
+        cumple &= tramos[salto:] == tramos[:-salto]
+        for k in range(salto + 1):
+            ss[k:n - salto + k][cumple] = codigo
+    return ss
+
+def asignar_bloques(calpha, esquema='segmento'):
+    """
+    Etiqueta de bloque rígido por Cα:
+      - 'segmento[:N]': N residuos consecutivos de un mismo tramo (10 por defecto),
+      - 'ss': hélices, hebras y lazos (partidos cada 2N residuos),
+      - 'cadena': una cadena entera por bloque.
+    """
+    nombre, _, tamano = esquema.partition(':')
+    tamano = int(tamano) if tamano else RESIDUOS_POR_SEGMENTO
+    if nombre not in ESQUEMAS_BLOQUE or tamano < 1:
+        raise ValueError(f"Esquema de bloques desconocido: {esquema}")
+    coords = np.asarray(calpha.getCoords(), dtype=float)
+    chids = np.asarray(calpha.getChids())
+    if nombre == 'cadena':
+        return np.unique(chids, return_inverse=True)[1]
+
+    tramos = _tramos(coords, chids)
+    if nombre == 'ss':
+        ss = _estructura_secundaria(coords, tramos)
+        cambio = np.ones(len(coords), dtype=bool)
+        cambio[1:] = (tramos[1:] != tramos[:-1]) | (ss[1:] != ss[:-1])
+        # Tramos de SS de menos de 3 residuos se funden con el bloque anterior
+        inicios = np.flatnonzero(cambio)
+        cortos = inicios[np.diff(np.r_[inicios, len(ss)]) < 3]
+        cortos = cortos[(cortos > 0) & (tramos[cortos] == tramos[cortos - 1])]
+        cambio[cortos] = False
+        grupos, tamano = np.cumsum(cambio) - 1, 2 * tamano
+    else:
+        grupos = tramos
+    # Posición dentro del grupo -> trozos de `tamano` residuos
+    inicio = np.flatnonzero(np.r_[True, grupos[1:] != grupos[:-1]])
+    posicion = np.arange(len(grupos)) - np.repeat(inicio, np.diff(np.r_[inicio, len(grupos)]))
+    nuevo = (posicion % tamano) == 0
+    return np.cumsum(nuevo) - 1
+
+# --- 2. PROYECCIÓN A CUERPOS RÍGIDOS ---
+
+def base_bloques(coords, etiquetas):
+    """
+    Base ortonormal de traslaciones + rotaciones de cada bloque. Devuelve
+    (filas, columnas, m): para cada átomo sus 3 filas (N×3×6) y los índices de
+    columna en el espacio reducido de dimensión m. Los bloques de uno o dos
+    átomos tienen menos de 6 grados de libertad (columnas con peso cero).
+    """
+    coords = np.asarray(coords, dtype=float)
+    n = len(coords)
+    etiquetas = np.asarray(etiquetas)
+    filas = np.zeros((n, 3, 6))
+    columnas = np.zeros((n, 6), dtype=np.int64)
+    orden = np.argsort(etiquetas, kind='stable')
+    _, inicios = np.unique(etiquetas[orden], return_index=True)
+    m = 0
+    for indices in np.split(orden, inicios[1:]):
+        x = coords[indices] - coords[indices].mean(axis=0)
+        base = np.zeros((len(indices), 3, 6))
+        for eje in range(3):
+            base[:, eje, eje] = 1.0
+        base[:, 1, 3], base[:, 2, 3] = -x[:, 2], x[:, 1]
+        base[:, 0, 4], base[:, 2, 4] = x[:, 2], -x[:, 0]
+        base[:, 0, 5], base[:, 1, 5] = -x[:, 1], x[:, 0]
+        u, s, _ = np.linalg.svd(base.reshape(-1, 6), full_matrices=False)
+        rango = int(np.sum(s > 1e-8 * max(s[0], 1.0)))
+        filas[indices, :, :rango] = u[:, :rango].reshape(len(indices), 3, rango)
+        columnas[indices] = m + np.minimum(np.arange(6), rango - 1)
+        m += rango
+    return filas, columnas, m
+
+def matriz_proyeccion(filas, columnas, m):
+    """P (3N × m) dispersa: desplazamiento de cada Cα por unidad de movimiento de su bloque."""
+    n = len(filas)
+    r = (3 * np.arange(n)[:, None, None] + np.arange(3)[None, :, None]).repeat(6, axis=2)
+    c = np.broadcast_to(columnas[:, None, :], (n, 3, 6))
+    return sparse.coo_matrix((filas.ravel(), (r.ravel(), c.ravel())), shape=(3 * n, m)).tocsr()
+
+def hessiana_bloques(coords, etiquetas, filas, columnas, m, cutoff=15., gamma=1.):
+    """
+    Pᵀ·H·P (m × m) directamente de los resortes entre bloques distintos, sin
+    construir la Hessiana 3N × 3N: cada resorte aporta γ·w·wᵀ con w = Pᵀu, y
+    los resortes internos de un bloque no se deforman en un movimiento rígido.
+    """
+    coords = np.asarray(coords, dtype=float)
+    pares = cKDTree(coords).query_pairs(cutoff, output_type='ndarray')
+    pares = pares[etiquetas[pares[:, 0]] != etiquetas[pares[:, 1]]]
+    reducida = sparse.csr_matrix((m, m))
+    for a in range(0, len(pares), PARES_POR_TANDA):
+        i, j = pares[a:a + PARES_POR_TANDA].T
+        d = coords[j] - coords[i]
+        d /= np.linalg.norm(d, axis=1)[:, None]
+        w = np.concatenate([np.einsum('pk,pkc->pc', d, filas[i]),
+                            -np.einsum('pk,pkc->pc', d, filas[j])], axis=1)
+        c = np.concatenate([columnas[i], columnas[j]], axis=1)
+        datos = gamma * w[:, :, None] * w[:, None, :]
+        r_idx = np.broadcast_to(c[:, :, None], datos.shape)
+        c_idx = np.broadcast_to(c[:, None, :], datos.shape)
+        reducida = reducida + sparse.coo_matrix((datos.ravel(), (r_idx.ravel(), c_idx.ravel())),
+                                                shape=(m, m)).tocsr()
+    return reducida
+
+def proyectar_cuerpo_rigido(base_global, filas, columnas, m):
+    """Pᵀ·R de los 6 movimientos rígidos globales, ortonormalizada (restricción de LOBPCG)."""
+    proyectada = np.zeros((m, base_global.shape[1]))
+    locales = np.einsum('nkc,nkr->ncr', filas, base_global.reshape(len(filas), 3, -1))
+    np.add.at(proyectada, columnas, locales)
+    q, _ = np.linalg.qr(proyectada)
+    return q
+
+# --- 3. MODOS EN EL ESPACIO DE BLOQUES ---
+
+def resolver_modos_rtb(calpha, n_modes=20, cutoff=15., gamma=1., bloques='segmento', perfil=None):
+    """
+    Modos ANM jerárquicos: se resuelve Pᵀ·H·P (6 grados de libertad por bloque)
+    y los autovectores se devuelven a resolución Cα con P. Devuelve
+    (valores, vectores 3N × k, residuos en el espacio reducido, info).
+    """
+    from scipy.linalg import eigh
+    from vally_profiling import PerfilNulo
+    from vally_solver import (CERO, TOL_RESIDUO, base_cuerpo_rigido, calcular_residuos,
+                              resolver_modos_arpack, resolver_modos_lobpcg)
+
+    perfil = perfil or PerfilNulo()
+    coords = np.asarray(calpha.getCoords(), dtype=float)
+    with perfil.etapa('hessiana'):
+        etiquetas = bloques if not isinstance(bloques, str) else asignar_bloques(calpha, bloques)
+        etiquetas = np.asarray(etiquetas)
+        filas, columnas, m = base_bloques(coords, etiquetas)
+        reducida = hessiana_bloques(coords, etiquetas, filas, columnas, m, cutoff, gamma)
+    with perfil.etapa('modos'):
+        if m <= DOF_DENSO:
+            # Sólo los modos más bajos (más los 6 rígidos): mucho más barato que el espectro completo
+            k = min(n_modes + 6, m)
+            valores, vectores = eigh(reducida.toarray(), subset_by_index=[0, k - 1])
+            utiles = valores > CERO
+            valores, vectores = valores[utiles][:n_modes], vectores[:, utiles][:, :n_modes]
+            metodo = 'eigh'
+        else:
+            rigidos = proyectar_cuerpo_rigido(base_cuerpo_rigido(coords), filas, columnas, m)
+            valores, vectores = resolver_modos_lobpcg(reducida, None, n_modes, restriccion=rigidos)
+            metodo = 'lobpcg'
+            if not np.all(calcular_residuos(reducida, valores, vectores) < TOL_RESIDUO):
+                valores, vectores = resolver_modos_arpack(reducida, n_modes)
+                metodo = 'arpack'
+        residuos = calcular_residuos(reducida, valores, vectores)
+        # P tiene columnas ortonormales: los modos Cα siguen siendo ortonormales
+        vectores = matriz_proyeccion(filas, columnas, m) @ vectores
+    info = {'metodo': metodo, 'n_bloques': int(len(np.unique(etiquetas))), 'dof_reducido': int(m),
+            'nnz_hessiana': int(reducida.nnz)}
+    return valores, vectores, residuos, info
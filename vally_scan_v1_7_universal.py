@@ -1,145 +1,233 @@
-import csv
 import numpy as np
-import matplotlib.pyplot as plt
-from prody import *
-from scipy.stats import pearsonr
-from fpdf import FPDF
 import datetime
 import os
 import platform
-import psutil
+from vally_io import leer_calpha, fuente_en_memoria, nombre_estructura
+from vally_cache import clave_modos
+from vally_store import ResultsStore
+from vally_archivo import archivar_perfiles
+from vally_profiling import PerfilEtapas
 
 # --- 1. GESTIÓN DE ENTORNO R2 ---
 def setup_vally_environment():
     """Garantiza la infraestructura de directorios para el preprint."""
     carpetas = ['Input_PDB', 'Reports', 'Plots', 'Database']
     for folder in carpetas:
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-
-# --- 2. MOTOR DE RENDERIZADO PREMIUM (Identidad Visual VALLY) ---
-class VALLY_Premium_Report(FPDF):
-    def __init__(self, pdb_id):
-        super().__init__()
-        self.pdb_id = pdb_id
-        self.logo_path = 'logo_proyecto.png'
-
-    def header(self):
-        # Banner Superior: Azul Oxford (Identidad Corporativa)
-        self.set_fill_color(0, 32, 63); self.rect(0, 0, 210, 45, 'F')
-        # Banner de Lema: Azul Soberanía
-        self.set_fill_color(0, 50, 90); self.rect(0, 45, 210, 8, 'F')
-        self.set_xy(0, 46.5); self.set_text_color(255, 255, 255); self.set_font("Helvetica", 'B', 9)
-        self.cell(210, 5, "CIENCIA Y SOBERANIA EN SALUD | PROYECTO VALLY", 0, 0, 'C')
-        
-        logo_x = 15
-        if os.path.exists(self.logo_path):
-            self.image(self.logo_path, 15, 10, 28); logo_x = 48
-            
-        self.set_xy(logo_x, 12); self.set_text_color(255, 255, 255); self.set_font("Helvetica", 'B', 22)
-        self.cell(0, 10, "VALLY-SCAN INSTRUMENT", ln=True)
-        self.set_font("Helvetica", '', 10); self.set_x(logo_x)
-        self.cell(0, 5, "VIBRATIONAL ANALYSIS & LOCAL LIGAND YIELDING", ln=True)
-        self.set_font("Helvetica", 'I', 9); self.set_x(logo_x)
-        self.cell(0, 5, "FRAMEWORK v1.7 | UNIVERSAL EDITION | R2 SYSTEM", ln=True)
-
-    def footer(self):
-        self.set_y(-25); self.set_draw_color(0, 32, 63); self.line(10, self.get_y(), 200, self.get_y())
-        self.set_font("Helvetica", 'I', 8); self.set_text_color(100); self.ln(2)
-        self.cell(0, 10, "PROYECTO VALLY - PROPIEDAD INTELECTUAL DE LIONELL E. NAVA RAMOS", align='C')
-        self.set_y(-15); self.cell(0, 10, f"Pagina {self.page_no()}", align='R')
-
-# --- 3. MOTOR UNIVERSAL R2 (LÓGICA OPTIMIZADA) ---
-def vally_universal_engine(pdb_file, active_site_residues=None, mode='universal'):
-    try:
-        setup_vally_environment()
-        target = os.path.join('Input_PDB', pdb_file) if os.path.exists(os.path.join('Input_PDB', pdb_file)) else pdb_file
-        
-        # Captura de Hardware (Factor 3: Experimental/Sistémico)
-        info_sys = {
-            'os': f"{platform.system()} {platform.release()}",
-            'cpu': platform.processor(),
-            'ram': f"{round(psutil.virtual_memory().total / (1024**3))} GB",
-            'time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-        }
-
-        # FACTOR 1: Dinámica Física Intrínseca (ANM)
-        structure = parsePDB(target)
-        calpha = structure.select('protein and name CA')
-        anm = ANM(pdb_file); anm.buildHessian(calpha)
-        anm.calcModes(n_modes=30)
-        msf = calcSqFlucts(anm)
+        # exist_ok: varios workers del batch pueden crearlas a la vez
+        os.makedirs(folder, exist_ok=True)
+
+# --- 2. MOTOR UNIVERSAL R2 (LÓGICA OPTIMIZADA) ---
+def vally_compute(pdb_file, active_site_residues=None, mode='universal', solver='auto', perfil=None,
+                  serie=None, hotspots='msf', bloques='segmento', msf_metodo='modos', datos=None,
+                  precision='float64'):
+    """
+    Etapa de cómputo pura: ANM + validación + hotspots. Devuelve un registro
+    compacto (dict con arreglos NumPy) que la etapa de render consume después,
+    con el tiempo, CPU y memoria de cada etapa en registro['perfil'].
+    `serie` (SerieModos) siembra el eigensolver con la estructura anterior.
+    `hotspots` ('msf', 'efector', 'sensor') elige el perfil del ranking; los
+    dos últimos calculan el PRS (vally_prs) con los mismos modos.
+    `bloques` define los cuerpos rígidos cuando el solver es 'rtb'.
+    mode='mineral' lee la celda unidad (CRYST1 o CIF) y resuelve la red periódica
+    en espacio k (vally_lattice): MSF por sitio en lugar de por Cα.
+    msf_metodo='directa' estima la diagonal de la pseudo-inversa sin modos
+    (vally_msf; todos los modos, con barra de error en r) en lugar de los 30 modos.
+    `pdb_file` puede ser .gz o 'contenedor.tar::miembro'; con `datos` (bytes de la
+    estructura, p.ej. leídos de un tar por iterar_estructuras) no se toca el disco.
+    precision='float32' hace Hessiana, autovectores y MSF en precisión simple
+    (mitad de memoria; `vally.py bench --verificar-precision` mide el efecto en r y hotspots).
+    """
+    perfil = perfil or PerfilEtapas(pdb_file)
+    # Dependencias pesadas sólo cuando de verdad se calcula (importar el motor es barato)
+    import psutil
+    from prody import calcSqFlucts
+    from scipy.stats import pearsonr
+    from vally_solver import calcular_modos
+
+    setup_vally_environment()
+    target = os.path.join('Input_PDB', pdb_file) if os.path.exists(os.path.join('Input_PDB', pdb_file)) else pdb_file
+    if datos is not None:
+        target = fuente_en_memoria(pdb_file, datos)
+
+    # Captura de Hardware (Factor 3: Experimental/Sistémico)
+    info_sys = {
+        'os': f"{platform.system()} {platform.release()}",
+        'cpu': platform.processor(),
+        'ram': f"{round(psutil.virtual_memory().total / (1024**3))} GB",
+        'time': datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    }
+    timestamp = datetime.datetime.now().isoformat(timespec='seconds')
+
+    if mode == 'mineral':
+        return _compute_mineral(pdb_file, target, perfil, info_sys, timestamp)
+
+    # FACTOR 1: Dinámica Física Intrínseca (ANM)
+    # Lectura en streaming: sólo los Cα llegan a memoria
+    with perfil.etapa('parse'):
+        calpha = leer_calpha(target)
+    if calpha.numAtoms() == 0:
+        raise ValueError(f"No se encontraron Carbonos Alfa en {pdb_file}")
+    if msf_metodo == 'directa':
+        if hotspots != 'msf':
+            raise ValueError("El PRS necesita los modos: --msf directa sólo admite hotspots por MSF")
+        if precision != 'float64':
+            raise ValueError("--msf directa resuelve en float64 (LU/CG): no admite --precision float32")
+        return _compute_directa(pdb_file, calpha, mode, perfil, info_sys, timestamp)
+    if msf_metodo != 'modos':
+        raise ValueError(f"Método de MSF desconocido: {msf_metodo}")
+    # 'auto': Hessiana densa en estructuras pequeñas, LOBPCG disperso en ensamblajes grandes
+    anm, info_solver = calcular_modos(calpha, n_modes=30, solver=solver, nombre=pdb_file, perfil=perfil,
+                                      serie=serie, bloques=bloques, precision=precision)
+    print(f"--> [SOLVER] {info_solver['solver']}/{info_solver['metodo']} | "
+          f"{info_solver['n_atoms']} Cα | residuo max = {info_solver['residuo_max']:.2e} "
+          f"| caché: {info_solver['cache']}")
+    # FACTOR 3: Correlación Cruzada Experimental
+    with perfil.etapa('validacion'):
+        # En float32 la MSF se acumula en precisión simple; el perfil (N valores) se guarda en float64
+        msf = calcSqFlucts(anm).astype(float)
         b_factors = calpha.getBetas()
-        
-        # FACTOR 3: Correlación Cruzada Experimental
         r_val, _ = pearsonr(msf, b_factors)
-        
-        # FACTOR 2: Heurística de Exclusión Geométrica (Hotspots)
+
+    # FACTOR 2: Heurística de Exclusión Geométrica (Hotspots)
+    extra = {} if precision == 'float64' else {'precision': precision}
+    efectividad = sensibilidad = None
+    if hotspots != 'msf':
+        from vally_prs import escanear
+        with perfil.etapa('prs'):
+            efectividad, sensibilidad = escanear(anm)
+        extra.update({'hotspots_criterio': hotspots,
+                      'efectores': [int(i) for i in np.argsort(efectividad)[-5:][::-1]],
+                      'sensores': [int(i) for i in np.argsort(sensibilidad)[-5:][::-1]]})
+    with perfil.etapa('hotspots'):
+        if hotspots == 'msf':
+            top_indices = np.argsort(msf)[-5:][::-1]
+        else:
+            from vally_prs import ranking_hotspots
+            top_indices = ranking_hotspots(msf, efectividad, sensibilidad, criterio=hotspots)
+
+    return {
+        'pdb': pdb_file,
+        # Hash sólo de las coordenadas Cα: identifica la estructura, no los parámetros
+        'content_hash': clave_modos(calpha.getCoords()),
+        'timestamp': timestamp,
+        'mode': mode,
+        'pearson_r': float(r_val),
+        'hotspots': [int(i) for i in top_indices],
+        'msf': msf,
+        'b_factors': b_factors,
+        'resnums': calpha.getResnums(),
+        'chids': calpha.getChids(),
+        'info_sys': info_sys,
+        'info_solver': {k: v for k, v in info_solver.items() if k != 'residuos'},
+        'perfil': perfil.resumen(),
+        'extra': extra,
+    }
+
+def _compute_directa(pdb_file, calpha, mode, perfil, info_sys, timestamp):
+    """MSF directa: sin eigenvectores en memoria, sólo la Hessiana dispersa y un bloque de sondas."""
+    from vally_msf import estimar_msf, pearson_con_error
+
+    estimacion = estimar_msf(calpha, perfil=perfil)
+    print(f"--> [SOLVER] directo/{estimacion['resolvente']} | {calpha.numAtoms()} Cα "
+          f"| {estimacion['n_sondas']} sondas + {estimacion['modos_deflacion']} modos exactos "
+          f"| error MSF (mediana) = {np.median(estimacion['msf_error'] / estimacion['msf']):.1%}")
+    with perfil.etapa('validacion'):
+        msf, b_factors = estimacion['msf'], calpha.getBetas()
+        r_val, r_error = pearson_con_error(estimacion, b_factors)
+    with perfil.etapa('hotspots'):
+        top_indices = np.argsort(msf)[-5:][::-1]
+    return {
+        'pdb': pdb_file,
+        'content_hash': clave_modos(calpha.getCoords()),
+        'timestamp': timestamp,
+        'mode': mode,
+        'pearson_r': float(r_val),
+        'hotspots': [int(i) for i in top_indices],
+        'msf': msf,
+        'b_factors': b_factors,
+        'resnums': calpha.getResnums(),
+        'chids': calpha.getChids(),
+        'info_sys': info_sys,
+        'info_solver': {'solver': 'directo', 'metodo': estimacion['resolvente'], 'n_atoms': calpha.numAtoms(),
+                        'dof': 3 * calpha.numAtoms(), 'residuo_max': estimacion['residuo_max'], 'cache': 'off'},
+        'perfil': perfil.resumen(),
+        'extra': {'msf_metodo': 'directa', 'pearson_r_error': r_error, 'n_sondas': estimacion['n_sondas'],
+                  'modos_deflacion': estimacion['modos_deflacion']},
+    }
+
+def _compute_mineral(pdb_file, target, perfil, info_sys, timestamp):
+    """Modo mineral: coste según los sitios de la celda unidad, no según la supercelda."""
+    from vally_lattice import leer_celda, analizar_red, guardar_resultado
+
+    with perfil.etapa('parse'):
+        celda = leer_celda(target)
+    resultado = analizar_red(celda, perfil=perfil)
+    print(f"--> [SOLVER] bloch/eigh | {celda.numSitios()} sitios | {len(resultado['kpuntos'])} puntos k "
+          f"| {resultado['n_resortes']} resortes por celda")
+    with perfil.etapa('validacion'):
+        msf, b_factors = resultado['msf'], celda.betas
+        # Sin B-factors (o todos iguales, p.ej. sitios equivalentes) no hay correlación posible
+        r_val = float(np.corrcoef(msf, b_factors)[0, 1]) if np.ptp(msf) > 0 and np.ptp(b_factors) > 0 else float('nan')
+    with perfil.etapa('hotspots'):
         top_indices = np.argsort(msf)[-5:][::-1]
+    nombre = nombre_estructura(pdb_file)
+    return {
+        'pdb': pdb_file,
+        'content_hash': clave_modos(celda.coords, vectores=celda.vectores.ravel().tolist()),
+        'timestamp': timestamp,
+        'mode': 'mineral',
+        'pearson_r': r_val,
+        'hotspots': [int(i) for i in top_indices],
+        'msf': msf,
+        'b_factors': b_factors,
+        'resnums': np.arange(1, celda.numSitios() + 1),
+        'info_sys': info_sys,
+        'info_solver': {'solver': 'bloch', 'metodo': 'eigh', 'n_atoms': celda.numSitios(),
+                        'dof': 3 * celda.numSitios(), 'n_kpuntos': len(resultado['kpuntos']),
+                        'residuo_max': 0.0, 'cache': 'off'},
+        'perfil': perfil.resumen(),
+        'extra': {'red': guardar_resultado(resultado, nombre), 'elementos': celda.elementos.tolist()},
+    }
+
+def registrar_resultado(registro, store=None):
+    """Actualización de la base de resultados (Database/VALLY_Scan.sqlite) a partir del registro."""
+    if store is not None:
+        return store.insertar(registro)
+    with ResultsStore() as store:
+        return store.insertar(registro)
+
+def vally_universal_engine(pdb_file, active_site_residues=None, mode='universal', solver='auto',
+                           render='inline', render_pool=None, serie=None, hotspots='msf', bloques='segmento',
+                           msf_metodo='modos', datos=None, precision='float64'):
+    """
+    Cómputo + registro + render. `render` controla la etapa gráfica:
+    'inline' (gráfico y PDF aquí mismo), 'async' (se envía a un RenderPool),
+    'lazy' (registro en Records/ para `renderizar_pendientes`) o 'none' (sólo números).
+    """
+    try:
+        registro = vally_compute(pdb_file, active_site_residues, mode, solver, serie=serie, hotspots=hotspots,
+                                 bloques=bloques, msf_metodo=msf_metodo, datos=datos, precision=precision)
+        # El id permite que la etapa de render (aquí o en otro proceso) añada su medida
+        registro['resultado_id'] = registrar_resultado(registro)
+        # Perfiles por residuo al archivo memory-mapped (consultas entre estructuras sin recalcular)
+        archivar_perfiles(registro)
 
-        # --- GENERACIÓN DE GRÁFICO (FIGURE X PREPRINT) ---
-        plt.figure(figsize=(10, 5))
-        m_z = (msf - np.mean(msf)) / np.std(msf)
-        b_z = (b_factors - np.mean(b_factors)) / np.std(b_factors)
-        plt.plot(m_z, color='#00203F', label='VALLY Simulation (ANM)', lw=2)
-        plt.plot(b_z, color='#32CD32', label='Experimental Data (B-factors)', ls='--', alpha=0.6)
-        plt.title(f"R2 Validation System | {pdb_file.upper()} | r = {round(r_val, 3)}")
-        plt.legend(loc='best', frameon=True, shadow=True)
-        plt.grid(True, alpha=0.25); plt.xlabel("Residue Index"); plt.ylabel("Standardized Fluctuation")
-        
-        plot_path = os.path.join('Plots', f"Plot_{pdb_file[:-4]}.png")
-        plt.savefig(plot_path, dpi=300); plt.close()
-
-        # --- CONSTRUCCIÓN DEL REPORTE TÉCNICO ---
-        pdf = VALLY_Premium_Report(pdb_file.upper())
-        pdf.add_page(); pdf.set_xy(10, 60)
-        
-        # Bloque I: Validación R2 y Trazabilidad
-        pdf.set_font("Helvetica", 'B', 14); pdf.set_text_color(0, 32, 63)
-        pdf.cell(0, 10, "I. R2 VALIDATION PROTOCOL & HARDWARE LOG", ln=True)
-        pdf.set_font("Helvetica", '', 10); pdf.set_text_color(0, 0, 0)
-        pdf.cell(55, 7, "Pearson Correlation (r):", 0); pdf.cell(0, 7, f"{round(r_val, 4)}", ln=True)
-        pdf.cell(55, 7, "System CPU:", 0); pdf.cell(0, 7, info_sys['cpu'], ln=True)
-        pdf.cell(55, 7, "Memory Architecture:", 0); pdf.cell(0, 7, info_sys['ram'], ln=True)
-
-        # Bloque II: Hotspots (Plasticidad Regulatoria)
-        pdf.ln(5); pdf.set_font("Helvetica", 'B', 14); pdf.set_text_color(0, 32, 63)
-        pdf.cell(0, 10, "II. VIBRATIONAL HOTSPOTS MAPPING", ln=True)
-        pdf.set_font("Helvetica", '', 10); pdf.set_text_color(0, 0, 0)
-        for i, idx in enumerate(top_indices, 1):
-            pdf.cell(0, 7, f"Rank {i} -> Index: {idx} | Allosteric/Regulatory Plasticity Site", ln=True)
-
-        # Bloque III: Figure X y Gráfico
-        pdf.ln(5); pdf.image(plot_path, x=15, y=pdf.get_y(), w=180)
-        pdf.set_y(pdf.get_y() + 95)
-        pdf.set_font("Helvetica", 'I', 8); pdf.set_text_color(100)
-        caption = (f"Figure X. Validation of the R2 System through comparative flexibility analysis ({pdb_file.upper()}). "
-                   "The solid blue line represents theoretical fluctuations, while the green dashed line represents "
-                   f"experimental B-factor data. Correlation r={round(r_val, 3)} confirms predictive accuracy.")
-        pdf.multi_cell(180, 4, caption, align='C')
-
-        # Bloque IV: Executive Summary (Technical Update Text)
-        pdf.ln(5); pdf.set_font("Helvetica", 'B', 12); pdf.set_text_color(0, 32, 63)
-        pdf.cell(0, 8, "III. EXECUTIVE SUMMARY", ln=True)
-        pdf.set_font("Helvetica", '', 10); pdf.set_text_color(0, 0, 0)
-        summary = (f"El framework VALLY-Scan v1.7 ha ejecutado el protocolo R2 sobre {pdb_file.upper()}. "
-                   f"Los resultados demuestran que el sistema captura la varianza dinamica experimental. "
-                   "La alineacion de picos identifica dominios de alta structural plasticity, validando la "
-                   "capacidad del software para mapear alosterismo molecular.")
-        pdf.multi_cell(0, 5, summary)
-
-        pdf.output(os.path.join('Reports', f"VALLY_Scan_Report_{pdb_file[:-4]}.pdf"))
-
-        # --- ACTUALIZACIÓN DE DATABASE ---
-        db_path = os.path.join('Database', 'VALLY_Scan_Master.csv')
-        hot_str = "-".join(map(str, top_indices))
-        with open(db_path, 'a', newline='') as f:
-            writer = csv.writer(f)
-            if os.path.getsize(db_path) == 0:
-                writer.writerow(['Timestamp', 'PDB', 'Pearson_R', 'Hotspots', 'CPU', 'RAM'])
-            writer.writerow([info_sys['time'], pdb_file, round(r_val, 4), hot_str, info_sys['cpu'], info_sys['ram']])
+        if render == 'inline':
+            from vally_render import renderizar_registro
+            renderizar_registro(registro)
+        elif render == 'async':
+            from vally_render import pool_por_defecto
+            # El pool anota los fallos de cada render (RenderPool.fallos) y los devuelve al cerrarse
+            (render_pool or pool_por_defecto()).enviar(registro)
+        elif render == 'lazy':
+            from vally_render import guardar_registro
+            guardar_registro(registro)
+        elif render != 'none':
+            raise ValueError(f"Modo de render desconocido: {render}")
 
         print(f"--> [SUCCESS] VALLY-SCAN R2 FRAMEWORK v1.7: {pdb_file} procesado.")
+        return registro
 
     except Exception as e:
         print(f"--> [ERROR CRITICO] {str(e)}")
+        return None
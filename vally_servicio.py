@@ -0,0 +1,254 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Servicio HTTP/JSON Local con Workers Precalentados
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import ipaddress
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as TiempoAgotado
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+HOST = '127.0.0.1'
+PUERTO = 8765
+# Trabajos admitidos a la vez por encima de los que ya están en un worker
+COLA = 8
+TIMEOUT_S = 300.0
+MAX_SUBIDA_MB = 256
+
+# --- 1. WORKERS PRECALENTADOS ---
+
+def _init_servicio(n_hilos):
+    """BLAS acotado (como en batch) y dependencias pesadas cargadas antes del primer trabajo."""
+    from vally_batch import _init_worker
+    _init_worker(n_hilos)
+    import prody  # noqa: F401
+    import scipy.sparse.linalg  # noqa: F401
+    import scipy.stats  # noqa: F401
+    import main  # noqa: F401
+    import vally_solver  # noqa: F401
+    prody.confProDy(verbosity='none')
+
+def _listo():
+    """Trabajo vacío: fuerza el arranque de cada worker al iniciar el servicio."""
+    time.sleep(0.2)
+    return os.getpid()
+
+def _analizar(pdb_id, ruta=None, contenido=None, solver='auto'):
+    """
+    Flujo de `validate` (ANM -> B-factors -> predictor) dentro de un worker;
+    devuelve el mismo JSON que generar_reporte_json. `contenido` es el texto de
+    una estructura subida; si no, se lee `ruta`.
+    """
+    from main import (PROTEINAS, calcular_y_guardar_anm, datos_reporte_json, predecir_con_ia_simulada,
+                      validar_con_datos_experimentales)
+    from vally_profiling import PerfilEtapas
+
+    fuente = ruta
+    if contenido is not None:
+        fuente = io.StringIO(contenido)
+        fuente.name = pdb_id
+    pdb_id = os.path.splitext(os.path.basename(pdb_id))[0].lower()
+    perfil = PerfilEtapas(pdb_id)
+    # El registro de pasos del flujo clásico no interesa al cliente del servicio
+    with contextlib.redirect_stdout(io.StringIO()):
+        anm, protein_ca = calcular_y_guardar_anm(fuente, pdb_id, solver, perfil)
+        if anm is None:
+            raise ValueError(f"No se pudo construir el ANM de {pdb_id} (¿sin Carbonos Alfa?)")
+        with perfil.etapa('validacion'):
+            r_val = validar_con_datos_experimentales(anm, protein_ca)
+        with perfil.etapa('hotspots'):
+            clave = PROTEINAS.get(pdb_id, {}).get("clave", [])
+            afinidad, top_res = predecir_con_ia_simulada(anm, protein_ca, clave)
+    return datos_reporte_json(pdb_id, afinidad, top_res, r_val, perfil.resumen())
+
+class ColaSaturada(Exception):
+    """No quedan plazas en la cola: el cliente debe reintentar más tarde."""
+
+class ServicioVally:
+    """
+    Pool de procesos con ProDy/SciPy ya importados y una cola acotada: cada
+    petición ocupa una plaza (workers + cola) hasta que su trabajo termina; sin
+    plazas libres se rechaza al momento en lugar de acumular trabajo (backpressure).
+    """
+
+    def __init__(self, workers=2, cola=COLA, blas_threads=1, timeout=TIMEOUT_S):
+        self.workers, self.capacidad, self.timeout = workers, workers + cola, timeout
+        self._plazas = threading.BoundedSemaphore(self.capacidad)
+        self._bloqueo = threading.Lock()
+        self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_servicio, initargs=(blas_threads,),
+                                         mp_context=multiprocessing.get_context('spawn'))
+        self.inicio = time.time()
+        self.contadores = {'en_curso': 0, 'completados': 0, 'fallidos': 0, 'rechazados': 0, 'timeouts': 0}
+        self._latencia_total = 0.0
+        self.pids = []
+
+    def calentar(self):
+        """Arranca todos los workers (y sus imports) antes de aceptar peticiones."""
+        futuros = [self._pool.submit(_listo) for _ in range(self.workers)]
+        self.pids = sorted({f.result() for f in futuros})
+        return self.pids
+
+    def _terminado(self, futuro, inicio):
+        with self._bloqueo:
+            self.contadores['en_curso'] -= 1
+            if futuro.exception() is None:
+                self.contadores['completados'] += 1
+                self._latencia_total += time.perf_counter() - inicio
+            else:
+                self.contadores['fallidos'] += 1
+        self._plazas.release()
+
+    def enviar(self, pdb_id, ruta=None, contenido=None, solver='auto'):
+        if not self._plazas.acquire(blocking=False):
+            with self._bloqueo:
+                self.contadores['rechazados'] += 1
+            raise ColaSaturada()
+        with self._bloqueo:
+            self.contadores['en_curso'] += 1
+        inicio = time.perf_counter()
+        futuro = self._pool.submit(_analizar, pdb_id, ruta, contenido, solver)
+        futuro.add_done_callback(lambda f: self._terminado(f, inicio))
+        return futuro
+
+    def analizar(self, pdb_id, ruta=None, contenido=None, solver='auto'):
+        """Envía y espera el resultado (TiempoAgotado si supera el timeout; el trabajo sigue su curso)."""
+        futuro = self.enviar(pdb_id, ruta, contenido, solver)
+        try:
+            return futuro.result(timeout=self.timeout)
+        except TiempoAgotado:
+            with self._bloqueo:
+                self.contadores['timeouts'] += 1
+            raise
+
+    def estado(self):
+        with self._bloqueo:
+            contadores = dict(self.contadores)
+            completados = contadores['completados']
+            latencia = self._latencia_total / completados if completados else None
+        return {'estado': 'ok', 'workers': self.workers, 'pids': self.pids, 'capacidad': self.capacidad,
+                'plazas_libres': self.capacidad - contadores['en_curso'], **contadores,
+                'latencia_media_s': None if latencia is None else round(latencia, 4),
+                'uptime_s': round(time.time() - self.inicio, 1)}
+
+    def cerrar(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# --- 2. SERVIDOR HTTP ---
+
+def _es_local(host):
+    """El servicio sólo escucha en loopback: sin autenticación, no debe quedar expuesto."""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+class _Manejador(BaseHTTPRequestHandler):
+    """
+    GET  /status   estado del pool y de la cola.
+    POST /analyze  JSON {"pdb": ruta o ID en data/, "solver": ...} o el archivo
+                   PDB/mmCIF en el cuerpo (?nombre=xxx.cif&solver=...).
+    """
+    servicio = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, codigo, datos, cabeceras=()):
+        cuerpo = json.dumps(datos).encode()
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        for clave, valor in cabeceras:
+            self.send_header(clave, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        if urlparse(self.path).path.rstrip('/') == '/status':
+            return self._responder(200, self.servicio.estado())
+        self._responder(404, {'error': f"Ruta desconocida: {self.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/analyze':
+            return self._responder(404, {'error': f"Ruta desconocida: {self.path}"})
+        longitud = int(self.headers.get('Content-Length') or 0)
+        if longitud > MAX_SUBIDA_MB * 2 ** 20:
+            return self._responder(413, {'error': f"Subida mayor de {MAX_SUBIDA_MB} MB"})
+        cuerpo = self.rfile.read(longitud)
+        parametros = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if self.headers.get_content_type() == 'application/json':
+                pedido = json.loads(cuerpo or b'{}')
+                parametros.update(pedido)
+                if not parametros.get('pdb'):
+                    return self._responder(400, {'error': "Falta 'pdb' (ruta o ID)"})
+                from main import resolver_ruta_pdb
+                ruta = resolver_ruta_pdb(str(parametros['pdb']), os.getcwd())
+                if not os.path.exists(ruta):
+                    return self._responder(404, {'error': f"No existe {ruta}"})
+                argumentos = dict(pdb_id=str(parametros['pdb']), ruta=ruta)
+            else:
+                if not cuerpo:
+                    return self._responder(400, {'error': "Cuerpo vacío: se esperaba un PDB/mmCIF o JSON"})
+                argumentos = dict(pdb_id=parametros.get('nombre', 'upload.pdb'),
+                                  contenido=cuerpo.decode('utf-8', errors='replace'))
+            datos = self.servicio.analizar(solver=parametros.get('solver', 'auto'), **argumentos)
+        except json.JSONDecodeError as e:
+            return self._responder(400, {'error': f"JSON inválido: {e}"})
+        except ColaSaturada:
+            return self._responder(503, {'error': "Cola llena", 'capacidad': self.servicio.capacidad},
+                                   cabeceras=[('Retry-After', '1')])
+        except TiempoAgotado:
+            return self._responder(504, {'error': f"Sin resultado en {self.servicio.timeout:g} s"})
+        except Exception as e:
+            return self._responder(500, {'error': str(e)})
+        self._responder(200, datos)
+
+def servir(host=HOST, puerto=PUERTO, workers=2, cola=COLA, blas_threads=1, timeout=TIMEOUT_S):
+    """Arranca los workers, espera a que estén calientes y atiende hasta Ctrl+C."""
+    if not _es_local(host):
+        raise ValueError(f"El servicio sólo puede escuchar en loopback (127.0.0.1/::1), no en {host}")
+    servicio = ServicioVally(workers, cola, blas_threads, timeout)
+    print(f"--> [SERVICE] Precalentando {workers} worker(s)...")
+    inicio = time.perf_counter()
+    servicio.calentar()
+    _Manejador.servicio = servicio
+    servidor = ThreadingHTTPServer((host, puerto), _Manejador)
+    servidor.daemon_threads = True
+    print(f"--> [SERVICE] Listo en {time.perf_counter() - inicio:.1f} s: http://{host}:{servidor.server_port} "
+          f"(POST /analyze, GET /status) | cola {servicio.capacidad}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        servicio.cerrar()
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vally serve",
+                                     description="Servicio HTTP/JSON local con workers precalentados.")
+    parser.add_argument('--host', default=HOST, help="Dirección loopback de escucha.")
+    parser.add_argument('--puerto', type=int, default=PUERTO)
+    parser.add_argument('--workers', type=int, default=2, help="Procesos de cómputo (ProDy ya importado).")
+    parser.add_argument('--cola', type=int, default=COLA, help="Trabajos en espera admitidos; el resto recibe 503.")
+    parser.add_argument('--blas-threads', type=int, default=1, help="Hilos BLAS por worker.")
+    parser.add_argument('--timeout', type=float, default=TIMEOUT_S, help="Espera máxima por petición (s).")
+    args = parser.parse_args(argv)
+    return servir(args.host, args.puerto, args.workers, args.cola, args.blas_threads, args.timeout)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Motor de Autovalores ANM (Denso / Disperso)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import warnings
+
+import numpy as np
+from prody import ANM
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, eigsh, lobpcg, splu
+from scipy.spatial import cKDTree
+from vally_cache import ModeCache, clave_modos
+from vally_profiling import PerfilNulo
+
+# A partir de este número de Cα el solver 'auto' abandona la Hessiana densa.
+UMBRAL_DISPERSO = 3000
+# Mismo criterio que ProDy para descartar los 6 modos de cuerpo rígido.
+CERO = 1e-6
+# Residuo relativo máximo aceptado antes de recurrir a ARPACK shift-invert.
+TOL_RESIDUO = 1e-4
+MAX_ITER_LOBPCG = 2000
+# En una serie, 'auto' usa LOBPCG (sembrado con los modos previos) desde este tamaño
+# (la Hessiana densa ya es más lenta que el solver iterativo a partir de ~1000 Cα).
+UMBRAL_SERIE = 1000
+# Fracción mínima de residuos emparejados con la estructura previa para sembrar
+FRACCION_MINIMA_SERIE = 0.5
+# A partir de este número de Cα 'auto' resuelve en el espacio de bloques rígidos (RTB):
+# la Hessiana dispersa completa y el bloque de LOBPCG ya no caben cómodamente en memoria.
+UMBRAL_RTB = 50000
+# Modo de precisión simple (opt-in): Hessiana, autovectores y MSF en float32, la mitad
+# de memoria y ancho de banda. Las tolerancias se adaptan al épsilon de cada tipo.
+PRECISIONES = {'float64': np.float64, 'float32': np.float32}
+TOL_LOBPCG = {'float64': 1e-6, 'float32': 1e-4}
+TOL_RESIDUO_PRECISION = {'float64': TOL_RESIDUO, 'float32': 5e-3}
+
+# --- 1. CONSTRUCCIÓN DE LA HESSIANA DISPERSA ---
+
+def construir_hessiana_dispersa(coords, cutoff=15., gamma=1., dtype=np.float64):
+    """Hessiana ANM 3N×3N en formato CSR, sin materializar la matriz densa."""
+    coords = np.asarray(coords, dtype=float)
+    pares = cKDTree(coords).query_pairs(cutoff, output_type='ndarray')
+    return hessiana_de_pares(coords, pares[:, 0], pares[:, 1], gamma, dtype)
+
+def hessiana_de_pares(coords, i, j, gamma=1., dtype=np.float64):
+    """
+    Hessiana (CSR) de los resortes i–j dados. Es aditiva: la de un cutoff mayor
+    es la del menor más la de los pares nuevos (barridos de cutoff).
+    Los bloques y la diagonal se acumulan en float64 y se guardan en `dtype`;
+    los índices del ensamblado son int32 mientras quepan (la mitad de memoria).
+    """
+    coords = np.asarray(coords, dtype=float)
+    n_atoms = len(coords)
+    dof = 3 * n_atoms
+    d = coords[j] - coords[i]
+    d2 = np.einsum('ij,ij->i', d, d)
+    bloques = -gamma * d[:, :, None] * d[:, None, :] / d2[:, None, None]
+
+    # Diagonal: cada nodo acumula (con signo opuesto) los resortes que lo tocan
+    diagonal = np.zeros((n_atoms, 3, 3))
+    np.add.at(diagonal, i, -bloques)
+    np.add.at(diagonal, j, -bloques)
+    bloques = bloques.astype(dtype, copy=False)
+
+    indice = np.int32 if dof < np.iinfo(np.int32).max else np.int64
+    nodos = np.arange(n_atoms, dtype=indice)
+    filas = np.concatenate([i, j, nodos]).astype(indice, copy=False)
+    columnas = np.concatenate([j, i, nodos]).astype(indice, copy=False)
+    datos = np.concatenate([bloques, bloques, diagonal.astype(dtype, copy=False)])
+
+    eje = np.arange(3, dtype=indice)
+    r = (3 * filas[:, None, None] + eje[None, :, None]).repeat(3, axis=2)
+    c = (3 * columnas[:, None, None] + eje[None, None, :]).repeat(3, axis=1)
+    return sparse.coo_matrix((datos.ravel(), (r.ravel(), c.ravel())), shape=(dof, dof)).tocsr()
+
+# --- 2. SOLVERS DE MODOS NORMALES ---
+
+def base_cuerpo_rigido(coords):
+    """Base ortonormal (3N×6) de las traslaciones y rotaciones rígidas de la red."""
+    x = np.asarray(coords, dtype=float)
+    x = x - x.mean(axis=0)
+    base = np.zeros((3 * len(x), 6))
+    for eje in range(3):
+        base[eje::3, eje] = 1.0
+    base[1::3, 3], base[2::3, 3] = -x[:, 2], x[:, 1]
+    base[0::3, 4], base[2::3, 4] = x[:, 2], -x[:, 0]
+    base[0::3, 5], base[1::3, 5] = -x[:, 1], x[:, 0]
+    q, _ = np.linalg.qr(base)
+    return q
+
+def umbral_cero(hessiana):
+    """Autovalor por debajo del cual un modo es de cuerpo rígido: en float32 el ruido de redondeo supera CERO."""
+    if hessiana.dtype == np.float64:
+        return CERO
+    return max(CERO, 100 * np.finfo(hessiana.dtype).eps * float(np.max(hessiana.diagonal())))
+
+def resolver_modos_densos(hessiana, n_modes=20):
+    """
+    eigh (LAPACK ?syevr) sólo de los modos más bajos, sobre la Hessiana densa
+    en su propio tipo y en el sitio: en float32 no hay copia float64 en ningún paso.
+    """
+    from scipy.linalg import eigh
+    dof = hessiana.shape[0]
+    cero = umbral_cero(hessiana)
+    valores, vectores = eigh(hessiana, subset_by_index=[0, min(n_modes + 5, dof - 1)], overwrite_a=True,
+                             check_finite=False, driver='evr')
+    utiles = valores > cero
+    return valores[utiles][:n_modes], vectores[:, utiles][:, :n_modes]
+
+def tamano_bloque(n_modes, dof):
+    return min(n_modes + max(10, n_modes // 2), dof - 6)
+
+def resolver_modos_lobpcg(hessiana, coords, n_modes=20, semilla=0, x0=None, devolver_bloque=False,
+                          restriccion=None):
+    """
+    LOBPCG con los modos rígidos como restricción y precondicionador de Jacobi.
+    `x0` (dof × bloque) sustituye al bloque inicial aleatorio (arranque en caliente);
+    con devolver_bloque=True también se devuelve el bloque completo ordenado.
+    `restriccion` sustituye a la base rígida de `coords` (p.ej. en el espacio RTB).
+    """
+    dof, tipo = hessiana.shape[0], hessiana.dtype
+    if x0 is None:
+        x0 = np.random.default_rng(semilla).standard_normal((dof, tamano_bloque(n_modes, dof)))
+    # Bloque, restricción y precondicionador en el tipo de la Hessiana: nada se promueve a float64
+    precond = sparse.diags((1.0 / hessiana.diagonal()).astype(tipo, copy=False))
+    tol = TOL_LOBPCG['float64' if tipo == np.float64 else 'float32']
+    with warnings.catch_warnings():
+        # La convergencia se juzga después con los residuos explícitos
+        warnings.simplefilter('ignore', UserWarning)
+        rigidos = base_cuerpo_rigido(coords) if restriccion is None else restriccion
+        valores, vectores = lobpcg(hessiana, x0.astype(tipo, copy=False), Y=rigidos.astype(tipo, copy=False),
+                                   M=precond, largest=False, tol=tol, maxiter=MAX_ITER_LOBPCG)
+    orden = np.argsort(valores)
+    if devolver_bloque:
+        return valores[orden][:n_modes], vectores[:, orden][:, :n_modes], vectores[:, orden]
+    return valores[orden][:n_modes], vectores[:, orden][:, :n_modes]
+
+def resolver_modos_arpack(hessiana, n_modes=20):
+    """Lanczos (ARPACK) en modo shift-invert: sólo los n_modes modos no triviales más bajos."""
+    dof = hessiana.shape[0]
+    k = min(n_modes + 6, dof - 1)
+    # Desplazamiento negativo: (H - σI) es definida positiva y los modos
+    # de cuerpo rígido quedan como los más cercanos a σ.
+    sigma = -1e-4 * float(np.mean(hessiana.diagonal()))
+    desplazada = (hessiana - sigma * sparse.identity(dof, dtype=hessiana.dtype, format='csc')).tocsc()
+    lu = splu(desplazada, permc_spec='MMD_AT_PLUS_A', diag_pivot_thresh=0.,
+              options=dict(SymmetricMode=True))
+    inversa = LinearOperator(desplazada.shape, matvec=lu.solve, dtype=desplazada.dtype)
+    valores, vectores = eigsh(hessiana, k=k, sigma=sigma, which='LM', OPinv=inversa)
+    orden = np.argsort(valores)
+    valores, vectores = valores[orden], vectores[:, orden]
+    utiles = valores > umbral_cero(hessiana)
+    return valores[utiles][:n_modes], vectores[:, utiles][:, :n_modes]
+
+def calcular_residuos(hessiana, valores, vectores):
+    """Residuo relativo ||Hv - λv|| / |λ| de cada par propio."""
+    residuo = hessiana @ vectores - vectores * valores
+    return np.linalg.norm(residuo, axis=0) / np.abs(valores)
+
+# --- 3. SERIES DE ESTRUCTURAS PARECIDAS (ARRANQUE EN CALIENTE) ---
+
+def claves_residuo(calpha):
+    """Identidad de cada Cα (cadena, número, código de inserción) para emparejar estructuras."""
+    if not hasattr(calpha, 'getResnums'):
+        return None
+    icodes = calpha.getIcodes() if hasattr(calpha, 'getIcodes') else [''] * calpha.numAtoms()
+    return [f"{c}:{r}{i}" for c, r, i in zip(calpha.getChids(), calpha.getResnums(), icodes)]
+
+class SerieModos:
+    """
+    Modos de la última estructura de una serie (mutantes, fotogramas, homólogos).
+    calcular_modos(..., serie=serie) siembra LOBPCG con ellos, emparejando los
+    átomos por residuo, y guarda los nuevos para la siguiente estructura.
+    """
+
+    def __init__(self, semilla=0):
+        self.bloque = None
+        self.claves = None
+        self.rng = np.random.default_rng(semilla)
+        self.arranques = []
+
+    def x0(self, claves, dof, n_columnas):
+        """Bloque inicial (dof × n_columnas) o None si no hay una estructura previa emparejable."""
+        if self.bloque is None:
+            return None
+        n_atoms = dof // 3
+        if claves is not None and self.claves is not None:
+            previas = {clave: i for i, clave in enumerate(self.claves)}
+            pares = [(i, previas[c]) for i, c in enumerate(claves) if c in previas]
+        elif self.bloque.shape[0] == dof:
+            pares = [(i, i) for i in range(n_atoms)]
+        else:
+            pares = []
+        if len(pares) < FRACCION_MINIMA_SERIE * n_atoms:
+            return None
+
+        nuevos, previos = (np.asarray(x) for x in zip(*pares))
+        filas_nuevas = (3 * nuevos[:, None] + np.arange(3)).ravel()
+        filas_previas = (3 * previos[:, None] + np.arange(3)).ravel()
+        # Residuos sin pareja y columnas que falten: ruido pequeño (LOBPCG las ortogonaliza)
+        x0 = 1e-3 * self.rng.standard_normal((dof, n_columnas))
+        k = min(n_columnas, self.bloque.shape[1])
+        x0[filas_nuevas, :k] = self.bloque[filas_previas, :k]
+        return x0
+
+    def registrar(self, bloque, claves, arranque):
+        self.bloque, self.claves = np.asarray(bloque), claves
+        self.arranques.append(arranque)
+
+# --- 4. PUNTO DE ENTRADA ÚNICO ---
+
+def calcular_modos(calpha, n_modes=20, cutoff=15., gamma=1., solver='auto', nombre='VALLY ANM',
+                   cache=True, perfil=None, serie=None, bloques='segmento', precision='float64'):
+    """
+    Construye el modelo ANM eligiendo entre Hessiana densa (ProDy) o dispersa
+    (LOBPCG, con ARPACK shift-invert como respaldo si los residuos no convergen).
+    Devuelve el objeto ANM y un diccionario con el solver usado y los residuos.
+
+    Con cache=True (o una instancia de ModeCache) los modos se buscan primero en
+    la caché en disco por hash de coordenadas + (cutoff, gamma, n_modes).
+    Con un PerfilEtapas se miden por separado las etapas 'hessiana' y 'modos'.
+    Con una SerieModos, LOBPCG arranca desde los modos de la estructura anterior
+    (y vuelve al arranque en frío si no converge).
+    solver='rtb' resuelve en el espacio de bloques rígidos `bloques` (vally_rtb)
+    y devuelve los modos proyectados a Cα; 'auto' lo elige desde UMBRAL_RTB Cα.
+    precision='float32' construye la Hessiana y resuelve los modos en precisión
+    simple (en RTB sólo el bloque de autovectores a resolución Cα, el que ocupa memoria).
+    """
+    perfil = perfil or PerfilNulo()
+    coords = calpha.getCoords() if hasattr(calpha, 'getCoords') else np.asarray(calpha)
+    n_atoms = len(coords)
+    claves = claves_residuo(calpha) if serie is not None else None
+
+    if solver == 'auto':
+        umbral = UMBRAL_SERIE if serie is not None else UMBRAL_DISPERSO
+        solver = 'rtb' if n_atoms > UMBRAL_RTB else 'sparse' if n_atoms > umbral else 'dense'
+    if solver not in ('dense', 'sparse', 'rtb'):
+        raise ValueError(f"Solver desconocido: {solver}")
+    if precision not in PRECISIONES:
+        raise ValueError(f"Precisión desconocida: {precision}")
+    tipo, tol_residuo = PRECISIONES[precision], TOL_RESIDUO_PRECISION[precision]
+    # Denso y disperso dan los mismos modos; RTB depende además de los bloques
+    parametros = dict(cutoff=cutoff, gamma=gamma, n_modes=n_modes)
+    if precision != 'float64':
+        # Las claves float64 de siempre no cambian
+        parametros['precision'] = precision
+    if solver == 'rtb':
+        if not isinstance(bloques, str):
+            raise ValueError("solver='rtb' necesita un esquema de bloques ('segmento[:N]', 'ss', 'cadena')")
+        parametros.update(solver='rtb', bloques=bloques)
+
+    almacen = (ModeCache() if cache is True else cache) or None
+    if almacen is not None:
+        clave = clave_modos(coords, **parametros)
+        with perfil.etapa('cache'):
+            encontrado = almacen.obtener(clave)
+        if encontrado is not None:
+            valores, vectores, meta = encontrado
+            anm = ANM(nombre)
+            anm.setEigens(vectores, valores)
+            info = dict(meta['info'], cache='hit', clave=clave)
+            info['residuos'] = np.asarray(info['residuos'])
+            perfil.anotar(solver=info['solver'], metodo=info['metodo'], n_atoms=n_atoms, dof=info['dof'], cache='hit')
+            if serie is not None and solver != 'rtb':
+                serie.registrar(vectores, claves, 'cache')
+            return anm, info
+
+    # RTB no se siembra: su espacio reducido cambia con los bloques de cada estructura
+    x0 = None
+    if serie is not None and solver != 'rtb':
+        x0 = serie.x0(claves, 3 * n_atoms, tamano_bloque(n_modes, 3 * n_atoms))
+
+    anm = ANM(nombre)
+    metodo, arranque = 'eigh', 'frio'
+    bloque, extra = None, {}
+    if solver == 'rtb':
+        from vally_rtb import resolver_modos_rtb
+        valores, vectores, residuos, extra = resolver_modos_rtb(calpha, n_modes, cutoff, gamma, bloques, perfil)
+        metodo = extra.pop('metodo')
+        nnz = extra.pop('nnz_hessiana')
+        extra['bloques'] = bloques
+        valores, vectores = valores.astype(tipo, copy=False), vectores.astype(tipo, copy=False)
+        anm.setEigens(vectores, valores)
+    elif solver == 'dense' and precision != 'float64':
+        with perfil.etapa('hessiana'):
+            hessiana = construir_hessiana_dispersa(coords, cutoff, gamma, tipo)
+        with perfil.etapa('modos'):
+            # La copia densa sólo vive durante eigh (que la sobrescribe); los residuos usan la CSR
+            valores, vectores = resolver_modos_densos(hessiana.toarray(), n_modes)
+        anm.setEigens(vectores, valores)
+    elif solver == 'dense':
+        with perfil.etapa('hessiana'):
+            anm.buildHessian(coords, cutoff=cutoff, gamma=gamma)
+        with perfil.etapa('modos'):
+            anm.calcModes(n_modes=n_modes)
+        hessiana = anm.getHessian()
+        valores, vectores = anm.getEigvals(), anm.getEigvecs()
+    else:
+        with perfil.etapa('hessiana'):
+            hessiana = construir_hessiana_dispersa(coords, cutoff, gamma, tipo)
+        with perfil.etapa('modos'):
+            metodo = 'lobpcg'
+            if x0 is not None:
+                valores, vectores, bloque = resolver_modos_lobpcg(hessiana, coords, n_modes, x0=x0,
+                                                                  devolver_bloque=True)
+                residuos = calcular_residuos(hessiana, valores, vectores)
+                arranque = 'caliente'
+            if x0 is None or not np.all(residuos < tol_residuo):
+                valores, vectores, bloque = resolver_modos_lobpcg(hessiana, coords, n_modes, devolver_bloque=True)
+                residuos = calcular_residuos(hessiana, valores, vectores)
+                arranque = 'frio' if x0 is None else 'caliente->frio'
+            if not np.all(residuos < tol_residuo):
+                valores, vectores = resolver_modos_arpack(hessiana, n_modes)
+                metodo = 'arpack'
+            anm.setEigens(vectores, valores)
+
+    if solver != 'rtb' and metodo != 'lobpcg':
+        residuos = calcular_residuos(hessiana, valores, vectores)
+    info = {
+        'solver': solver,
+        'metodo': metodo,
+        'n_atoms': n_atoms,
+        'dof': 3 * n_atoms,
+        'n_modes': len(valores),
+        'residuo_max': float(np.max(residuos)) if len(residuos) else 0.0,
+        'residuos': residuos,
+        'cache': 'off',
+        'arranque': arranque,
+        'precision': precision,
+        **extra,
+    }
+    if serie is not None and solver != 'rtb':
+        serie.registrar(bloque if metodo == 'lobpcg' else vectores, claves, arranque)
+    if solver != 'rtb':
+        nnz = hessiana.nnz if sparse.issparse(hessiana) else np.count_nonzero(hessiana)
+    perfil.anotar(solver=solver, metodo=metodo, arranque=arranque, n_atoms=n_atoms, dof=3 * n_atoms,
+                  nnz_hessiana=int(nnz), cache='miss' if almacen is not None else 'off', precision=precision,
+                  **extra)
+    if almacen is not None:
+        meta = {'nombre': nombre, 'cutoff': cutoff, 'gamma': gamma,
+                'info': dict(info, residuos=residuos.tolist())}
+        almacen.guardar(clave, valores, vectores, coords, meta)
+        info.update(cache='miss', clave=clave)
+    return anm, info
@@ -0,0 +1,269 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Base de Resultados Indexada (SQLite WAL)
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import csv
+import json
+import sqlite3
+import argparse
+import numpy as np
+
+RUTA_DB = os.path.join('Database', 'VALLY_Scan.sqlite')
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS resultados (
+    id           INTEGER PRIMARY KEY,
+    pdb_id       TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    timestamp    TEXT NOT NULL,
+    pearson_r    REAL,
+    n_residuos   INTEGER,
+    modo         TEXT,
+    solver       TEXT,
+    cpu          TEXT,
+    ram          TEXT,
+    extra        TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_resultados_pdb  ON resultados(pdb_id);
+CREATE INDEX IF NOT EXISTS ix_resultados_hash ON resultados(content_hash);
+CREATE INDEX IF NOT EXISTS ix_resultados_ts   ON resultados(timestamp);
+CREATE INDEX IF NOT EXISTS ix_resultados_r    ON resultados(pearson_r);
+
+CREATE TABLE IF NOT EXISTS hotspots (
+    resultado_id INTEGER NOT NULL REFERENCES resultados(id) ON DELETE CASCADE,
+    rango        INTEGER NOT NULL,
+    indice       INTEGER NOT NULL,
+    resnum       INTEGER,
+    PRIMARY KEY (resultado_id, rango)
+);
+CREATE INDEX IF NOT EXISTS ix_hotspots_resnum ON hotspots(resnum);
+
+CREATE TABLE IF NOT EXISTS perfiles (
+    resultado_id INTEGER PRIMARY KEY REFERENCES resultados(id) ON DELETE CASCADE,
+    msf          BLOB,
+    b_factors    BLOB,
+    resnums      BLOB
+);
+
+CREATE TABLE IF NOT EXISTS etapas (
+    resultado_id INTEGER NOT NULL REFERENCES resultados(id) ON DELETE CASCADE,
+    etapa        TEXT NOT NULL,
+    wall_s       REAL,
+    cpu_s        REAL,
+    rss_pico_mb  REAL
+);
+CREATE INDEX IF NOT EXISTS ix_etapas_resultado ON etapas(resultado_id);
+CREATE INDEX IF NOT EXISTS ix_etapas_wall      ON etapas(etapa, wall_s);
+"""
+
+# Perfiles por residuo: bytes little-endian de tipo fijo
+TIPOS_PERFIL = {'msf': '<f8', 'b_factors': '<f8', 'resnums': '<i4'}
+
+def _a_blob(arreglo, tipo):
+    return None if arreglo is None else np.ascontiguousarray(arreglo, dtype=tipo).tobytes()
+
+# --- 1. ALMACÉN CONCURRENTE ---
+
+class ResultsStore:
+    """
+    Resultados del motor en SQLite modo WAL: muchos procesos escriben a la vez
+    (cada inserción es una transacción corta) mientras otros consultan por
+    PDB, hash de contenido, fecha o rango de Pearson r usando índices.
+    """
+
+    def __init__(self, ruta=RUTA_DB, timeout=60.0):
+        self.ruta = ruta
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        self.con = sqlite3.connect(ruta, timeout=timeout)
+        self.con.row_factory = sqlite3.Row
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=NORMAL')
+        self.con.execute('PRAGMA foreign_keys=ON')
+        self.con.executescript(ESQUEMA)
+
+    def cerrar(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    def insertar(self, registro):
+        """Inserta un registro de vally_compute (con sus perfiles binarios); devuelve su id."""
+        info_sys = registro.get('info_sys', {})
+        info_solver = registro.get('info_solver', {})
+        perfil = registro.get('perfil') or {}
+        # Anotaciones del perfil (dof, nnz de la Hessiana, método, caché...) junto al extra libre
+        extra = dict(registro.get('extra', {}), **{k: v for k, v in perfil.items() if k != 'etapas'})
+        if info_solver.get('residuo_max') is not None:
+            # Lo que el PDF necesita para rehacerse desde la base (ver `registro`)
+            extra.setdefault('residuo_max', info_solver['residuo_max'])
+        resnums = registro.get('resnums')
+        with self.con:
+            cursor = self.con.execute(
+                "INSERT INTO resultados (pdb_id, content_hash, timestamp, pearson_r, n_residuos, "
+                "modo, solver, cpu, ram, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (registro['pdb'], registro.get('content_hash', ''), registro['timestamp'],
+                 registro.get('pearson_r'), len(registro['msf']) if registro.get('msf') is not None else None,
+                 registro.get('mode'), info_solver.get('solver'), info_sys.get('cpu'), info_sys.get('ram'),
+                 json.dumps(extra)))
+            resultado_id = cursor.lastrowid
+            self.con.executemany(
+                "INSERT INTO hotspots (resultado_id, rango, indice, resnum) VALUES (?, ?, ?, ?)",
+                [(resultado_id, rango, int(idx), int(resnums[idx]) if resnums is not None else None)
+                 for rango, idx in enumerate(registro.get('hotspots', []), 1)])
+            if registro.get('msf') is not None:
+                self.con.execute(
+                    "INSERT INTO perfiles (resultado_id, msf, b_factors, resnums) VALUES (?, ?, ?, ?)",
+                    (resultado_id, *(_a_blob(registro.get(k), t) for k, t in TIPOS_PERFIL.items())))
+            self._insertar_etapas(resultado_id, perfil.get('etapas', []))
+        return resultado_id
+
+    def _insertar_etapas(self, resultado_id, etapas):
+        self.con.executemany(
+            "INSERT INTO etapas (resultado_id, etapa, wall_s, cpu_s, rss_pico_mb) VALUES (?, ?, ?, ?, ?)",
+            [(resultado_id, m['etapa'], m.get('wall_s'), m.get('cpu_s'), m.get('rss_pico_mb')) for m in etapas])
+
+    def agregar_etapas(self, resultado_id, etapas):
+        """Añade medidas tomadas después de insertar (p.ej. el render en otro proceso)."""
+        with self.con:
+            self._insertar_etapas(resultado_id, etapas)
+
+    def consultar(self, r_min=None, r_max=None, pdb_id=None, content_hash=None,
+                  desde=None, hasta=None, limite=None):
+        """Filas de `resultados` que cumplen los filtros (todos opcionales e indexados)."""
+        condiciones, valores = [], []
+        for columna, operador, valor in (('pearson_r', '>', r_min), ('pearson_r', '<=', r_max),
+                                         ('pdb_id', '=', pdb_id), ('content_hash', '=', content_hash),
+                                         ('timestamp', '>=', desde), ('timestamp', '<', hasta)):
+            if valor is not None:
+                condiciones.append(f"{columna} {operador} ?")
+                valores.append(valor)
+        sql = "SELECT * FROM resultados"
+        if condiciones:
+            sql += " WHERE " + " AND ".join(condiciones)
+        sql += " ORDER BY timestamp"
+        if limite:
+            sql += f" LIMIT {int(limite)}"
+        return [dict(fila) for fila in self.con.execute(sql, valores)]
+
+    def hotspots(self, resultado_id):
+        filas = self.con.execute("SELECT indice FROM hotspots WHERE resultado_id = ? ORDER BY rango",
+                                 (resultado_id,))
+        return [fila[0] for fila in filas]
+
+    def etapas(self, resultado_id):
+        filas = self.con.execute("SELECT etapa, wall_s, cpu_s, rss_pico_mb FROM etapas "
+                                 "WHERE resultado_id = ? ORDER BY rowid", (resultado_id,))
+        return [dict(fila) for fila in filas]
+
+    def mas_lentas(self, etapa=None, limite=20):
+        """
+        Estructuras más lentas: por una etapa concreta ('modos', 'render'...) o
+        por tiempo total de todas sus etapas registradas.
+        """
+        if etapa is not None:
+            sql = ("SELECT r.id, r.pdb_id, r.timestamp, r.solver, e.wall_s, e.cpu_s, e.rss_pico_mb "
+                   "FROM etapas e JOIN resultados r ON r.id = e.resultado_id "
+                   "WHERE e.etapa = ? ORDER BY e.wall_s DESC LIMIT ?")
+            valores = (etapa, int(limite))
+        else:
+            sql = ("SELECT r.id, r.pdb_id, r.timestamp, r.solver, SUM(e.wall_s) AS wall_s, "
+                   "SUM(e.cpu_s) AS cpu_s, MAX(e.rss_pico_mb) AS rss_pico_mb "
+                   "FROM etapas e JOIN resultados r ON r.id = e.resultado_id "
+                   "GROUP BY r.id ORDER BY wall_s DESC LIMIT ?")
+            valores = (int(limite),)
+        return [dict(fila) for fila in self.con.execute(sql, valores)]
+
+    def perfil(self, resultado_id):
+        """Perfiles por residuo (MSF, B-factors, resnums) como arreglos NumPy."""
+        fila = self.con.execute("SELECT * FROM perfiles WHERE resultado_id = ?", (resultado_id,)).fetchone()
+        if fila is None:
+            return None
+        return {k: np.frombuffer(fila[k], dtype=t) if fila[k] is not None else None
+                for k, t in TIPOS_PERFIL.items()}
+
+    def registro(self, resultado_id):
+        """
+        Registro listo para vally_render rehecho desde la base (sin recalcular
+        ANM): regenera gráfico, PDF o registro diferido que falten. None si el
+        resultado no existe o no guardó perfiles.
+        """
+        fila = self.con.execute("SELECT * FROM resultados WHERE id = ?", (resultado_id,)).fetchone()
+        perfiles = self.perfil(resultado_id)
+        if fila is None or perfiles is None or perfiles['msf'] is None:
+            return None
+        extra = json.loads(fila['extra'] or '{}')
+        etapas = self.etapas(resultado_id)
+        return {
+            'pdb': fila['pdb_id'], 'content_hash': fila['content_hash'], 'timestamp': fila['timestamp'],
+            'mode': fila['modo'], 'pearson_r': fila['pearson_r'], 'hotspots': self.hotspots(resultado_id),
+            **perfiles,
+            'info_sys': {'cpu': fila['cpu'], 'ram': fila['ram']},
+            'info_solver': {'solver': fila['solver'], 'metodo': extra.get('metodo', '-'),
+                            'residuo_max': extra.get('residuo_max', float('nan'))},
+            'perfil': {'etapas': etapas, 'total_wall_s': sum(e['wall_s'] or 0.0 for e in etapas),
+                       'total_cpu_s': sum(e['cpu_s'] or 0.0 for e in etapas),
+                       'rss_pico_mb': max((e['rss_pico_mb'] or 0.0 for e in etapas), default=0.0)},
+            'extra': extra, 'resultado_id': resultado_id,
+        }
+
+    # --- 2. COMPATIBILIDAD CON VALLY_Scan_Master.csv ---
+
+    def exportar_csv(self, ruta=os.path.join('Database', 'VALLY_Scan_Master.csv')):
+        """Regenera el CSV maestro clásico (mismas columnas) desde la base."""
+        with open(ruta, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Timestamp', 'PDB', 'Pearson_R', 'Hotspots', 'CPU', 'RAM'])
+            for fila in self.consultar():
+                hot_str = "-".join(map(str, self.hotspots(fila['id'])))
+                r_val = round(fila['pearson_r'], 4) if fila['pearson_r'] is not None else ''
+                writer.writerow([fila['timestamp'], fila['pdb_id'], r_val, hot_str, fila['cpu'], fila['ram']])
+        return ruta
+
+    def importar_csv(self, ruta=os.path.join('Database', 'VALLY_Scan_Master.csv')):
+        """Migra un CSV maestro existente (sin perfiles) a la base."""
+        n = 0
+        with open(ruta, newline='') as f:
+            for fila in csv.DictReader(f):
+                self.insertar({
+                    'pdb': fila['PDB'], 'timestamp': fila['Timestamp'],
+                    'pearson_r': float(fila['Pearson_R']) if fila['Pearson_R'] else None,
+                    'hotspots': [int(h) for h in fila['Hotspots'].split('-') if h],
+                    'info_sys': {'cpu': fila['CPU'], 'ram': fila['RAM']},
+                })
+                n += 1
+        return n
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consultas sobre la base de resultados VALLY-Scan.")
+    parser.add_argument("--db", default=RUTA_DB)
+    parser.add_argument("--min-r", type=float, help="Sólo estructuras con Pearson r mayor que este valor.")
+    parser.add_argument("--pdb", help="Filtrar por identificador PDB / nombre de archivo.")
+    parser.add_argument("--limite", type=int)
+    parser.add_argument("--export-csv", metavar="RUTA", help="Regenerar el CSV maestro clásico.")
+    parser.add_argument("--import-csv", metavar="RUTA", help="Migrar un CSV maestro existente.")
+    parser.add_argument("--lentas", nargs='?', const='total', metavar="ETAPA",
+                        help="Estructuras más lentas (total o por etapa: parse, hessiana, modos, render...).")
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        if args.import_csv:
+            print(f"Importadas {store.importar_csv(args.import_csv)} filas.")
+        if args.export_csv:
+            print(f"CSV generado: {store.exportar_csv(args.export_csv)}")
+        if args.lentas:
+            etapa = None if args.lentas == 'total' else args.lentas
+            for fila in store.mas_lentas(etapa, args.limite or 20):
+                print(f"{fila['pdb_id']:<20} | {args.lentas:<10} {fila['wall_s']:9.3f} s "
+                      f"| CPU {fila['cpu_s']:9.3f} s | RSS pico {fila['rss_pico_mb']:8.1f} MB | {fila['solver']}")
+        else:
+            for fila in store.consultar(r_min=args.min_r, pdb_id=args.pdb, limite=args.limite):
+                # r NULL: NaN o perfil constante, o fila migrada de un CSV sin Pearson_R
+                r_txt = '-' if fila['pearson_r'] is None else f"{fila['pearson_r']:.4f}"
+                print(f"{fila['timestamp']} | {fila['pdb_id']:<20} | r = {r_txt} "
+                      f"| hotspots: {store.hotspots(fila['id'])}")
@@ -0,0 +1,168 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Barrido de Cutoff y Número de Modos en una Pasada
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import sys
+import csv
+import argparse
+import numpy as np
+
+DIRECTORIO_BARRIDOS = 'Sweeps'
+CUTOFFS = tuple(float(c) for c in range(8, 21))
+MAX_MODOS = 50
+
+# --- 1. PEARSON DE TODOS LOS PREFIJOS DE MODOS ---
+
+def pearson_prefijos(valores, vectores, b_factors):
+    """
+    r de Pearson entre la MSF de los k primeros modos y los B-factors, para
+    k = 1..K en un solo paso: cada modo aporta |v_i|²/λ a cada residuo y la
+    suma acumulada de esas contribuciones da la MSF de todos los prefijos.
+    """
+    n_atoms = vectores.shape[0] // 3
+    contribucion = (vectores ** 2).reshape(n_atoms, 3, -1).sum(axis=1) / valores  # N × K
+    msf = np.cumsum(contribucion, axis=1)
+    msf -= msf.mean(axis=0)
+    b = np.asarray(b_factors, dtype=float)
+    b = b - b.mean()
+    normas = np.linalg.norm(msf, axis=0) * np.linalg.norm(b)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(normas > 0, (b @ msf) / normas, np.nan)
+
+# --- 2. BARRIDO ---
+
+def barrer(calpha, cutoffs=CUTOFFS, max_modos=MAX_MODOS, gamma=1., solver='auto', perfil=None):
+    """
+    Matriz r[cutoff, n_modes] (n_modes = 1..max_modos) de una estructura.
+
+    Las distancias se calculan una vez hasta el cutoff mayor; los pares se ordenan
+    y la Hessiana de cada cutoff es la del anterior más los resortes nuevos. En
+    modo disperso, LOBPCG arranca con los modos del cutoff anterior.
+    """
+    from scipy.linalg import eigh
+    from scipy.spatial import cKDTree
+    from vally_profiling import PerfilNulo
+    from vally_solver import (CERO, TOL_RESIDUO, UMBRAL_DISPERSO, calcular_residuos, hessiana_de_pares,
+                              resolver_modos_arpack, resolver_modos_lobpcg)
+
+    perfil = perfil or PerfilNulo()
+    coords = np.asarray(calpha.getCoords(), dtype=float)
+    b_factors = calpha.getBetas()
+    n_atoms = len(coords)
+    cutoffs = np.sort(np.asarray(cutoffs, dtype=float))
+    max_modos = min(max_modos, 3 * n_atoms - 6)
+    if solver == 'auto':
+        solver = 'sparse' if n_atoms > UMBRAL_DISPERSO else 'dense'
+    if solver not in ('dense', 'sparse'):
+        raise ValueError(f"Solver no soportado en el barrido: {solver}")
+
+    with perfil.etapa('vecinos'):
+        pares = cKDTree(coords).query_pairs(cutoffs[-1], output_type='ndarray')
+        distancias = np.linalg.norm(coords[pares[:, 1]] - coords[pares[:, 0]], axis=1)
+        orden = np.argsort(distancias)
+        pares, distancias = pares[orden], distancias[orden]
+        limites = np.searchsorted(distancias, cutoffs, side='right')
+
+    tabla = np.full((len(cutoffs), max_modos), np.nan)
+    hessiana, usados, x0 = None, 0, None
+    for fila, (cutoff, limite) in enumerate(zip(cutoffs, limites)):
+        with perfil.etapa('hessiana'):
+            nuevos = pares[usados:limite]
+            incremento = hessiana_de_pares(coords, nuevos[:, 0], nuevos[:, 1], gamma)
+            hessiana = incremento if hessiana is None else hessiana + incremento
+            usados = limite
+        with perfil.etapa('modos'):
+            if solver == 'dense':
+                k = min(max_modos + 6, 3 * n_atoms)
+                valores, vectores = eigh(hessiana.toarray(), subset_by_index=[0, k - 1])
+                utiles = valores > CERO
+                valores, vectores = valores[utiles][:max_modos], vectores[:, utiles][:, :max_modos]
+            else:
+                valores, vectores, bloque = resolver_modos_lobpcg(hessiana, coords, max_modos, x0=x0,
+                                                                  devolver_bloque=True)
+                if not np.all(calcular_residuos(hessiana, valores, vectores) < TOL_RESIDUO):
+                    valores, vectores = resolver_modos_arpack(hessiana, max_modos)
+                    bloque = None
+                x0 = bloque
+        with perfil.etapa('pearson'):
+            # Red desconectada a cutoffs pequeños: menos modos no triviales que columnas
+            tabla[fila, :len(valores)] = pearson_prefijos(valores, vectores, b_factors)
+    perfil.anotar(solver=solver, n_atoms=n_atoms, n_cutoffs=len(cutoffs), max_modos=max_modos)
+    return cutoffs, tabla
+
+def mejor(cutoffs, tabla):
+    """(cutoff, n_modes, r) con el r máximo de la tabla."""
+    if np.all(np.isnan(tabla)):
+        return None
+    fila, columna = np.unravel_index(np.nanargmax(tabla), tabla.shape)
+    return float(cutoffs[fila]), int(columna + 1), float(tabla[fila, columna])
+
+# --- 3. SALIDAS ---
+
+def guardar_tabla(cutoffs, tabla, nombre, directorio=DIRECTORIO_BARRIDOS):
+    """CSV largo: una fila por (cutoff, n_modes)."""
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"{nombre}_sweep.csv")
+    with open(ruta, 'w', newline='') as f:
+        escritor = csv.writer(f)
+        escritor.writerow(['cutoff', 'n_modes', 'pearson_r'])
+        for cutoff, fila in zip(cutoffs, tabla):
+            for n_modes, r in enumerate(fila, 1):
+                escritor.writerow([cutoff, n_modes, '' if np.isnan(r) else round(float(r), 5)])
+    return ruta
+
+def graficar_mapa(cutoffs, tabla, nombre, directorio='Plots'):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(directorio, exist_ok=True)
+    plt.figure(figsize=(10, 5))
+    plt.imshow(tabla, aspect='auto', origin='lower', cmap='viridis',
+               extent=(0.5, tabla.shape[1] + 0.5, -0.5, len(cutoffs) - 0.5))
+    plt.yticks(range(len(cutoffs)), [f"{c:g}" for c in cutoffs])
+    plt.colorbar(label='Pearson r (MSF vs B-factors)')
+    optimo = mejor(cutoffs, tabla)
+    if optimo:
+        plt.scatter([optimo[1]], [list(cutoffs).index(optimo[0])], marker='*', color='red', s=120)
+    plt.xlabel('Número de modos')
+    plt.ylabel('Cutoff (Å)')
+    plt.title(f"VALLY Sweep: {nombre}")
+    ruta = os.path.join(directorio, f"Sweep_{nombre}.png")
+    plt.savefig(ruta, dpi=200)
+    plt.close()
+    return ruta
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vally sweep",
+                                     description="Pearson r sobre la rejilla (cutoff, número de modos) en una pasada.")
+    parser.add_argument('pdb', nargs='+', help="Archivo(s) PDB/mmCIF.")
+    parser.add_argument('--cutoffs', type=float, nargs='+', default=list(CUTOFFS), help="Cutoffs en Å.")
+    parser.add_argument('--max-modos', type=int, default=MAX_MODOS)
+    parser.add_argument('--solver', choices=['auto', 'dense', 'sparse'], default='auto')
+    parser.add_argument('--sin-grafico', action='store_true')
+    args = parser.parse_args(argv)
+
+    from vally_io import leer_calpha
+    from vally_profiling import PerfilEtapas
+    for ruta in args.pdb:
+        perfil = PerfilEtapas(ruta)
+        with perfil.etapa('parse'):
+            calpha = leer_calpha(ruta)
+        cutoffs, tabla = barrer(calpha, args.cutoffs, args.max_modos, solver=args.solver, perfil=perfil)
+        nombre = os.path.splitext(os.path.basename(ruta))[0]
+        optimo = mejor(cutoffs, tabla)
+        print(f"\n--> [SWEEP] {nombre}: {len(cutoffs)} cutoffs × {tabla.shape[1]} modos")
+        if optimo:
+            print(f"    Óptimo: cutoff {optimo[0]:g} Å, {optimo[1]} modos -> r = {optimo[2]:.4f}")
+        # Etapas repetidas por cutoff: se muestran sumadas
+        print("    Perfil: " + " | ".join(f"{etapa} {t:.2f} s" for etapa, t in perfil.tiempos().items()))
+        print(f"    Tabla: {guardar_tabla(cutoffs, tabla, nombre)}")
+        if not args.sin_grafico:
+            print(f"    Mapa: {graficar_mapa(cutoffs, tabla, nombre)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+# ===================================================================
+# PROYECTO V.A.L.L.Y. - Análisis en Streaming de Ensamblajes y Trayectorias
+# Autor: Lionell Eduardo Nava Ramos
+# ===================================================================
+
+import os
+import sys
+import argparse
+import numpy as np
+from vally_io import EXT_ESTRUCTURA, CalphaSet, iterar_modelos
+
+DIRECTORIO_TRAYECTORIAS = 'Trajectories'
+
+# --- 1. FUENTES DE FOTOGRAMAS ---
+
+def _fotogramas_dcd(ruta, topologia):
+    """Fotogramas de un DCD (ProDy) recortados a los Cα de la topología."""
+    from prody import DCDFile, parsePDB
+    seleccion = parsePDB(topologia).select('protein and name CA')
+    indices = seleccion.getIndices()
+    plantilla = dict(resnames=seleccion.getResnames(), resnums=seleccion.getResnums(),
+                     chids=seleccion.getChids(), betas=seleccion.getBetas(), icodes=seleccion.getIcodes())
+    titulo = os.path.splitext(os.path.basename(ruta))[0]
+    dcd = DCDFile(ruta)
+    try:
+        for fotograma in dcd:
+            yield CalphaSet(fotograma._getCoords()[indices], titulo=titulo, **plantilla)
+    finally:
+        dcd.close()
+
+def iterar_fotogramas(fuentes, topologia=None):
+    """
+    Recorre, de uno en uno, los fotogramas de:
+      - un PDB/mmCIF multi-modelo (ensamblaje RMN, trayectoria exportada),
+      - una lista de archivos o un directorio de snapshots (orden alfabético),
+      - un DCD, con `topologia` (PDB) para saber qué átomos son Cα.
+    """
+    if isinstance(fuentes, (str, os.PathLike)):
+        fuentes = [fuentes]
+    for fuente in fuentes:
+        fuente = os.fspath(fuente)
+        if os.path.isdir(fuente):
+            archivos = sorted(f for f in os.listdir(fuente) if f.lower().endswith(EXT_ESTRUCTURA))
+            yield from iterar_fotogramas([os.path.join(fuente, f) for f in archivos], topologia)
+        elif fuente.lower().endswith('.dcd'):
+            if topologia is None:
+                raise ValueError(f"{fuente}: un DCD necesita --topologia (PDB con los mismos átomos)")
+            yield from _fotogramas_dcd(fuente, topologia)
+        else:
+            yield from iterar_modelos(fuente)
+
+# --- 2. ESTADÍSTICAS ACUMULADAS (UN FOTOGRAMA A LA VEZ) ---
+
+def _pearson(x, y):
+    """r de Pearson; NaN si alguno de los perfiles es constante (p.ej. B-factors a cero en RMN)."""
+    dx, dy = x - x.mean(), y - y.mean()
+    denominador = np.sqrt(np.dot(dx, dx) * np.dot(dy, dy))
+    return float(np.dot(dx, dy) / denominador) if denominador > 0 else float('nan')
+
+class EstadisticasTrayectoria:
+    """
+    MSF media y varianza (Welford), frecuencia de hotspots y Pearson por fotograma,
+    actualizadas en O(N) por fotograma: nunca se guardan los modos de más de uno.
+    """
+
+    def __init__(self, n_residuos, betas=None, top=5):
+        self.n = 0
+        self.top = top
+        self.media = np.zeros(n_residuos)
+        self._m2 = np.zeros(n_residuos)
+        self.conteo_hotspots = np.zeros(n_residuos, dtype=np.int64)
+        self.betas = None if betas is None else np.asarray(betas, dtype=float)
+        if self.betas is not None and self.betas.shape != (n_residuos,):
+            raise ValueError(f"B-factors de referencia con {self.betas.size} residuos; los fotogramas tienen {n_residuos}")
+        self.pearson_fotogramas = []
+        self.pearson_media = []
+
+    def actualizar(self, msf, betas=None):
+        msf = np.asarray(msf, dtype=float)
+        if msf.shape != self.media.shape:
+            raise ValueError(f"Fotograma con {msf.size} residuos; se esperaban {self.media.size}")
+        self.n += 1
+        delta = msf - self.media
+        self.media += delta / self.n
+        self._m2 += delta * (msf - self.media)
+        self.conteo_hotspots[np.argpartition(msf, -self.top)[-self.top:]] += 1
+
+        referencia = self.betas if self.betas is not None else np.asarray(betas, dtype=float)
+        self.pearson_fotogramas.append(_pearson(msf, referencia))
+        # Convergencia: correlación del promedio acumulado hasta este fotograma
+        self.pearson_media.append(_pearson(self.media, referencia))
+
+    @property
+    def varianza(self):
+        return self._m2 / (self.n - 1) if self.n > 1 else np.zeros_like(self._m2)
+
+    @property
+    def frecuencia_hotspots(self):
+        return self.conteo_hotspots / max(self.n, 1)
+
+    def resultado(self):
+        return {
+            'n_fotogramas': self.n,
+            'msf_media': self.media.copy(),
+            'msf_varianza': self.varianza,
+            'frecuencia_hotspots': self.frecuencia_hotspots,
+            'pearson_fotogramas': np.asarray(self.pearson_fotogramas),
+            'pearson_media_acumulada': np.asarray(self.pearson_media),
+        }
+
+# --- 3. ANÁLISIS COMPLETO ---
+
+def analizar_trayectoria(fuentes, topologia=None, n_modes=20, solver='auto', top=5, betas=None,
+                         cada=1, max_fotogramas=None, caliente=True, verbose=True):
+    """
+    ANM por fotograma con estadísticas en streaming. `betas` fija la referencia
+    experimental (p.ej. la estructura cristalina); por defecto se usan las de
+    cada fotograma (getBetas()). Con caliente=True cada fotograma siembra el
+    eigensolver del siguiente.
+    """
+    from prody import calcSqFlucts
+    from vally_solver import calcular_modos, SerieModos
+
+    serie = SerieModos() if caliente else None
+    estadisticas, primero = None, None
+    for k, calpha in enumerate(iterar_fotogramas(fuentes, topologia)):
+        if k % cada:
+            continue
+        if max_fotogramas is not None and estadisticas is not None and estadisticas.n >= max_fotogramas:
+            break
+        if estadisticas is None:
+            primero = calpha
+            estadisticas = EstadisticasTrayectoria(calpha.numAtoms(), betas, top)
+        # Sin caché en disco: miles de fotogramas únicos sólo la llenarían
+        anm, info = calcular_modos(calpha, n_modes=n_modes, solver=solver, nombre=f"frame {k}", cache=False,
+                                   serie=serie)
+        estadisticas.actualizar(calcSqFlucts(anm), calpha.getBetas())
+        if verbose:
+            print(f"--> [FRAME {k}] {info['solver']}/{info['metodo']} ({info['arranque']}) "
+                  f"| r = {estadisticas.pearson_fotogramas[-1]:.3f} "
+                  f"| r(media acumulada) = {estadisticas.pearson_media[-1]:.3f}")
+        del anm
+
+    if estadisticas is None:
+        raise ValueError("La fuente no contiene fotogramas con Cα")
+    resultado = estadisticas.resultado()
+    resultado.update(resnums=primero.getResnums(), resnames=primero.getResnames(), chids=primero.getChids())
+    return resultado
+
+def guardar_resultado(resultado, nombre, directorio=DIRECTORIO_TRAYECTORIAS):
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f"{nombre}_stats.npz")
+    np.savez(ruta, **resultado)
+    return ruta
+
+def imprimir_resumen(resultado, top=10):
+    r = resultado['pearson_fotogramas']
+    validos = r[~np.isnan(r)]
+    print("\n" + "=" * 55)
+    print(f" TRAYECTORIA | {resultado['n_fotogramas']} fotogramas")
+    print("=" * 55)
+    if len(validos):
+        print(f"Pearson por fotograma: {validos.mean():.3f} ± {validos.std():.3f} "
+              f"(min {validos.min():.3f}, max {validos.max():.3f})")
+        print(f"Pearson de la MSF media: {resultado['pearson_media_acumulada'][-1]:.3f}")
+    else:
+        print("Pearson no disponible (B-factors constantes; usa --betas-de con la estructura cristalina)")
+    print("Residuos más frecuentes entre los hotspots:")
+    for i in np.argsort(resultado['frecuencia_hotspots'])[::-1][:top]:
+        if resultado['frecuencia_hotspots'][i] == 0:
+            break
+        print(f"  {resultado['resnames'][i]} {resultado['resnums'][i]} ({resultado['chids'][i]}): "
+              f"{resultado['frecuencia_hotspots'][i]:.0%} | MSF {resultado['msf_media'][i]:.3f} "
+              f"± {np.sqrt(resultado['msf_varianza'][i]):.3f}")
+    print("=" * 55)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="vally traj",
+                                     description="ANM por fotograma de ensamblajes RMN, multi-modelo o trayectorias.")
+    parser.add_argument('fuentes', nargs='+', help="PDB/mmCIF multi-modelo, directorio de snapshots o DCD.")
+    parser.add_argument('--topologia', help="PDB de topología para archivos DCD.")
+    parser.add_argument('--betas-de', metavar='PDB', help="Estructura cuyos B-factors sirven de referencia.")
+    parser.add_argument('--modos', type=int, default=20)
+    parser.add_argument('--solver', choices=['auto', 'dense', 'sparse', 'rtb'], default='auto')
+    parser.add_argument('--top', type=int, default=5, help="Hotspots contados por fotograma.")
+    parser.add_argument('--cada', type=int, default=1, help="Analizar uno de cada K fotogramas.")
+    parser.add_argument('--max-fotogramas', type=int)
+    parser.add_argument('--frio', action='store_true', help="No sembrar cada fotograma con los modos del anterior.")
+    args = parser.parse_args(argv)
+
+    betas = None
+    if args.betas_de:
+        from vally_io import leer_calpha
+        betas = leer_calpha(args.betas_de).getBetas()
+    resultado = analizar_trayectoria(args.fuentes, args.topologia, args.modos, args.solver, args.top,
+                                     betas, args.cada, args.max_fotogramas, caliente=not args.frio)
+    imprimir_resumen(resultado)
+    nombre = os.path.splitext(os.path.basename(os.path.normpath(args.fuentes[0])))[0]
+    print(f"Estadísticas guardadas: {guardar_resultado(resultado, nombre)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())